@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+from picdeduper import common as pdc
+from picdeduper import records as pdr
+
+import argparse
+import hashlib
+import json
+import time
+import tracemalloc
+
+CREATORS = ["Apple iPhone 11 Pro", "Apple iPhone 8", "Canon EOS 5D Mark IV", "FUJIFILM X-T3"]
+RESOLUTIONS = ["3024x4032@24", "4032x3024@24", "6720x4480@24", "6240x4160@24"]
+
+
+def synthetic_properties_json(count: int) -> str:
+    """As JSON, so every entry gets its own strings when loaded, like when loading a real index"""
+    by_path = dict()
+    for i in range(count):
+        path = f"/Volumes/Photos/{2000 + i % 24}/{i % 12 + 1:02d}/IMG_{i % 10000:04d}_{i}.JPG"
+        by_path[path] = {
+            pdc.KEY_FILE_DATE: f"20{i % 24:02d}-{i % 12 + 1:02d}-{i % 28 + 1:02d} 03:12:{i % 60:02d} +0000",
+            pdc.KEY_FILE_SIZE: str(1000000 + i * 7919 % 9000000),
+            pdc.KEY_FILE_MTIME_NS: str(1577243526000000000 + i),
+            pdc.KEY_FILE_INODE: str(1000000 + i),
+            pdc.KEY_FILE_DEVICE: "16777220",
+            pdc.KEY_FILE_HASH: hashlib.sha256(str(i).encode()).hexdigest(),
+            pdc.KEY_FILE_CORE_NAME: f"IMG_{i % 10000:04d}",
+            pdc.KEY_IMAGE_DATE: f"20{i % 24:02d}-{i % 12 + 1:02d}-{i % 28 + 1:02d} 03:12:{i % 60:02d} -0800",
+            pdc.KEY_IMAGE_RES: RESOLUTIONS[i % len(RESOLUTIONS)],
+            pdc.KEY_IMAGE_LOC: f"<+37.{i % 1000:03d},-122.{i % 997:03d}>",
+            pdc.KEY_IMAGE_CREATOR: CREATORS[i % len(CREATORS)],
+        }
+    return json.dumps(by_path)
+
+
+def measure(name: str, content: str, convert) -> None:
+    start = time.perf_counter()
+    by_path = {path: convert(properties) for path, properties in json.loads(content).items()}
+    seconds = time.perf_counter() - start
+    del by_path
+
+    tracemalloc.start()  # Slows allocations down a lot: not while timing
+    by_path = {path: convert(properties) for path, properties in json.loads(content).items()}
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_entry = current / len(by_path)
+    print(f"{name:>14}: {per_entry:7.0f} bytes/entry "
+          f"({current / 2**20:7.1f} MiB, peak {peak / 2**20:7.1f} MiB, {seconds:.2f} s)")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="""
+        Measures the memory of the index entries: PropertyDicts (dicts of strings) vs. ImageRecords.
+        """)
+
+    parser.add_argument(
+        "-n", "--entries",
+        type=int,
+        default=100000,
+        dest="entries",
+        help="Number of synthetic index entries (default: 100000)",
+    )
+
+    args = parser.parse_args()
+
+    content = synthetic_properties_json(args.entries)
+    print(f"{args.entries} entries:")
+    measure("PropertyDict", content, lambda properties: properties)
+    measure("ImageRecord", content, pdr.ImageRecord)
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,8 @@ HASHES = {
 
     "hashlib/sha3_256" : platform._file_hashlib_sha3_256_hash,
     "hashlib/sha3_512" : platform._file_hashlib_sha3_512_hash,
+
+    "quick_file_hash" : platform.quick_file_hash,
 }
 
 def preheat(path: pds.Path) -> None:
@@ -2,8 +2,19 @@
 
 from picdeduper import picdeduper as pd
 from picdeduper.indexstore import IndexStore
+from picdeduper.sqliteindexstore import SqliteIndexStore, is_sqlite_path
+from picdeduper.shardedindexstore import ShardedIndexStore, is_sharded_path
+from picdeduper import snapshot as pdsnap
+from picdeduper import merge as pdmerge
 from picdeduper import platform as pds
+from picdeduper import bloom as pdb
 from picdeduper import fingerprinting as pdf
+from picdeduper import fingerprintcache as pdfc
+from picdeduper import perceptual as pdperc
+from picdeduper import probe as pdprobe
+from picdeduper import prune as pdprune
+from picdeduper import query as pdquery
+from picdeduper import common as pdc
 from picdeduper import fixits  # TODO
 
 import argparse
@@ -12,6 +23,10 @@ import signal
 
 platform = pds.MacOSPlatform()
 fingerprinter = pdf.Fingerprinter(platform)
+METADATA_BACKENDS = {
+    "mdls": pdf.MdlsMetadataBackend,
+    "headers": pdf.HeaderMetadataBackend,
+}
 fixit_processor = fixits.CommandLineFixItProcessor()
 fixit_processor.configure_fixit_default_actions(fixits.ExactDupeFixIt, fixits.FixItSoftDeleteFileAction)
 picdeduper = pd.PicDeduper(platform, fingerprinter, fixit_processor)
@@ -26,12 +41,128 @@ def on_ctrl_c(signum, frame):
     picdeduper.should_quit = True
 
 
+def load_index_store(path: pds.Path, read_only: bool = False):
+    """With `read_only`, a journal left behind by a crashed run only gets replayed in memory"""
+    print(f"Will load IndexStore from {path} if available.")
+    if is_sqlite_path(path):
+        index_store = SqliteIndexStore.load(path, platform)
+    elif pdsnap.is_snapshot_path(path):
+        index_store = pdsnap.MappedIndexStore.load(path, platform)
+    elif is_sharded_path(path):
+        index_store = ShardedIndexStore.load(path, platform, read_only)
+    else:
+        index_store = IndexStore.load(path, platform, journaled=not read_only, read_only=read_only)
+    print("Done.")
+    return index_store
+
+
+def probe_candidates(probe_path: pds.Path, candidate_start_dir: pds.Path, json_load_path: pds.Path):
+    """Only loads the index (if any) when some candidates may be exact dupes"""
+    print(f"Loading collection probe from {probe_path}...")
+    collection_probe = pdprobe.CollectionProbe.load(probe_path, platform)
+    print(f"Done. Probe of {collection_probe.entry_count} entries.")
+
+    print(f"Probing candidates at {candidate_start_dir}...")
+    maybe_paths = picdeduper.probe_candidate_dir(collection_probe, candidate_start_dir)
+    print(f"Done. {len(maybe_paths)} candidates may be file dupes.")
+
+    if not maybe_paths or picdeduper.should_quit:
+        return
+    if not json_load_path or not platform.path_exists(json_load_path):
+        print("Pass the index of the collection (-f) to check them.")
+        return
+    index_store = load_index_store(json_load_path, read_only=True)
+    index_store.stop_persisting()  # Candidates are not part of the collection
+    print(f"Checking the {len(maybe_paths)} candidates that may be file dupes...")
+    picdeduper.evaluate_candidate_paths(index_store, maybe_paths)
+    print("Done.")
+
+
+def query_main(argv):
+
+    parser = argparse.ArgumentParser(prog="picdedupe query", description="""
+        Lists the indexed files that match every given filter, from the lookups of the index.
+        """)
+
+    parser.add_argument(
+        "-f", "--json_file",
+        required=True,
+        metavar="path_to_json_file",
+        dest="json_file_path",
+        help="Path of the index to query",
+    )
+
+    parser.add_argument(
+        "--hash",
+        metavar="file_hash",
+        dest="file_hash",
+        help="Files with that (full) hash",
+    )
+
+    parser.add_argument(
+        "--name",
+        metavar="core_filename",
+        dest="core_filename",
+        help="Files with that core filename (e.g. IMG_0001 for IMG_0001 copy 2.JPG)",
+    )
+
+    parser.add_argument(
+        "--from",
+        metavar="time_or_day",
+        dest="oldest",
+        help='Images taken at or after that time ("2019-12-25 03:12:06 +0000"), or day ("2019-12-25", UTC)',
+    )
+
+    parser.add_argument(
+        "--to",
+        metavar="time_or_day",
+        dest="newest",
+        help="Images taken at or before that time, or day (included)",
+    )
+
+    parser.add_argument(
+        "--creator",
+        metavar="creator",
+        dest="creator",
+        help='Images taken by a creator that has that in its name, in any case (e.g. "iPhone 11")',
+    )
+
+    args = parser.parse_args(argv)
+
+    try:
+        oldest = pdquery.time_bound(args.oldest, is_newest=False) if args.oldest else None
+        newest = pdquery.time_bound(args.newest, is_newest=True) if args.newest else None
+    except ValueError as e:
+        print(f"-error: Not a time or day: {e}")
+        sys.exit(1)
+
+    if not platform.path_exists(args.json_file_path):
+        print(f"-error: Cannot find {args.json_file_path}")
+        sys.exit(1)
+
+    index_store = load_index_store(args.json_file_path, read_only=True)
+    index_store.stop_persisting()  # Read-only
+
+    query = pdquery.IndexQuery(args.file_hash, args.core_filename, oldest, newest, args.creator)
+    paths = query.paths(index_store)
+    for path in paths:
+        image_properties = index_store.known_image_properties(path)
+        image_date = image_properties.get(pdc.KEY_IMAGE_DATE) or "-"
+        creator = image_properties.get(pdc.KEY_IMAGE_CREATOR) or "-"
+        print(f"{image_date}  {creator}  {path}")
+    print(f"{len(paths)} files.")
+
+
 def main():
 
     DEFAULT_JSON_FILENAME = "picdedupe.json"
 
     signal.signal(signal.SIGINT, on_ctrl_c)
 
+    if sys.argv[1:2] == ["query"]:
+        query_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="""
         Tool to figure out if new images are already in an established collection.
         
@@ -48,6 +179,8 @@ def main():
 
         Actions are proposed, or can be taken automatically, when such situations 
         are being detected.
+
+        "picdedupe query" lists what the index has: by hash, name, time or creator.
         """)
 
     parser.add_argument(
@@ -74,6 +207,29 @@ def main():
         help="[DEBUG ONLY] Path of where to save the JSON file that represents the collection",
     )
 
+    parser.add_argument(
+        "--import_json",
+        metavar="path_to_json_file",
+        dest="import_json_path",
+        help="One-shot import of a JSON index into the SQLite index given by -f/--json_file (*.sqlite, *.db)",
+    )
+
+    parser.add_argument(
+        "--convert_to",
+        metavar="path_to_index_file",
+        dest="convert_to_path",
+        help="Writes the loaded index to another file, as JSON (*.json), as a binary snapshot (*.pdidx), "
+             "or sharded by month (*.pdshards)",
+    )
+
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="path_to_json_file",
+        dest="merge_paths",
+        help="Merges JSON indexes (e.g. of other volumes) into the JSON index given by -f/--json_file",
+    )
+
     parser.add_argument(
         "-i", "--incoming_dir",
         metavar="path_to_new_images",
@@ -88,24 +244,171 @@ def main():
         help="Path to the root folder of the established collection of file we definitely want to keep",
     )
 
+    parser.add_argument(
+        "--export_probe",
+        metavar="path_to_probe_file",
+        dest="export_probe_path",
+        help="Save a collection probe (*.pdprobe): a compact filter of the index, "
+             "to tell offline which candidates are certainly not exact dupes",
+    )
+
+    parser.add_argument(
+        "--probe_fpr",
+        type=float,
+        default=pdb.DEFAULT_FALSE_POSITIVE_RATE,
+        metavar="false_positive_rate",
+        dest="probe_false_positive_rate",
+        help=f"False positive rate of the exported collection probe (default: {pdb.DEFAULT_FALSE_POSITIVE_RATE})",
+    )
+
+    parser.add_argument(
+        "--probe",
+        metavar="path_to_probe_file",
+        dest="probe_path",
+        help="Check the candidates (-i) against a collection probe first. "
+             "Only the ones it cannot rule out get checked against the index (-f), if any",
+    )
+
+    parser.add_argument(
+        "--lazy_hashing",
+        action="store_true",
+        dest="lazy_hashing",
+        help="Only hash files whose size (and then partial hash) collides with another file",
+    )
+
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        dest="prune",
+        help="Before indexing the collection (-c), take the files that are not there anymore out of the index",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        dest="force",
+        help="With --prune: prune even when no images are found in the collection (-c) at all",
+    )
+
+    parser.add_argument(
+        "--full_rescan",
+        action="store_true",
+        dest="full_rescan",
+        help="Quick-check every file of the collection, even in the directories that did not change since the last run",
+    )
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        metavar="number_of_jobs",
+        dest="jobs",
+        help="Number of files to fingerprint and hash in parallel (default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--metadata",
+        choices=sorted(METADATA_BACKENDS.keys()),
+        dest="metadata_backend",
+        help="How to read the image metadata (default: mdls on macOS, headers elsewhere)",
+    )
+
+    parser.add_argument(
+        "--phash",
+        action="store_true",
+        dest="phash",
+        help="Also compute a perceptual hash of every picture, to find similar images",
+    )
+
+    parser.add_argument(
+        "--cache_file",
+        metavar="path_to_cache_file",
+        dest="cache_file_path",
+        help="Path of a fingerprint cache, to skip the files that were fingerprinted before (even if moved)",
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=pdfc.DEFAULT_MAX_ENTRIES,
+        metavar="max_entries",
+        dest="cache_size",
+        help=f"Max number of fingerprints in the cache (default: {pdfc.DEFAULT_MAX_ENTRIES})",
+    )
+
     args = parser.parse_args()
 
     candidate_start_dir = args.candidate_start_dir
     collection_start_dir = args.collection_start_dir
     json_load_path = args.debug_json_load_file_path or args.json_file_path
     json_save_path = args.debug_json_save_file_path or args.json_file_path
+    picdeduper.lazy_hashing = args.lazy_hashing
+    picdeduper.skip_unchanged_dirs = not args.full_rescan
+    if args.metadata_backend:
+        fingerprinter.metadata_backend = METADATA_BACKENDS[args.metadata_backend](platform)
+    if args.phash:
+        fingerprinter.perceptual_hasher = pdperc.PerceptualHasher(platform)
+    if args.cache_file_path:
+        fingerprinter.cache = pdfc.FingerprintCache.load(args.cache_file_path, platform, args.cache_size)
+    if args.jobs:
+        picdeduper.jobs = args.jobs
+        platform.file_hasher().max_workers = args.jobs
+
+    if args.probe_path:
+        if not candidate_start_dir:
+            print("-error: --probe needs candidates (-i)")
+            sys.exit(1)
+        probe_candidates(args.probe_path, candidate_start_dir, json_load_path)
+        return
 
     if not json_load_path or not json_save_path:
         print("-error: the following arguments are required: -f/--json_file")
         sys.exit(1)
 
-    if not collection_start_dir and json_load_path and not platform.path_exists(json_load_path):
+    if args.import_json_path and not is_sqlite_path(json_load_path):
+        print(f"-error: --import_json needs a SQLite index (*.sqlite, *.db), not {json_load_path}")
+        sys.exit(1)
+
+    if args.merge_paths and (is_sqlite_path(json_load_path) or pdsnap.is_snapshot_path(json_load_path) or
+                             is_sharded_path(json_load_path)):
+        print(f"-error: --merge needs a JSON index (*.json), not {json_load_path}")
+        sys.exit(1)
+
+    if args.merge_paths:
+        merge_paths = args.merge_paths
+        if platform.path_exists(json_load_path):
+            IndexStore.load(json_load_path, platform, journaled=True)  # Replays what a crashed run left behind
+            merge_paths = [json_load_path] + merge_paths
+        merged_index_store = pdmerge.merge_index_files(merge_paths, platform)
+        print(f"Saving merged IndexStore to {json_save_path}...")
+        merged_index_store.save(json_save_path)
+        json_load_path = json_save_path
+        print("Done.")
+
+    if not collection_start_dir and not args.import_json_path and not platform.path_exists(json_load_path):
         print(f"-error: Cannot find {json_load_path}")
         sys.exit(1)
 
-    print(f"Will load IndexStore from {json_load_path} if available.")
-    index_store = IndexStore.load(json_load_path, platform)
-    print("Done.")
+    index_store = load_index_store(json_load_path)
+
+    if args.import_json_path:
+        print(f"Importing {args.import_json_path}...")
+        count = index_store.import_json(args.import_json_path)
+        print(f"Done. Imported {count} entries.")
+
+    if args.convert_to_path:
+        print(f"Converting IndexStore to {args.convert_to_path}...")
+        pdsnap.save_index(index_store, args.convert_to_path)
+        print("Done.")
+
+    if args.prune and collection_start_dir and not picdeduper.should_quit:
+        print(f"Pruning the files that are not in {collection_start_dir} anymore...")
+        stale_paths = pdprune.prune_index(index_store, platform, collection_start_dir, args.force)
+        print(f"Done. Pruned {len(stale_paths)} entries.")
+
+    if args.export_probe_path:
+        print(f"Building collection probe of {len(index_store)} entries...")
+        picdeduper.collection_probe = pdprobe.CollectionProbe.of(index_store, args.probe_false_positive_rate)
+        print("Done.")
 
     if collection_start_dir and not picdeduper.should_quit:
         print(f"Indexing collection at {collection_start_dir}...")
@@ -117,11 +420,27 @@ def main():
         index_store.save(json_save_path)
         print("Done.")
 
+    if picdeduper.collection_probe is not None:
+        print(f"Saving collection probe to {args.export_probe_path}...")
+        picdeduper.collection_probe.save(args.export_probe_path, platform)
+        picdeduper.collection_probe = None  # Candidates are not part of the collection
+        print("Done.")
+
     if candidate_start_dir and not picdeduper.should_quit:
+        index_store.stop_persisting()  # Candidates are not part of the collection
         print(f"Checking candidates at {candidate_start_dir}...")
         picdeduper.evaluate_candidate_dir(index_store, candidate_start_dir)
         print("Done.")
 
+    if fingerprinter.cache is not None:
+        print(fingerprinter.cache.summary())
+        print(f"Saving fingerprint cache to {args.cache_file_path}...")
+        fingerprinter.cache.save(args.cache_file_path)
+        print("Done.")
+
+    if fingerprinter.perceptual_hasher:
+        print(fingerprinter.perceptual_hasher.summary())
+
 
 if __name__ == "__main__":
     main()
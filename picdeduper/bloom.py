@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import math
+
+from typing import Dict, Iterable, Iterator
+
+from picdeduper import jsonable
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A Bloom filter: a compact summary of a set of strings, that answers
+#  "certainly not in there" or "maybe in there".
+#
+#  Every value sets `hash_count` bits, derived from one BLAKE2b digest
+#  (double hashing: bit i = h1 + i * h2). With the bit & hash counts of
+#  for_capacity(), about `false_positive_rate` of the values that are not in
+#  there still get a "maybe". Values that are in there always do.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+KEY_JSON_BITS = "bits"
+KEY_JSON_HASH_COUNT = "hashes"
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+class BloomFilter(jsonable.Jsonable):
+
+    def __init__(self, bit_count: int, hash_count: int, bits: bytearray = None) -> None:
+        byte_count = max(1, (bit_count + 7) // 8)
+        self.bit_count = byte_count * 8
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray(byte_count)
+
+    def for_capacity(capacity: int, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE):
+        """A filter that is about `false_positive_rate` wrong when it holds `capacity` values"""
+        capacity = max(1, capacity)
+        bit_count = math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        return BloomFilter(bit_count, hash_count)
+
+    def of(values: Iterable[str], capacity: int, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE):
+        output = BloomFilter.for_capacity(capacity, false_positive_rate)
+        output.update(values)
+        return output
+
+    def _bit_indexes(self, value: str) -> Iterator[int]:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, value: str):
+        for index in self._bit_indexes(value):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def update(self, values: Iterable[str]):
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[index >> 3] & (1 << (index & 7)) for index in self._bit_indexes(value))
+
+    def __eq__(self, rhs: object) -> bool:
+        return self.hash_count == rhs.hash_count and self.bits == rhs.bits
+
+    def jsonable_encode(self) -> Dict:
+        return {
+            KEY_JSON_BITS: base64.b64encode(bytes(self.bits)).decode("ascii"),
+            KEY_JSON_HASH_COUNT: self.hash_count,
+        }
+
+    def jsonable_decode(val: Dict):
+        bits = bytearray(base64.b64decode(val[KEY_JSON_BITS]))
+        return BloomFilter(len(bits) * 8, val[KEY_JSON_HASH_COUNT], bits)
@@ -4,7 +4,11 @@ PropertyDict = Dict[str, str]
 
 KEY_FILE_DATE = "file_date"
 KEY_FILE_SIZE = "file_size"
+KEY_FILE_MTIME_NS = "file_mtime_ns"
+KEY_FILE_INODE = "file_inode"
+KEY_FILE_DEVICE = "file_device"
 KEY_FILE_HASH = "file_hash"
+KEY_FILE_PARTIAL_HASH = "file_partial_hash"  # only of the head & tail of the file
 KEY_FILE_SECOND_HASH = "file_second_hash"
 KEY_FILE_CORE_NAME = "file_core_name"  # 'IMG_1234' for 'IMG_1233 copy 1.jpg'
 KEY_IMAGE_DATE = "image_date"
@@ -13,11 +17,14 @@ KEY_IMAGE_LOC = "image_loc"
 KEY_IMAGE_CREATOR = "image_creator"
 KEY_IMAGE_ANGLES = "image_angles"
 KEY_IMAGE_CAMSET = "image_camset"
+KEY_IMAGE_PHASH = "image_phash"  # perceptual hash, as 16 hex digits
 
 KEY_BY_PATH = "by_path"
 KEY_BY_HASH = "by_hash"
 KEY_BY_FILENAME = "by_filename"
 KEY_BY_SERIES = "by_series"
+KEY_BY_PHASH = "by_phash"
+KEY_BY_DIR = "by_dir"
 KEY_IMAGE_DATE_STATS = "image_date_stats"
 KEY_OLDEST = "oldest"
 KEY_NEWEST = "newest"
@@ -0,0 +1,95 @@
+import hashlib
+
+from typing import Callable, Dict, Iterator
+
+from picdeduper import images
+from picdeduper import jsonable
+from picdeduper import platform as pds
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A summary of the images of a directory, to tell whether any of them
+#  changed since the last run without quick-checking them one by one:
+#
+#     mtime       of the directory itself: files got added, removed, renamed
+#     children    the number of images in it
+#     digest      SHA-1 over the sorted (name, size, mtime) of its images
+#
+#  A file that gets modified in place leaves the directory mtime as it was,
+#  so every image still gets stat'ed, from a single scan of its directory.
+#  But none of the images of a directory with the same summary get looked
+#  up in the index, fingerprinted or even queued.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+KEY_JSON_MTIME_NS = "mtime_ns"
+KEY_JSON_CHILD_COUNT = "children"
+KEY_JSON_DIGEST = "digest"
+
+DirectorySummaries = Dict[pds.Path, "DirectorySummary"]
+DirectorySummaryGetter = Callable[[pds.Path], "DirectorySummary"]
+
+
+class DirectorySummary(jsonable.Jsonable):
+
+    def __init__(self, mtime_ns: int, child_count: int, digest: str) -> None:
+        self.mtime_ns = mtime_ns
+        self.child_count = child_count
+        self.digest = digest
+
+    def of(dir_stat: pds.FileStat, image_stats: Dict[pds.Filename, pds.FileStat]):
+        digest = hashlib.sha1()
+        for filename in sorted(image_stats):
+            file_stat = image_stats[filename]
+            digest.update(f"{filename}\0{file_stat.size}\0{file_stat.mtime_ns}\n".encode("utf-8"))
+        return DirectorySummary(dir_stat.mtime_ns, len(image_stats), digest.hexdigest())
+
+    def __eq__(self, rhs: object) -> bool:
+        return (
+            isinstance(rhs, DirectorySummary) and
+            self.mtime_ns == rhs.mtime_ns and
+            self.child_count == rhs.child_count and
+            self.digest == rhs.digest
+        )
+
+    def __repr__(self) -> str:
+        return f"DirectorySummary({self.mtime_ns}, {self.child_count}, {self.digest!r})"
+
+    def jsonable_encode(self) -> Dict:
+        return {
+            KEY_JSON_MTIME_NS: self.mtime_ns,
+            KEY_JSON_CHILD_COUNT: self.child_count,
+            KEY_JSON_DIGEST: self.digest,
+        }
+
+    def jsonable_decode(val: Dict):
+        return DirectorySummary(val[KEY_JSON_MTIME_NS], val[KEY_JSON_CHILD_COUNT], val[KEY_JSON_DIGEST])
+
+
+def iter_changed_image_paths(platform: pds.Platform,
+                             start_dir: pds.Path,
+                             known_summary_of: DirectorySummaryGetter,
+                             summaries: DirectorySummaries) -> Iterator[pds.Path]:
+    """
+    Same as images.iter_image_paths(), minus the images of the directories whose summary is
+    still what `known_summary_of(dir_path)` returns. The summaries of every walked directory go into `summaries`.
+    NOTE: Only record those once all the yielded images got indexed: until then, they did not change in the index.
+    """
+    dir_paths = [start_dir]
+    while dir_paths:
+        dir_path = dir_paths.pop()
+        subdirs, file_stats = platform.dir_entries(dir_path)
+        image_stats = {filename: file_stat for filename, file_stat in file_stats.items()
+                       if images.is_image_filename(filename)}
+        summary = DirectorySummary.of(platform.file_stat(dir_path), image_stats)
+        summaries[dir_path] = summary
+        if summary == known_summary_of(dir_path):
+            print(f"Skipping untouched directory: {dir_path}")
+        else:
+            for filename in pds.sorted_filenames(file_stats):
+                path = dir_path + "/" + filename
+                if not filename in image_stats:
+                    print(f"Skipping non-image: {path}")
+                    continue
+                yield path
+        dir_paths.extend(dir_path + "/" + subdir for subdir in sorted(subdirs, reverse=True))
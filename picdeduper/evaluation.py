@@ -1,14 +1,26 @@
 from picdeduper import common as pdc
-from picdeduper.indexstore import IndexStore
+from picdeduper.indexstore import BaseIndexStore
 from picdeduper import platform as pds
 from picdeduper import time as pdt
 
+# Max number of different bits between the perceptual hashes of similar images:
+SIMILAR_IMAGE_MAX_DISTANCE = 8
+
+# Derived from the content of a file: stale once its quick signature changed
+FILE_CONTENT_KEYS = [
+    pdc.KEY_FILE_HASH,
+    pdc.KEY_FILE_PARTIAL_HASH,
+    pdc.KEY_FILE_SECOND_HASH,
+    pdc.KEY_IMAGE_PHASH,
+]
+
 
 class EvaluationResult:
     def __init__(self) -> None:
         self.same_core_filename = set()
         self.same_hash = set()
         self.same_image_properties = set()
+        self.similar_image = dict()  # path -> Hamming distance of the perceptual hashes
         self.incorrect_time_tuple = None  # (file_date, image_date)
 
     def add_same_filename(self, path: pds.Path):
@@ -20,6 +32,9 @@ class EvaluationResult:
     def add_same_image_properties(self, path: pds.Path):
         self.same_image_properties.add(path)
 
+    def add_similar_image(self, path: pds.Path, distance: int):
+        self.similar_image[path] = distance
+
     def paths_with_same_core_filename(self) -> pds.PathSet:
         return self.same_core_filename
 
@@ -29,6 +44,9 @@ class EvaluationResult:
     def paths_with_same_image_properties(self) -> pds.PathSet:
         return self.same_image_properties
 
+    def paths_with_similar_image(self) -> pds.PathSet:
+        return set(self.similar_image)
+
     def set_incorrect_file_time(self, file_timestamp: pdt.Timestamp, image_timestamp: pdt.Timestamp) -> None:
         self.incorrect_time_tuple = (file_timestamp, image_timestamp)
 
@@ -41,6 +59,9 @@ class EvaluationResult:
     def has_image_property_dupes(self) -> bool:
         return 0 != len(self.same_image_properties)
 
+    def has_similar_images(self) -> bool:
+        return 0 != len(self.similar_image)
+
     def has_incorrect_file_time(self) -> bool:
         return self.incorrect_time_tuple != None
 
@@ -49,6 +70,7 @@ class EvaluationResult:
             self.has_core_filename_dupes() or
             self.has_hash_dupes() or
             self.has_image_property_dupes() or
+            self.has_similar_images() or
             False)
 
 
@@ -56,25 +78,44 @@ def _is_equal_property(key: str, a: pdc.PropertyDict, b: pdc.PropertyDict) -> bo
     return ((key in a) == (key in b)) and (a[key] == b[key])
 
 
+def is_legacy_quick_signature(signature: pdc.PropertyDict) -> bool:
+    """Entries indexed before we used stat() only have a file size & (second precision) date."""
+    return not pdc.KEY_FILE_MTIME_NS in signature
+
+
 def is_quick_signature_equal(a: pdc.PropertyDict, b: pdc.PropertyDict) -> bool:
     """
     Does a limited, but quick check to see if this file changed since last time.
+    NOTE: The device is not compared, because it is not stable across (re)mounts.
     """
     if not _is_equal_property(pdc.KEY_FILE_SIZE, a, b):
         return False
-    if not _is_equal_property(pdc.KEY_FILE_DATE, a, b):
+    if is_legacy_quick_signature(a) or is_legacy_quick_signature(b):
+        return pdt.time_strings_are_same_time(a.get(pdc.KEY_FILE_DATE), b.get(pdc.KEY_FILE_DATE))
+    if not _is_equal_property(pdc.KEY_FILE_MTIME_NS, a, b):
+        return False
+    if not _is_equal_property(pdc.KEY_FILE_INODE, a, b):
         return False
     return True
 
 
-def _is_likely_same_image(a: pdc.PropertyDict, b: pdc.PropertyDict) -> bool:
-    return (
-        _is_equal_property(pdc.KEY_IMAGE_RES, a, b) and
-        _is_equal_property(pdc.KEY_IMAGE_DATE, a, b) and
-        _is_equal_property(pdc.KEY_IMAGE_CREATOR, a, b) and
-        _is_equal_property(pdc.KEY_IMAGE_LOC, a, b) and
-        _is_equal_property(pdc.KEY_IMAGE_ANGLES, a, b) and
-        True)
+def _image_quality_tuple(image_properties: pdc.PropertyDict):
+    """(pixel count, bits per sample, file size), from e.g. '3024x4032@24'"""
+    pixels, bits = 0, 0
+    res = image_properties.get(pdc.KEY_IMAGE_RES)
+    if res:
+        dims, _, bits_str = res.partition("@")
+        height, _, width = dims.partition("x")
+        pixels = int(height) * int(width)
+        bits = int(bits_str) if bits_str else 0
+    return (pixels, bits, int(image_properties.get(pdc.KEY_FILE_SIZE) or 0))
+
+
+def compare_image_quality(a: pdc.PropertyDict, b: pdc.PropertyDict) -> int:
+    """Returns 1 if `a` looks like the better quality version of `b`, -1 if worse, 0 if it cannot tell"""
+    quality_a = _image_quality_tuple(a)
+    quality_b = _image_quality_tuple(b)
+    return (quality_a > quality_b) - (quality_a < quality_b)
 
 
 def is_consistent_time(image_properties: pdc.PropertyDict) -> bool:
@@ -85,25 +126,35 @@ def is_consistent_time(image_properties: pdc.PropertyDict) -> bool:
         image_properties[pdc.KEY_FILE_DATE])
 
 
-def evaluate(candidate_image_path: pds.Path, candidate_image_properties: pdc.PropertyDict, index_store: IndexStore) -> EvaluationResult:
+def evaluate(candidate_image_path: pds.Path, candidate_image_properties: pdc.PropertyDict,
+             index_store: BaseIndexStore) -> EvaluationResult:
     result = EvaluationResult()
 
-    candidate_hash = candidate_image_properties[pdc.KEY_FILE_HASH]
+    # Size -> partial hash -> full hash. Only hashes what could actually be a dupe.
+    index_store.resolve_hash_collisions(candidate_image_path, candidate_image_properties)
+
+    candidate_hash = candidate_image_properties.get(pdc.KEY_FILE_HASH)
     candidate_core_filename = candidate_image_properties[pdc.KEY_FILE_CORE_NAME]
 
-    if candidate_hash in index_store.by_hash:
+    if candidate_hash:
         result.paths_with_same_hash().update(
-            index_store.by_hash[candidate_hash])
+            index_store.paths_with_hash(candidate_hash))
+
+    result.paths_with_same_core_filename().update(
+        index_store.paths_with_core_filename(candidate_core_filename))
 
-    if candidate_core_filename in index_store.by_core_filename:
-        result.paths_with_same_core_filename().update(
-            index_store.by_core_filename[candidate_core_filename])
+    candidate_phash = candidate_image_properties.get(pdc.KEY_IMAGE_PHASH)
+    if candidate_phash:
+        similar = index_store.paths_with_similar_phash(candidate_phash, SIMILAR_IMAGE_MAX_DISTANCE)
+        for other_image_path, distance in similar.items():
+            if other_image_path == candidate_image_path or other_image_path in result.paths_with_same_hash():
+                continue
+            result.add_similar_image(other_image_path, distance)
 
-    for other_image_path, other_image_properties in index_store.by_path.items():
+    for other_image_path in index_store.paths_with_image_properties(candidate_image_properties):
         if other_image_path == candidate_image_path:
             continue
-        if _is_likely_same_image(candidate_image_properties, other_image_properties):
-            result.add_same_image_properties(other_image_path)
+        result.add_same_image_properties(other_image_path)
 
     if not is_consistent_time(candidate_image_properties):
         file_ts = pdt.timestamp_from_string(candidate_image_properties[pdc.KEY_FILE_DATE])
@@ -0,0 +1,325 @@
+import struct
+
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Dict, Tuple
+
+from picdeduper import common as pdc
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A minimal EXIF reader, so we do not need `mdls` (or macOS) for metadata.
+#
+#  It only reads the JPEG segments in front of the image data (typically a
+#  few tens of KiB), and returns the same kMDItem* keys that mdls would.
+#
+#  https://www.cipa.jp/std/documents/e/DC-X008-Translation-2019-E.pdf
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+IFD = Dict[int, object]
+
+# IFD0 tags:
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_SOFTWARE = 0x0131
+TAG_DATE_TIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+
+# Exif IFD tags:
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME = 0x9010
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_FOCAL_LENGTH = 0x920A
+TAG_PIXEL_X_DIMENSION = 0xA002
+TAG_PIXEL_Y_DIMENSION = 0xA003
+
+# GPS IFD tags:
+TAG_GPS_LATITUDE_REF = 0x01
+TAG_GPS_LATITUDE = 0x02
+TAG_GPS_LONGITUDE_REF = 0x03
+TAG_GPS_LONGITUDE = 0x04
+TAG_GPS_ALTITUDE_REF = 0x05
+TAG_GPS_ALTITUDE = 0x06
+TAG_GPS_IMG_DIRECTION = 0x11
+TAG_GPS_DEST_BEARING = 0x18
+
+# IFD1 (thumbnail) tags:
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+
+# TIFF field type -> (struct format, size in bytes)
+TIFF_TYPES = {
+    1: ("B", 1),    # BYTE
+    2: ("s", 1),    # ASCII
+    3: ("H", 2),    # SHORT
+    4: ("L", 4),    # LONG
+    5: ("LL", 8),   # RATIONAL
+    7: ("s", 1),    # UNDEFINED
+    9: ("l", 4),    # SLONG
+    10: ("ll", 8),  # SRATIONAL
+}
+
+# JPEG markers:
+MARKER_SOI = 0xD8
+MARKER_EOI = 0xD9
+MARKER_SOS = 0xDA
+MARKER_APP1 = 0xE1
+MARKERS_SOF = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+EXIF_HEADER = b"Exif\x00\x00"
+
+
+class ExifError(Exception):
+    pass
+
+
+class TiffData:
+    """The IFDs we care about, as {tag: value}. Offsets are relative to the TIFF header."""
+
+    def __init__(self) -> None:
+        self.ifd0: IFD = dict()
+        self.exif: IFD = dict()
+        self.gps: IFD = dict()
+        self.ifd1: IFD = dict()
+        self.raw: bytes = b""
+
+
+def _read_value(data: bytes, byte_order: str, field_type: int, count: int, value_offset: int):
+    fmt, size = TIFF_TYPES[field_type]
+    if value_offset + size * count > len(data):
+        raise ExifError("Value out of bounds")
+    if fmt == "s":
+        raw = data[value_offset:value_offset + count]
+        if field_type == 2:
+            return raw.split(b"\x00", 1)[0].decode("utf-8", errors="replace").strip()
+        return raw
+    values = struct.unpack_from(byte_order + fmt * count, data, value_offset)
+    if len(fmt) == 2:  # (S)RATIONAL
+        values = tuple((values[i] / values[i + 1]) if values[i + 1] else 0. for i in range(0, len(values), 2))
+    return values[0] if count == 1 else values
+
+
+def _read_ifd(data: bytes, byte_order: str, offset: int) -> Tuple[IFD, int]:
+    """Returns the {tag: value} of the IFD at `offset`, and the offset of the next IFD."""
+    if offset + 2 > len(data):
+        raise ExifError("IFD out of bounds")
+    (count,) = struct.unpack_from(byte_order + "H", data, offset)
+    ifd: IFD = dict()
+    for i in range(count):
+        entry_offset = offset + 2 + 12 * i
+        if entry_offset + 12 > len(data):
+            break
+        tag, field_type, value_count = struct.unpack_from(byte_order + "HHL", data, entry_offset)
+        if not field_type in TIFF_TYPES:
+            continue
+        size = TIFF_TYPES[field_type][1] * value_count
+        if size <= 4:
+            value_offset = entry_offset + 8
+        else:
+            (value_offset,) = struct.unpack_from(byte_order + "L", data, entry_offset + 8)
+        try:
+            ifd[tag] = _read_value(data, byte_order, field_type, value_count, value_offset)
+        except ExifError:
+            continue
+    next_offset_at = offset + 2 + 12 * count
+    next_offset = 0
+    if next_offset_at + 4 <= len(data):
+        (next_offset,) = struct.unpack_from(byte_order + "L", data, next_offset_at)
+    return ifd, next_offset
+
+
+def _sub_ifd_offset(ifd: IFD, tag: int) -> int:
+    """The offset that `tag` points to a sub-IFD at: a single number, or it is no offset at all"""
+    offset = ifd[tag]
+    if not isinstance(offset, int):
+        raise ExifError(f"Bad sub-IFD offset of tag {tag:#06x}")
+    return offset
+
+
+def parse_tiff(data: bytes) -> TiffData:
+    """Parses the TIFF structure that holds the EXIF data (the part after b'Exif\\0\\0')"""
+    if data[:2] == b"II":
+        byte_order = "<"
+    elif data[:2] == b"MM":
+        byte_order = ">"
+    else:
+        raise ExifError("Not a TIFF header")
+    if len(data) < 8:
+        raise ExifError("Truncated TIFF header")
+    magic, ifd0_offset = struct.unpack_from(byte_order + "HL", data, 2)
+    if magic != 42:
+        raise ExifError("Not a TIFF header")
+    tiff = TiffData()
+    tiff.raw = data
+    tiff.ifd0, ifd1_offset = _read_ifd(data, byte_order, ifd0_offset)
+    if TAG_EXIF_IFD in tiff.ifd0:
+        tiff.exif, _ = _read_ifd(data, byte_order, _sub_ifd_offset(tiff.ifd0, TAG_EXIF_IFD))
+    if TAG_GPS_IFD in tiff.ifd0:
+        tiff.gps, _ = _read_ifd(data, byte_order, _sub_ifd_offset(tiff.ifd0, TAG_GPS_IFD))
+    if ifd1_offset:
+        try:
+            tiff.ifd1, _ = _read_ifd(data, byte_order, ifd1_offset)
+        except ExifError:
+            pass
+    return tiff
+
+
+def thumbnail_of_tiff(tiff: TiffData) -> bytes:
+    """Returns the JPEG thumbnail that IFD1 points to (typically 160x120), or None"""
+    offset = tiff.ifd1.get(TAG_THUMBNAIL_OFFSET)
+    length = tiff.ifd1.get(TAG_THUMBNAIL_LENGTH)
+    if not offset or not length or offset + length > len(tiff.raw):
+        return None
+    thumbnail = tiff.raw[offset:offset + length]
+    if not thumbnail.startswith(bytes([0xFF, MARKER_SOI])):
+        return None
+    return thumbnail
+
+
+class JpegHeader:
+    """What we read from the segments in front of the JPEG image data"""
+
+    def __init__(self) -> None:
+        self.exif: bytes = None     # The TIFF part of the APP1 Exif segment
+        self.height: int = None
+        self.width: int = None
+        self.bits_per_sample: int = None
+
+
+def read_jpeg_header(f: BinaryIO) -> JpegHeader:
+    """
+    Walks the JPEG segments until the image data starts (SOS), only reading
+    the APP1 (Exif) and SOF (dimensions) segments, and seeking past the rest.
+    """
+    header = JpegHeader()
+    if f.read(2) != bytes([0xFF, MARKER_SOI]):
+        raise ExifError("Not a JPEG")
+    while True:
+        marker_bytes = f.read(2)
+        if len(marker_bytes) < 2 or marker_bytes[0] != 0xFF:
+            break
+        marker = marker_bytes[1]
+        if marker == 0xFF:  # Fill byte
+            f.seek(-1, 1)
+            continue
+        if marker in (MARKER_SOS, MARKER_EOI):
+            break
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            break
+        (length,) = struct.unpack(">H", length_bytes)
+        if length < 2:  # It counts its own 2 bytes
+            raise ExifError(f"Bad length of segment {marker:#04x}")
+        if marker == MARKER_APP1 and header.exif is None:
+            payload = f.read(length - 2)
+            if payload.startswith(EXIF_HEADER):
+                header.exif = payload[len(EXIF_HEADER):]
+        elif marker in MARKERS_SOF:
+            payload = f.read(length - 2)
+            if len(payload) >= 6:
+                precision, height, width, components = struct.unpack_from(">BHHB", payload)
+                header.height = height
+                header.width = width
+                header.bits_per_sample = precision * components
+        else:
+            f.seek(length - 2, 1)
+    return header
+
+
+def _ascii_string(value) -> str:
+    """The value of an ASCII tag, or None when the tag has another type"""
+    return value if isinstance(value, str) else None
+
+
+def _number_string(value) -> str:
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if not isinstance(value, (int, float)):
+        return None
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.10g}"
+
+
+def _time_string(exif_time: str, offset: str) -> str:
+    """
+    'YYYY:MM:DD HH:MM:SS' (+ '+HH:MM' offset) to our 'YYYY-MM-DD HH:MM:SS +0000' (in UTC, like mdls).
+    Without an offset, the time is taken as local time, like Spotlight does.
+    """
+    if not exif_time or not isinstance(exif_time, str):
+        return None
+    try:
+        local = datetime.strptime(exif_time[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    if offset and isinstance(offset, str) and len(offset) >= 6 and offset[0] in "+-":
+        try:
+            sign = -1 if offset[0] == "-" else 1
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+            local = local.replace(tzinfo=timezone(sign * delta))
+        except ValueError:
+            pass
+    if local.tzinfo is None:
+        local = local.astimezone()
+    return local.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S +0000")
+
+
+def _degrees(dms, ref: str, negative_ref: str) -> float:
+    if not isinstance(dms, tuple) or len(dms) != 3:
+        return None
+    degrees = dms[0] + dms[1] / 60. + dms[2] / 3600.
+    if ref == negative_ref:
+        degrees = -degrees
+    return degrees
+
+
+def _put(output: pdc.PropertyDict, key: str, value) -> None:
+    if value is None or value == "":
+        return
+    output[key] = value
+
+
+def mdls_properties_from_tiff(tiff: TiffData) -> pdc.PropertyDict:
+    """Maps the EXIF tags onto the kMDItem* keys that mdls uses for the same data."""
+    output: pdc.PropertyDict = dict()
+    _put(output, "kMDItemContentModificationDate",
+         _time_string(tiff.ifd0.get(TAG_DATE_TIME), tiff.exif.get(TAG_OFFSET_TIME)))
+    _put(output, "kMDItemContentCreationDate",
+         _time_string(tiff.exif.get(TAG_DATE_TIME_ORIGINAL), tiff.exif.get(TAG_OFFSET_TIME_ORIGINAL)))
+    _put(output, "kMDItemAcquisitionModel", _ascii_string(tiff.ifd0.get(TAG_MODEL)))
+    _put(output, "kMDItemCreator", _ascii_string(tiff.ifd0.get(TAG_SOFTWARE)))
+    _put(output, "kMDItemPixelHeight", _number_string(tiff.exif.get(TAG_PIXEL_Y_DIMENSION)))
+    _put(output, "kMDItemPixelWidth", _number_string(tiff.exif.get(TAG_PIXEL_X_DIMENSION)))
+    latitude = _degrees(tiff.gps.get(TAG_GPS_LATITUDE), tiff.gps.get(TAG_GPS_LATITUDE_REF), "S")
+    longitude = _degrees(tiff.gps.get(TAG_GPS_LONGITUDE), tiff.gps.get(TAG_GPS_LONGITUDE_REF), "W")
+    _put(output, "kMDItemLatitude", _number_string(latitude))
+    _put(output, "kMDItemLongitude", _number_string(longitude))
+    altitude = tiff.gps.get(TAG_GPS_ALTITUDE)
+    if isinstance(altitude, (int, float)) and tiff.gps.get(TAG_GPS_ALTITUDE_REF) in (1, b"\x01"):
+        altitude = -altitude
+    _put(output, "kMDItemAltitude", _number_string(altitude))
+    _put(output, "kMDItemImageDirection", _number_string(tiff.gps.get(TAG_GPS_IMG_DIRECTION)))
+    _put(output, "kMDItemGPSDestBearing", _number_string(tiff.gps.get(TAG_GPS_DEST_BEARING)))
+    _put(output, "kMDItemExposureTimeSeconds", _number_string(tiff.exif.get(TAG_EXPOSURE_TIME)))
+    _put(output, "kMDItemFNumber", _number_string(tiff.exif.get(TAG_F_NUMBER)))
+    _put(output, "kMDItemFocalLength", _number_string(tiff.exif.get(TAG_FOCAL_LENGTH)))
+    return output
+
+
+def mdls_properties_of_jpeg(f: BinaryIO) -> pdc.PropertyDict:
+    header = read_jpeg_header(f)
+    output: pdc.PropertyDict = dict()
+    if header.exif:
+        try:
+            output.update(mdls_properties_from_tiff(parse_tiff(header.exif)))
+        except ExifError:
+            pass
+    # The frame header is the real thing. EXIF dimensions are not always updated after edits.
+    if header.height and header.width:
+        output["kMDItemPixelHeight"] = str(header.height)
+        output["kMDItemPixelWidth"] = str(header.width)
+        output["kMDItemBitsPerSample"] = str(header.bits_per_sample)
+    return output
@@ -34,6 +34,20 @@ class FileGroup(jsonable.Jsonable):
         if new_main_file_path != path:
             self.supporting_file_paths.add(path)
 
+    def remove_file_path(self, path: pds.Path) -> None:
+        """When it is the main file that goes, the main file gets determined again among the others"""
+        if path != self.main_path:
+            self._remove_supporting_file_path(path)
+            return
+        other_paths = sorted(self.supporting_file_paths)
+        self.main_path = None
+        self.supporting_file_paths = set()
+        for other_path in other_paths:
+            self.add_file_path(other_path)
+
+    def is_empty(self) -> bool:
+        return not self.main_path
+
     def main_file_path(self) -> pds.Path:
         return self.main_path
 
@@ -175,6 +175,32 @@ class PictureFileSeriesSplitter:
 
         return False
 
+    def restore_file_series(self, all_file_series: List[PictureFileSeries]) -> None:
+        """
+        Restores persisted series, instead of adding all their paths again.
+        The next path may continue the last one.
+        """
+        self.all_file_series = all_file_series
+        self.curr_file_series = None
+        self.curr_file_group = None
+        self.curr_file_prefix = None
+        self.curr_file_num = None
+        if all_file_series and all_file_series[-1].file_groups:
+            self.curr_file_series = all_file_series[-1]
+            self.curr_file_group = self.curr_file_series.file_groups[-1]
+            self.curr_file_prefix, self.curr_file_num = images.filename_dcf_prefix_and_number(
+                self.curr_file_group.main_path)
+
+    def remove_paths(self, paths: pds.PathSet) -> None:
+        """Takes `paths` out of their series. Groups & series that end up empty go."""
+        for file_series in self.all_file_series:
+            for file_group in file_series.file_groups:
+                for path in [file_group.main_path, *file_group.supporting_file_paths]:
+                    if path in paths:
+                        file_group.remove_file_path(path)
+            file_series.file_groups = [x for x in file_series.file_groups if not x.is_empty()]
+        self.restore_file_series([file_series for file_series in self.all_file_series if file_series.file_groups])
+
     def add_path(self,
                  path: pds.Path,
                  properties: pdc.PropertyDict) -> None:
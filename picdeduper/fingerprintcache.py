@@ -0,0 +1,115 @@
+import collections
+import json
+import threading
+
+from typing import Callable, OrderedDict
+
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  An on-disk cache of fingerprints, keyed by file identity:
+#
+#     (device, inode, size, mtime_ns) -> the PropertyDict from Fingerprinter
+#
+#  The path is not part of the key, so a moved or renamed file still hits.
+#  Path-derived fields (like the core filename) get recomputed on a hit.
+#
+#  It keeps the `max_entries` most recently used fingerprints (LRU).
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+DEFAULT_MAX_ENTRIES = 1000000
+
+CACHE_FORMAT_VERSION = 1
+KEY_VERSION = "version"
+KEY_ENTRIES = "entries"
+
+# Fields that depend on the path, not on the content:
+PATH_DERIVED_KEYS = [pdc.KEY_FILE_CORE_NAME]
+
+IDENTITY_KEYS = [pdc.KEY_FILE_DEVICE, pdc.KEY_FILE_INODE, pdc.KEY_FILE_SIZE, pdc.KEY_FILE_MTIME_NS]
+
+
+def identity_of(quick_signature: pdc.PropertyDict) -> str:
+    """Returns the cache key of a (quick) signature, or None if it does not have all of IDENTITY_KEYS"""
+    parts = [quick_signature.get(key) for key in IDENTITY_KEYS]
+    if not all(parts):
+        return None
+    return ":".join(parts)
+
+
+class FingerprintCache:
+
+    def __init__(self, platform: pds.Platform, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.platform = platform
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, pdc.PropertyDict] = collections.OrderedDict()  # oldest first
+        self.lock = threading.Lock()  # Fingerprinting runs on a thread pool
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self,
+            image_path: pds.Path,
+            quick_signature: pdc.PropertyDict,
+            is_usable: Callable[[pdc.PropertyDict], bool] = None) -> pdc.PropertyDict:
+        """
+        Returns a copy of the cached fingerprint of the file with this identity, or None.
+        It is a miss if `is_usable` rejects the cached fingerprint
+        (e.g. it was computed without a hash, and now a hash is needed).
+        """
+        key = identity_of(quick_signature)
+        with self.lock:
+            cached = self.entries.get(key) if key else None
+            if (cached is None) or (is_usable and not is_usable(cached)):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        output = dict(cached)
+        output.update(quick_signature)
+        output[pdc.KEY_FILE_CORE_NAME] = pds.path_core_filename(image_path)
+        return output
+
+    def put(self, image_properties: pdc.PropertyDict) -> None:
+        key = identity_of(image_properties)
+        if not key:
+            return
+        entry = {k: v for k, v in image_properties.items() if not k in PATH_DERIVED_KEYS}
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def summary(self) -> str:
+        with self.lock:
+            return (f"Fingerprint cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+                    f"{len(self.entries)} entries")
+
+    def save(self, path: pds.Path) -> None:
+        with self.lock:
+            storage_dict = {
+                KEY_VERSION: CACHE_FORMAT_VERSION,
+                KEY_ENTRIES: [[key, entry] for key, entry in self.entries.items()],
+            }
+        self.platform.write_text_file(path, json.dumps(obj=storage_dict))
+
+    def load(path: pds.Path, platform: pds.Platform, max_entries: int = DEFAULT_MAX_ENTRIES):
+        cache = FingerprintCache(platform, max_entries)
+        if not platform.path_exists(path):
+            print("WARNING: No fingerprint cache found. Starting new one.")
+            return cache
+        storage_dict = json.loads(platform.read_text_file(path))
+        if storage_dict.get(KEY_VERSION) != CACHE_FORMAT_VERSION:
+            print(f"WARNING: Ignoring fingerprint cache {path} of another version.")
+            return cache
+        for key, entry in storage_dict[KEY_ENTRIES][-max_entries:]:
+            cache.entries[key] = entry
+        return cache
@@ -1,23 +1,26 @@
+import asyncio
+
 from picdeduper import common as pdc
+from picdeduper import exif as pdexif
+from picdeduper import fingerprintcache as pdfc
+from picdeduper import isobmff as pdbmff
+from picdeduper import perceptual as pdperc
 from picdeduper import platform as pds
+from picdeduper import time as pdt
 
-from typing import Dict
+from abc import ABC, abstractmethod
+from typing import Dict, List
 
-MDLS_KEYS = []
+# Extensions of the files that HeaderMetadataBackend knows how to read:
+JPEG_EXTS = (".JPG", ".JPEG")
+ISOBMFF_EXTS = (".HEIC", ".MOV", ".MP4", ".HEVC")
 
-# File size:
-MDLS_FILE_SIZE_KEYS = [
-    "kMDItemFSSize",
-]
-MDLS_KEYS += MDLS_FILE_SIZE_KEYS
+# Max number of files passed to a single mdls call:
+MDLS_BATCH_SIZE = 256
 
-# File date (order sensitive!):
-MDLS_FILE_DATE_KEYS = [
-    "kMDItemFSContentChangeDate",
-    "kMDItemFSCreationDate",
-    "kMDItemDateAdded",
-]
-MDLS_KEYS += MDLS_FILE_DATE_KEYS
+MDLS_KEYS = []
+
+# NOTE: File size & date come from Platform.file_stat(), not from mdls.
 
 # Image date (order sensitive!):
 MDLS_IMAGE_DATE_KEYS = [
@@ -109,20 +112,6 @@ def _image_date_string(image_properties: pdc.PropertyDict) -> str:
     return None
 
 
-def _file_date_string(image_properties: pdc.PropertyDict) -> str:
-    for key in MDLS_FILE_DATE_KEYS:
-        if key in image_properties:
-            return image_properties[key]
-    return None
-
-
-def _file_size_string(image_properties: pdc.PropertyDict) -> str:
-    for key in MDLS_FILE_SIZE_KEYS:
-        if key in image_properties:
-            return image_properties[key]
-    return None
-
-
 def _image_camera_settings_string(image_properties: pdc.PropertyDict) -> str:
     settings = []
     for key in MDLS_CAMERA_SETTING_KEYS:
@@ -132,48 +121,173 @@ def _image_camera_settings_string(image_properties: pdc.PropertyDict) -> str:
     return "/".join(settings)
 
 
-class Fingerprinter:
+def _chunks(paths: pds.PathList, size: int):
+    for i in range(0, len(paths), size):
+        yield paths[i:i + size]
+
+
+class MetadataBackend(ABC):
+    """Something that can extract the (mdls-style, kMDItem*) metadata of image files"""
+
+    @abstractmethod
+    def properties_of_image_file(self, path: pds.Path) -> pdc.PropertyDict:
+        pass
+
+    def properties_of_image_files(self, paths: pds.PathList) -> Dict[pds.Path, pdc.PropertyDict]:
+        return {path: self.properties_of_image_file(path) for path in paths}
+
+    async def async_properties_of_image_files(self,
+                                              paths: pds.PathList,
+                                              async_platform: pds.AsyncPlatform) -> Dict[pds.Path, pdc.PropertyDict]:
+        """Async version of properties_of_image_files(). By default, on a worker thread."""
+        return await asyncio.to_thread(self.properties_of_image_files, paths)
+
+
+class MdlsMetadataBackend(MetadataBackend):
+    """Asks Spotlight, through `mdls`. Only works on macOS."""
 
     def __init__(self, platform: pds.Platform) -> None:
         self.platform = platform
         assert self.platform.is_mac_os()
 
-    def _mdls_properties_of_image_file(self, path: pds.Path) -> pdc.PropertyDict:
-        """Returns a list of properties that identify the identitiy of a file"""
+    def _mdls_cmd(self, paths: pds.PathList) -> pds.CommandLineParts:
         params = [["-name", x] for x in MDLS_KEYS]
 
         cmd = ["mdls"]
         cmd.extend([x for sublist in params for x in sublist])
-        cmd.append(path)
-
-        output_dict = dict()
-        raw_lines = self.platform.raw_stdout_of(cmd).split(b"\n")
-        for raw_line in raw_lines:
+        cmd.extend(paths)
+        return cmd
+
+    def _mdls_records_of(self, raw_output: bytes) -> List[pdc.PropertyDict]:
+        """
+        Cuts the output of a (multi-file) mdls call into one dict per file.
+        mdls prints the same (sorted) keys for every file, `(null)` included,
+        so a record starts every time the very first key shows up again.
+        """
+        records: List[pdc.PropertyDict] = list()
+        first_key = None
+        for raw_line in (raw_output or b"").split(b"\n"):
             raw_parts = raw_line.split(b"=")
             if len(raw_parts) != 2:
                 continue
+            key = raw_parts[0].decode("utf-8").strip()
+            if not first_key:
+                first_key = key
+            if key == first_key:
+                records.append(dict())
             if b" (null)" == raw_parts[1]:
                 continue
-            key = raw_parts[0].decode("utf-8").strip()
             val = raw_parts[1].decode("utf-8").strip().strip("\"")
-            output_dict[key] = val
+            records[-1][key] = val
+        return records
+
+    def properties_of_image_file(self, path: pds.Path) -> pdc.PropertyDict:
+        """Returns a list of properties that identify the identitiy of a file"""
+        records = self._mdls_records_of(self.platform.raw_stdout_of(self._mdls_cmd([path])))
+        output_dict = dict()
+        for record in records:
+            output_dict.update(record)
+        return output_dict
 
+    def properties_of_image_files(self, paths: pds.PathList) -> Dict[pds.Path, pdc.PropertyDict]:
+        """
+        Same as properties_of_image_file(), but with a single mdls call for all `paths`.
+        Falls back to one call per file if the output cannot be matched up with `paths`.
+        """
+        if len(paths) == 1:
+            return {paths[0]: self.properties_of_image_file(paths[0])}
+        records = self._mdls_records_of(self.platform.raw_stdout_of(self._mdls_cmd(paths)))
+        if len(records) != len(paths):
+            return {path: self.properties_of_image_file(path) for path in paths}
+        return dict(zip(paths, records))
+
+    async def _async_properties_of_image_file(self, path: pds.Path,
+                                              async_platform: pds.AsyncPlatform) -> pdc.PropertyDict:
+        output_dict = dict()
+        for record in self._mdls_records_of(await async_platform.raw_stdout_of(self._mdls_cmd([path]))):
+            output_dict.update(record)
         return output_dict
 
-    def quick_image_signature_dict_of(self, image_path: pds.Path) -> pdc.PropertyDict:
-        mdls_properties = self._mdls_properties_of_image_file(image_path)
-        return {
-            pdc.KEY_FILE_DATE: _file_date_string(mdls_properties),
-            pdc.KEY_FILE_SIZE: _file_size_string(mdls_properties),
-        }
+    async def async_properties_of_image_files(self,
+                                              paths: pds.PathList,
+                                              async_platform: pds.AsyncPlatform) -> Dict[pds.Path, pdc.PropertyDict]:
+        """Same as properties_of_image_files(), with the fallback calls in flight at once"""
+        if len(paths) > 1:
+            records = self._mdls_records_of(await async_platform.raw_stdout_of(self._mdls_cmd(paths)))
+            if len(records) == len(paths):
+                return dict(zip(paths, records))
+        records = await asyncio.gather(*[self._async_properties_of_image_file(path, async_platform) for path in paths])
+        return dict(zip(paths, records))
+
+
+class HeaderMetadataBackend(MetadataBackend):
+    """
+    Parses the metadata out of the file headers, within this process.
+    Works on any OS, and only reads the first few KiB of a file
+    (or, for .HEIC/.MOV/.MP4, a few boxes: never the media data).
+    """
 
-    def image_signature_dict_of(self, image_path: pds.Path, io_image_properties: pdc.PropertyDict) -> None:
-        mdls_properties = self._mdls_properties_of_image_file(image_path)
-        io_image_properties.update({
+    def __init__(self, platform: pds.Platform) -> None:
+        self.platform = platform
+
+    def properties_of_image_file(self, path: pds.Path) -> pdc.PropertyDict:
+        ext = pds.filename_ext(path).upper()
+        try:
+            with self.platform.open_binary_file(path) as f:
+                if ext in JPEG_EXTS:
+                    return pdexif.mdls_properties_of_jpeg(f)
+                if ext in ISOBMFF_EXTS:
+                    return pdbmff.mdls_properties_of_isobmff(f)
+        except (pdexif.ExifError, pdbmff.IsoBmffError, OSError) as e:
+            print(f"WARNING: Cannot read the metadata of {path}: {e}")
+        return dict()
+
+
+def default_metadata_backend(platform: pds.Platform) -> MetadataBackend:
+    if platform.is_mac_os():
+        return MdlsMetadataBackend(platform)
+    return HeaderMetadataBackend(platform)
+
+
+class Fingerprinter:
+
+    def __init__(self,
+                 platform: pds.Platform,
+                 metadata_backend: MetadataBackend = None,
+                 perceptual_hasher: pdperc.PerceptualHasher = None,
+                 cache: pdfc.FingerprintCache = None) -> None:
+        self.platform = platform
+        self.metadata_backend = metadata_backend or default_metadata_backend(platform)
+        self.perceptual_hasher = perceptual_hasher  # Optional: no KEY_IMAGE_PHASH without it
+        self.cache = cache  # Optional: consulted before any metadata or hash work
+
+    def _is_usable_cached_signature(self, cached: pdc.PropertyDict, with_hash: bool) -> bool:
+        if with_hash and not cached.get(pdc.KEY_FILE_HASH):
+            return False
+        if self.perceptual_hasher and not pdc.KEY_IMAGE_PHASH in cached:
+            return False
+        return True
+
+    def _cached_signature_dict_of(self, image_path: pds.Path, quick_signature: pdc.PropertyDict,
+                                  with_hash: bool) -> pdc.PropertyDict:
+        if self.cache is None:
+            return None
+        return self.cache.get(image_path, quick_signature, lambda x: self._is_usable_cached_signature(x, with_hash))
+
+    def remember(self, image_properties: pdc.PropertyDict) -> None:
+        """Updates the cache with what we learned about a file since it was fingerprinted (e.g. a lazy hash)"""
+        if self.cache is not None:
+            self.cache.put(image_properties)
+
+    def _image_signature_dict_from(self,
+                                   image_path: pds.Path,
+                                   quick_signature: pdc.PropertyDict,
+                                   mdls_properties: pdc.PropertyDict,
+                                   file_hash: str) -> pdc.PropertyDict:
+        output = dict(quick_signature)
+        output.update({
             pdc.KEY_FILE_CORE_NAME: pds.path_core_filename(image_path),
-            pdc.KEY_FILE_HASH: self.platform.quick_file_hash(image_path),
-            pdc.KEY_FILE_DATE: _file_date_string(mdls_properties),
-            pdc.KEY_FILE_SIZE: _file_size_string(mdls_properties),
+            pdc.KEY_FILE_HASH: file_hash,
             pdc.KEY_IMAGE_RES: _image_resolution_string(mdls_properties),
             pdc.KEY_IMAGE_LOC: _image_location_string(mdls_properties),
             pdc.KEY_IMAGE_CREATOR: _image_creator_string(mdls_properties),
@@ -181,6 +295,154 @@ class Fingerprinter:
             pdc.KEY_IMAGE_ANGLES: _image_angles_string(mdls_properties),
             pdc.KEY_IMAGE_CAMSET: _image_camera_settings_string(mdls_properties),
         })
+        if self.perceptual_hasher:
+            output[pdc.KEY_IMAGE_PHASH] = self.perceptual_hasher.phash_of(image_path)
+        self.remember(output)
+        return output
+
+    def quick_image_signature_dict_of(self, image_path: pds.Path) -> pdc.PropertyDict:
+        """
+        Returns the properties that tell if a file was touched since it was indexed.
+        It only needs a stat() call, so it stays within this process.
+        """
+        file_stat = self.platform.file_stat(image_path)
+        return {
+            pdc.KEY_FILE_DATE: pdt.string_from_timestamp(file_stat.mtime_ns // 10**9),
+            pdc.KEY_FILE_SIZE: str(file_stat.size),
+            pdc.KEY_FILE_MTIME_NS: str(file_stat.mtime_ns),
+            pdc.KEY_FILE_INODE: str(file_stat.inode),
+            pdc.KEY_FILE_DEVICE: str(file_stat.device),
+        }
+
+    def quick_image_signature_dicts_of(self, image_paths: pds.PathList) -> Dict[pds.Path, pdc.PropertyDict]:
+        """Batched version of quick_image_signature_dict_of(). Leaves out the files it cannot stat() (anymore)."""
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        for path in image_paths:
+            try:
+                output[path] = self.quick_image_signature_dict_of(path)
+            except OSError as e:
+                print(f"WARNING: Cannot stat {path}. Was it moved or deleted? {e}")
+        return output
+
+    def _quick_file_hashes(self, image_paths: pds.PathList) -> Dict[pds.Path, str]:
+        """Same as Platform.quick_file_hashes(), leaving out the files it cannot read (anymore)"""
+        try:
+            return self.platform.quick_file_hashes(image_paths)
+        except OSError:
+            pass
+        output: Dict[pds.Path, str] = dict()
+        for path in image_paths:  # One by one, to tell which
+            try:
+                output[path] = self.platform.quick_file_hash(path)
+            except OSError as e:
+                print(f"WARNING: Cannot hash {path}. Was it moved or deleted? {e}")
+        return output
+
+    async def _async_quick_file_hashes(self, image_paths: pds.PathList,
+                                       async_platform: pds.AsyncPlatform) -> Dict[pds.Path, str]:
+        """Async version of _quick_file_hashes()"""
+        file_hashes = await asyncio.gather(*[async_platform.quick_file_hash(path) for path in image_paths],
+                                           return_exceptions=True)
+        output: Dict[pds.Path, str] = dict()
+        for path, file_hash in zip(image_paths, file_hashes):
+            if isinstance(file_hash, OSError):
+                print(f"WARNING: Cannot hash {path}. Was it moved or deleted? {file_hash}")
+            elif isinstance(file_hash, BaseException):
+                raise file_hash
+            else:
+                output[path] = file_hash
+        return output
+
+    def image_signature_dict_of(self, image_path: pds.Path, io_image_properties: pdc.PropertyDict) -> None:
+        quick_signature = self.quick_image_signature_dict_of(image_path)
+        cached = self._cached_signature_dict_of(image_path, quick_signature, with_hash=True)
+        if cached:
+            io_image_properties.update(cached)
+            return
+        mdls_properties = self.metadata_backend.properties_of_image_file(image_path)
+        file_hash = self.platform.quick_file_hash(image_path)
+        io_image_properties.update(
+            self._image_signature_dict_from(image_path, quick_signature, mdls_properties, file_hash))
+
+    def image_signature_dicts_of(self, image_paths: pds.PathList, with_hash=True) -> Dict[pds.Path, pdc.PropertyDict]:
+        """
+        Batched version of image_signature_dict_of().
+        Asks the metadata backend for MDLS_BATCH_SIZE paths at once (e.g. a single mdls call).
+        The files of a batch get hashed in parallel, unless `with_hash` is False.
+        Without a hash, IndexStore.resolve_hash_collisions() only hashes what it needs.
+        Files found in the cache (by identity) skip all of that.
+        """
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        for chunk in _chunks(image_paths, MDLS_BATCH_SIZE):
+            quick_signatures, misses = self._cached_signature_dicts_of(chunk, with_hash, output)
+            if not misses:
+                continue
+            file_hashes = self._quick_file_hashes(misses) if with_hash else None
+            mdls_properties_dict = self.metadata_backend.properties_of_image_files(misses)
+            output.update(self._image_signature_dicts_from(quick_signatures, mdls_properties_dict, file_hashes))
+        return output
+
+    def _cached_signature_dicts_of(self, image_paths: pds.PathList, with_hash: bool,
+                                   io_output: Dict[pds.Path, pdc.PropertyDict]):
+        """Puts the cache hits in `io_output`. Returns the quick signatures of all `image_paths`, and the misses."""
+        quick_signatures = self.quick_image_signature_dicts_of(image_paths)
+        misses = list()
+        for path in quick_signatures:
+            cached = self._cached_signature_dict_of(path, quick_signatures[path], with_hash)
+            if cached:
+                io_output[path] = cached
+            else:
+                misses.append(path)
+        return quick_signatures, misses
+
+    def _image_signature_dicts_from(self,
+                                    quick_signatures: Dict[pds.Path, pdc.PropertyDict],
+                                    mdls_properties_dict: Dict[pds.Path, pdc.PropertyDict],
+                                    file_hashes: Dict[pds.Path, str]) -> Dict[pds.Path, pdc.PropertyDict]:
+        """
+        Without `file_hashes`, the files do not get hashed.
+        With them, the files that could not get hashed are left out.
+        """
+        return {
+            path: self._image_signature_dict_from(path, quick_signatures[path], mdls_properties,
+                                                  None if file_hashes is None else file_hashes[path])
+            for path, mdls_properties in mdls_properties_dict.items()
+            if file_hashes is None or path in file_hashes
+        }
+
+    async def _async_image_signature_dicts_of_chunk(self,
+                                                   chunk: pds.PathList,
+                                                   async_platform: pds.AsyncPlatform,
+                                                   with_hash: bool) -> Dict[pds.Path, pdc.PropertyDict]:
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        quick_signatures, misses = await asyncio.to_thread(self._cached_signature_dicts_of, chunk, with_hash, output)
+        if not misses:
+            return output
+        hashing = self._async_quick_file_hashes(misses, async_platform) if with_hash else asyncio.sleep(0, result=None)
+        file_hashes, mdls_properties_dict = await asyncio.gather(
+            hashing,
+            self.metadata_backend.async_properties_of_image_files(misses, async_platform))
+        # The perceptual hashes (if any) decode images: not on the event loop.
+        output.update(await asyncio.to_thread(
+            self._image_signature_dicts_from, quick_signatures, mdls_properties_dict, file_hashes))
+        return output
+
+    async def async_image_signature_dicts_of(self,
+                                             image_paths: pds.PathList,
+                                             async_platform: pds.AsyncPlatform,
+                                             with_hash=True) -> Dict[pds.Path, pdc.PropertyDict]:
+        """
+        Async version of image_signature_dicts_of(): all the chunks, their metadata
+        calls and their hashes are in flight at once (within the limit of `async_platform`),
+        so their latencies overlap instead of adding up.
+        """
+        chunk_outputs = await asyncio.gather(*[
+            self._async_image_signature_dicts_of_chunk(chunk, async_platform, with_hash)
+            for chunk in _chunks(image_paths, MDLS_BATCH_SIZE)])
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        for chunk_output in chunk_outputs:
+            output.update(chunk_output)
+        return output
 
     def double_check_dupes(self, images_properties_dict: Dict[pds.Path, pdc.PropertyDict]):
         second_hash_check = None
@@ -196,3 +458,13 @@ class Fingerprinter:
             if second_hash != second_hash_check:
                 return False
         return True
+
+    async def async_double_check_dupes(self,
+                                       images_properties_dict: Dict[pds.Path, pdc.PropertyDict],
+                                       async_platform: pds.AsyncPlatform) -> bool:
+        """Same as double_check_dupes(), with the second opinions computed at once"""
+        missing = [path for path, x in images_properties_dict.items() if not pdc.KEY_FILE_SECOND_HASH in x]
+        second_hashes = await asyncio.gather(*[async_platform.second_opinion_file_hash(path) for path in missing])
+        for path, second_hash in zip(missing, second_hashes):
+            images_properties_dict[path][pdc.KEY_FILE_SECOND_HASH] = second_hash
+        return len(set(x[pdc.KEY_FILE_SECOND_HASH] for x in images_properties_dict.values())) <= 1
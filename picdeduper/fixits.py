@@ -239,17 +239,38 @@ class WrongFileTimeFixIt(FixIt):
 
 
 class SimilarImageFixIt(FixIt):
-    pass
+    TITLE = "similar image"
+    TO_DIR = "./_similar"
+
+    def __init__(self, platform: pds.Platform, candidate_path: pds.Path, other_paths: pds.PathSet) -> None:
+        super().__init__()
+        self.description.add(FixItDescriptionTextElement("Detected a"))
+        self.description.add(FixItDescriptionBoldTextElement(type(self).TITLE))
+        self.description.add(FixItDescriptionTextElement("at"))
+        self.description.add(FixItDescriptionFilePathElement(candidate_path))
+        self.description.add(FixItDescriptionTextElement("looking like"))
+        for other_path in sorted(other_paths):
+            self.description.add(FixItDescriptionFilePathElement(other_path))
+        self.actions.append(self._proposed_action(platform, candidate_path))
+        self.actions.append(DoNothingAction())
+
+    def _proposed_action(self, platform: pds.Platform, candidate_path: pds.Path) -> FixItAction:
+        return FixItMoveFileAction(platform, candidate_path, type(self).TO_DIR)
 
 
 class BetterQualityVersionFixIt(SimilarImageFixIt):
     """e.g. Found a new HEIC of a JPEG"""
-    pass
+    TITLE = "better quality version"
+    TO_DIR = "./_enhancements"
 
 
 class WorseQualityVersionFixIt(SimilarImageFixIt):
     """e.g. Found a new JPEG of an HEIC"""
-    pass
+    TITLE = "worse quality version"
+    TO_DIR = "./_worse"
+
+    def _proposed_action(self, platform: pds.Platform, candidate_path: pds.Path) -> FixItAction:
+        return FixItSoftDeleteFileAction(platform, candidate_path, type(self).TO_DIR)
 
 
 class SmallerVersionFixIt(SimilarImageFixIt):
@@ -280,6 +301,7 @@ class CommandLineFixItProcessor(FixItProcessor):
     on the command line.
     """
     KEYB_KEY_FOR_ACTION_TYPE = BiMap({
+        FixItMoveFileAction: "M",
         FixItSoftDeleteFileAction: "D",
         ChangeFileMTimeAction: "F",
         DoNothingAction: "",
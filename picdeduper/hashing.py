@@ -0,0 +1,134 @@
+import concurrent.futures
+import hashlib
+import io
+import mmap
+import os
+import threading
+
+from typing import BinaryIO, Callable, Dict, List, Union
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  In-process file hashing, without spawning `openssl` for every file.
+#
+#  - Every thread reads into its own, reusable buffer (no new bytes per chunk).
+#  - Big files get mmap'ed, and hashed in one go.
+#  - hashlib releases the GIL while hashing, so a thread pool really helps.
+#
+#  The hex digests are the same as those of `openssl <algorithm> -r`.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+Algorithm = Union[str, Callable]
+BinaryFileOpener = Callable[[str], BinaryIO]
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024           # 1 MiB
+DEFAULT_MMAP_THRESHOLD = 64 * 1024 * 1024   # 64 MiB
+DEFAULT_PARTIAL_SIZE = 64 * 1024            # 64 KiB, at the head & at the tail
+
+
+def is_available(algorithm: str) -> bool:
+    """e.g. MD4 is not available in hashlib when OpenSSL 3 is missing its legacy provider"""
+    try:
+        hashlib.new(algorithm)
+        return True
+    except ValueError:
+        return False
+
+
+def _new_hash(algorithm: Algorithm):
+    if callable(algorithm):
+        return algorithm()
+    return hashlib.new(algorithm)
+
+
+def _fileno_of(f: BinaryIO) -> int:
+    try:
+        return f.fileno()
+    except (io.UnsupportedOperation, AttributeError):
+        return None
+
+
+class FileHasher:
+
+    def __init__(self,
+                 open_binary_file: BinaryFileOpener,
+                 max_workers: int = None,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 mmap_threshold: int = DEFAULT_MMAP_THRESHOLD) -> None:
+        self.open_binary_file = open_binary_file
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.buffer_size = buffer_size
+        self.mmap_threshold = mmap_threshold
+        self.thread_local = threading.local()
+        self.executor: concurrent.futures.ThreadPoolExecutor = None
+        self.executor_lock = threading.Lock()
+
+    def _buffer(self) -> memoryview:
+        """Returns the reusable read buffer of the calling thread"""
+        if not hasattr(self.thread_local, "buffer"):
+            self.thread_local.buffer = memoryview(bytearray(self.buffer_size))
+        return self.thread_local.buffer
+
+    def _executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self.executor_lock:
+            if not self.executor:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="FileHasher")
+            return self.executor
+
+    def _update_with_mmap(self, hash, fileno: int) -> bool:
+        """Returns False if the file is not a good fit for mmap"""
+        size = os.fstat(fileno).st_size
+        if size < self.mmap_threshold:
+            return False
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+            hash.update(mapped)
+        return True
+
+    def _update_with_readinto(self, hash, f: BinaryIO) -> None:
+        buffer = self._buffer()
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hash.update(buffer[:count])
+
+    def hash_file(self, path: str, algorithm: Algorithm) -> str:
+        hash = _new_hash(algorithm)
+        with self.open_binary_file(path) as f:
+            fileno = _fileno_of(f)
+            if (fileno is None) or (not self._update_with_mmap(hash, fileno)):
+                self._update_with_readinto(hash, f)
+        return hash.hexdigest()
+
+    def hash_file_head_tail(self, path: str, algorithm: Algorithm, part_size: int = DEFAULT_PARTIAL_SIZE) -> str:
+        """
+        Hashes only the first & last `part_size` bytes of a file (or all of it, if it is small).
+        Only useful to compare files of the same size!
+        """
+        hash = _new_hash(algorithm)
+        with self.open_binary_file(path) as f:
+            size = f.seek(0, io.SEEK_END)
+            f.seek(0)
+            if size <= 2 * part_size:
+                self._update_with_readinto(hash, f)
+            else:
+                hash.update(f.read(part_size))
+                f.seek(size - part_size)
+                hash.update(f.read(part_size))
+        return hash.hexdigest()
+
+    def hash_files(self, paths: List[str], algorithm: Algorithm) -> Dict[str, str]:
+        """Hashes all `paths` on the thread pool. Returns a dict of path to hex digest."""
+        if len(paths) <= 1:
+            return {path: self.hash_file(path, algorithm) for path in paths}
+        digests = self._executor().map(lambda path: self.hash_file(path, algorithm), paths)
+        return dict(zip(paths, digests))
+
+    def shutdown(self) -> None:
+        with self.executor_lock:
+            if self.executor:
+                self.executor.shutdown()
+                self.executor = None
@@ -2,7 +2,7 @@ from picdeduper import platform as pds
 
 import re
 
-from typing import Tuple
+from typing import Iterator, Tuple
 
 RE_FILENAME_NUM = re.compile(r"^(.{4})(\d{4})$")
 
@@ -58,4 +58,8 @@ def every_image_path(platform: pds.Platform, start_dir: pds.Path) -> pds.PathLis
     Returns full paths to all .jpg, .heic, .mov, etc... files under `start_dir`.
     It scans recursively, and sorts the filenames per subdirectory.
     """
-    return platform.every_file_path(start_dir, is_image_filename)
\ No newline at end of file
+    return platform.every_file_path(start_dir, is_image_filename)
+
+def iter_image_paths(platform: pds.Platform, start_dir: pds.Path) -> Iterator[pds.Path]:
+    """Same as every_image_path(), but yields the paths while walking."""
+    return platform.iter_file_paths(start_dir, is_image_filename)
@@ -1,22 +1,159 @@
 import json
-from typing import Dict, List
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
 
 from picdeduper import common as pdc
+from picdeduper import dirsummaries as pdds
 from picdeduper import platform as pds
 from picdeduper import fileseries as pfs
+from picdeduper import journal as pdj
 from picdeduper import jsonable
+from picdeduper import records as pdr
+from picdeduper import similarity as pdsim
+from picdeduper import time as pdt
+from picdeduper import timeindex as pdti
 
 # TODO: This file desperately needs unit tests!!
 
+NO_OLDEST_IMAGE_DATE = "9999-99-99 99:99:99 +9999"
+NO_NEWEST_IMAGE_DATE = "0000-00-00 00:00:00 +0000"
 
-class IndexStoreData(jsonable.Jsonable):
+# Top-level keys of a JSON file written by IndexStore.save() (with indent=2)
+RE_TOP_LEVEL_KEY = re.compile(r'^  "([^"\\]*)": ', re.MULTILINE)
+
+SectionGetter = Callable[[str], Any]
+
+# What makes two images "likely the same image", even when their files differ
+IMAGE_PROPERTIES_KEYS = [
+    pdc.KEY_IMAGE_RES,
+    pdc.KEY_IMAGE_DATE,
+    pdc.KEY_IMAGE_CREATOR,
+    pdc.KEY_IMAGE_LOC,
+    pdc.KEY_IMAGE_ANGLES,
+]
+
+
+def image_properties_key(image_properties: pdc.PropertyDict) -> str:
+    """
+    Returns the key under which images with the same IMAGE_PROPERTIES_KEYS get indexed.
+    Returns None when the image lacks a resolution or date: without them, everything would "match".
+    NOTE: The creator, location & angles may be missing (e.g. no GPS) and are then part of the key as null.
+    """
+    if not image_properties.get(pdc.KEY_IMAGE_RES) or not image_properties.get(pdc.KEY_IMAGE_DATE):
+        return None
+    return json.dumps([image_properties.get(key) for key in IMAGE_PROPERTIES_KEYS])
+
+
+def json_sections(content: str) -> Dict[str, str]:
+    """
+    Cuts the JSON of a saved index into its top-level sections, without parsing them.
+    Returns None if `content` is not laid out like IndexStore.save() does.
+    """
+    if not content.startswith("{\n") or not content.rstrip().endswith("\n}"):
+        return None
+    matches = list(RE_TOP_LEVEL_KEY.finditer(content))
+    output: Dict[str, str] = dict()
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else content.rstrip().rindex("}")
+        output[match.group(1)] = content[match.end():end].rstrip().rstrip(",")
+    return output
+
+
+def compact_json(val: Any) -> str:
+    return json.dumps(val, separators=(",", ":"), sort_keys=True)
+
+
+def dict_json_chunks(items: Iterable[Tuple[str, Any]]) -> Iterator[str]:
+    """The JSON of a dict, an item at a time"""
+    yield "{"
+    separator = ""
+    for key, val in items:
+        yield separator + compact_json(key) + ":" + compact_json(val)
+        separator = ","
+    yield "}"
+
+
+def list_json_chunks(vals: Iterable[Any]) -> Iterator[str]:
+    """The JSON of a list, an element at a time"""
+    yield "["
+    separator = ""
+    for val in vals:
+        yield separator + compact_json(val)
+        separator = ","
+    yield "]"
+
+
+def sections_json_chunks(sections: Dict[str, Iterable[str]]) -> Iterator[str]:
+    """
+    The JSON of a dict of (the chunks of) sections, sorted by key, with a section per line.
+    That is what json_sections() needs to cut it up again, while nothing but the top level is indented.
+    """
+    yield "{\n"
+    separator = ""
+    for key in sorted(sections):
+        yield f"{separator}  {compact_json(key)}: "
+        yield from sections[key]
+        separator = ",\n"
+    yield "\n}"
+
+
+class Deferred:
+    """Attributes that only get decoded on their first access (see defer())"""
+
+    def defer(self, names: List[str], decoder: Callable[[], None]):
+        """`decoder` sets all of the `names` attributes, the first time any of them gets used"""
+        if not "_deferred" in self.__dict__:
+            self._deferred: Dict[str, Callable[[], None]] = dict()
+            self._deferred_lock = threading.RLock()  # Worker threads look up processed files
+        for name in names:
+            self.__dict__.pop(name, None)
+            self._deferred[name] = decoder
+
+    def __getattr__(self, name: str):
+        """Only gets called for attributes that are not there (yet)"""
+        deferred = self.__dict__.get("_deferred")
+        if not deferred or not name in deferred:
+            raise AttributeError(name)
+        with self._deferred_lock:
+            decoder = deferred.get(name)
+            if decoder:
+                for decoded_name in [key for key, value in deferred.items() if value is decoder]:
+                    del deferred[decoded_name]
+                decoder()
+        return self.__dict__[name]
+
+    def is_decoded(self, name: str) -> bool:
+        """False while `name` is deferred: what it would need to know gets decoded with it anyway"""
+        return name in self.__dict__
+
+
+class IndexStoreData(jsonable.Jsonable, Deferred):
 
     def __init__(self) -> None:
         self.by_path = dict()
         self.by_hash = dict()
         self.by_core_filename = dict()
-        self.oldest_image_date = "9999-99-99 99:99:99 +9999"
-        self.newest_image_date = "0000-00-00 00:00:00 +0000"
+        self.by_phash = dict()
+        self.phash_index = pdsim.HammingIndex()  # derived from by_phash, not persisted
+        self.by_dir: pdds.DirectorySummaries = dict()
+        self.by_size = dict()           # derived from by_path, not persisted
+        self.by_partial_hash = dict()   # derived from by_path, not persisted
+        self.by_image_properties = dict()  # derived from by_path, not persisted
+        self.oldest_image_date = NO_OLDEST_IMAGE_DATE
+        self.newest_image_date = NO_NEWEST_IMAGE_DATE
+        self._defer_by_image_time()  # derived from by_path, not persisted, built on first use
+
+    def _defer_by_image_time(self):
+        """Only a time range query builds it: runs that only add never pay for it"""
+
+        def decode_by_image_time():
+            self.by_image_time = pdti.ImageTimeIndex.of(
+                (pdt.timestamp_from_string(image_properties[pdc.KEY_IMAGE_DATE]), path)
+                for path, image_properties in self.by_path.items() if image_properties.get(pdc.KEY_IMAGE_DATE))
+
+        self.defer(["by_image_time"], decode_by_image_time)
 
     def _pathset_for_hash(self, hash_str: str) -> pds.PathSet:
         if not hash_str in self.by_hash:
@@ -28,20 +165,112 @@ class IndexStoreData(jsonable.Jsonable):
             self.by_core_filename[filename] = set()
         return self.by_core_filename[filename]
 
+    def _pathset_for_phash(self, phash: str) -> pds.PathSet:
+        if not phash in self.by_phash:
+            self.by_phash[phash] = set()
+            self.phash_index.add(pdsim.phash_from_string(phash))
+        return self.by_phash[phash]
+
+    def _pathset_for_size(self, size: str) -> pds.PathSet:
+        if not size in self.by_size:
+            self.by_size[size] = set()
+        return self.by_size[size]
+
+    def _pathset_for_partial_hash(self, hash_str: str) -> pds.PathSet:
+        if not hash_str in self.by_partial_hash:
+            self.by_partial_hash[hash_str] = set()
+        return self.by_partial_hash[hash_str]
+
+    def _pathset_for_image_properties(self, key: str) -> pds.PathSet:
+        if not key in self.by_image_properties:
+            self.by_image_properties[key] = set()
+        return self.by_image_properties[key]
+
+    def _add_derived(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        """Adds `path` to the lookups that we do not persist, but rebuild on load"""
+        size = image_properties.get(pdc.KEY_FILE_SIZE)
+        if size:
+            self._pathset_for_size(size).add(path)
+        partial_hash = image_properties.get(pdc.KEY_FILE_PARTIAL_HASH)
+        if partial_hash:
+            self._pathset_for_partial_hash(partial_hash).add(path)
+        key = image_properties_key(image_properties)
+        if key:
+            self._pathset_for_image_properties(key).add(path)
+
     def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
-        print(f"Indexed: {path}")
+        if path in self.by_path:  # Changed since it got indexed: what it was goes
+            self.remove_paths({path})
         image_date = image_properties[pdc.KEY_IMAGE_DATE]
         if image_date:
             self.oldest_image_date = min(self.oldest_image_date, image_date)
             self.newest_image_date = max(self.newest_image_date, image_date)
-        self.by_path[path] = image_properties
-        self._pathset_for_hash(image_properties[pdc.KEY_FILE_HASH]).add(path)
+            if self.is_decoded("by_image_time"):
+                self.by_image_time.add(pdt.timestamp_from_string(image_date), path)
+        self.by_path[path] = pdr.ImageRecord.of(image_properties)
+        file_hash = image_properties.get(pdc.KEY_FILE_HASH)
+        if file_hash:  # Not there for lazily hashed entries
+            self._pathset_for_hash(file_hash).add(path)
         core_filename = pds.path_core_filename(path)
         self._pathset_for_core_filename(core_filename).add(path)
+        phash = image_properties.get(pdc.KEY_IMAGE_PHASH)
+        if phash:
+            self._pathset_for_phash(phash).add(path)
+        self._add_derived(path, image_properties)
+
+    def _discard(self, by_key: Dict[str, pds.PathSet], key: str, path: pds.Path) -> bool:
+        """Takes `path` out of the path set of `key`. Returns True if that emptied it (and it is gone)."""
+        if not key or not key in by_key:
+            return False
+        by_key[key].discard(path)
+        if by_key[key]:
+            return False
+        del by_key[key]
+        return True
+
+    def remove_paths(self, paths: pds.PathSet):
+        """
+        Takes `paths` out of every lookup.
+        The image date range only gets computed again when one of its bounds went.
+        """
+        is_date_range_stale = False
+        for path in paths:
+            image_properties = self.by_path.pop(path, None)
+            if image_properties is None:
+                continue
+            self._discard(self.by_hash, image_properties.get(pdc.KEY_FILE_HASH), path)
+            self._discard(self.by_core_filename, pds.path_core_filename(path), path)
+            phash = image_properties.get(pdc.KEY_IMAGE_PHASH)
+            if self._discard(self.by_phash, phash, path):
+                self.phash_index.remove(pdsim.phash_from_string(phash))
+            self._discard(self.by_size, image_properties.get(pdc.KEY_FILE_SIZE), path)
+            self._discard(self.by_partial_hash, image_properties.get(pdc.KEY_FILE_PARTIAL_HASH), path)
+            self._discard(self.by_image_properties, image_properties_key(image_properties), path)
+            image_date = image_properties.get(pdc.KEY_IMAGE_DATE)
+            if image_date and self.is_decoded("by_image_time"):
+                self.by_image_time.remove(pdt.timestamp_from_string(image_date), path)
+            if image_date in (self.oldest_image_date, self.newest_image_date):
+                is_date_range_stale = True
+        if is_date_range_stale:
+            image_dates = [image_properties.get(pdc.KEY_IMAGE_DATE) for image_properties in self.by_path.values()]
+            image_dates = [image_date for image_date in image_dates if image_date]
+            self.oldest_image_date = min(image_dates, default=NO_OLDEST_IMAGE_DATE)
+            self.newest_image_date = max(image_dates, default=NO_NEWEST_IMAGE_DATE)
+
+    def set_file_hash(self, path: pds.Path, file_hash: str):
+        """Backfills the (full) hash of an indexed entry"""
+        self.by_path[path][pdc.KEY_FILE_HASH] = file_hash
+        self._pathset_for_hash(file_hash).add(path)
+
+    def set_partial_hash(self, path: pds.Path, partial_hash: str):
+        """Backfills the partial hash of an indexed entry"""
+        self.by_path[path][pdc.KEY_FILE_PARTIAL_HASH] = partial_hash
+        self._pathset_for_partial_hash(partial_hash).add(path)
 
     def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
+        """NOTE: An empty record of a path that is not indexed does not get indexed: only add() does that"""
         if not path in self.by_path:
-            self.by_path[path] = dict()
+            return pdr.ImageRecord()
         return self.by_path[path]
 
     def image_properties_dict_for_paths(self, paths: pds.PathSet) -> Dict[pds.Path, pdc.PropertyDict]:
@@ -56,6 +285,8 @@ class IndexStoreData(jsonable.Jsonable):
             self.by_path == rhs.by_path and
             self.by_hash == rhs.by_hash and
             self.by_core_filename == rhs.by_core_filename and
+            self.by_phash == rhs.by_phash and
+            self.by_dir == rhs.by_dir and
             self.oldest_image_date == rhs.oldest_image_date and
             self.newest_image_date == rhs.newest_image_date
         )
@@ -64,79 +295,432 @@ class IndexStoreData(jsonable.Jsonable):
         by_path_copy = self.by_path  # avoiding redundant copy
         by_hash_copy = dict()
         by_filename_copy = dict()
+        by_phash_copy = dict()
         for key, val in self.by_hash.items():
             by_hash_copy[key] = jsonable.encode(sorted(val))
         for key, val in self.by_core_filename.items():
             by_filename_copy[key] = jsonable.encode(sorted(val))
+        for key, val in self.by_phash.items():
+            by_phash_copy[key] = jsonable.encode(sorted(val))
         return {
             pdc.KEY_BY_PATH: jsonable.encode(by_path_copy),
             pdc.KEY_BY_HASH: jsonable.encode(by_hash_copy),
             pdc.KEY_BY_FILENAME: jsonable.encode(by_filename_copy),
+            pdc.KEY_BY_PHASH: jsonable.encode(by_phash_copy),
+            pdc.KEY_BY_DIR: jsonable.encode(self.by_dir),
             pdc.KEY_IMAGE_DATE_STATS: jsonable.encode({
                 pdc.KEY_OLDEST: self.oldest_image_date,
                 pdc.KEY_NEWEST: self.newest_image_date,
             }),
         }
 
+    def json_section_chunks(self) -> Dict[str, Iterator[str]]:
+        """Same as jsonable_encode(), as JSON, but streamed: nothing gets copied, or encoded before it gets written"""
+
+        def pathsets(by_key: Dict[str, pds.PathSet]) -> Iterator[Tuple[str, pds.PathList]]:
+            return ((key, sorted(by_key[key])) for key in sorted(by_key))
+
+        return {
+            pdc.KEY_BY_PATH: dict_json_chunks((path, dict(self.by_path[path])) for path in sorted(self.by_path)),
+            pdc.KEY_BY_HASH: dict_json_chunks(pathsets(self.by_hash)),
+            pdc.KEY_BY_FILENAME: dict_json_chunks(pathsets(self.by_core_filename)),
+            pdc.KEY_BY_PHASH: dict_json_chunks(pathsets(self.by_phash)),
+            pdc.KEY_BY_DIR: dict_json_chunks(
+                (path, self.by_dir[path].jsonable_encode()) for path in sorted(self.by_dir)),
+            pdc.KEY_IMAGE_DATE_STATS: iter([compact_json({
+                pdc.KEY_OLDEST: self.oldest_image_date,
+                pdc.KEY_NEWEST: self.newest_image_date,
+            })]),
+        }
+
+    def defer_derived(self):
+        """(Re)builds the lookups that are not persisted from by_path, on first use"""
+
+        def decode_derived():
+            self.by_size = dict()
+            self.by_partial_hash = dict()
+            self.by_image_properties = dict()
+            for path, image_properties in self.by_path.items():
+                self._add_derived(path, image_properties)
+
+        self.defer(["by_size", "by_partial_hash", "by_image_properties"], decode_derived)
+        self._defer_by_image_time()
+
+    def defer_sections(self, section_of: SectionGetter):
+        """Decodes every section on first use. `section_of(key)` returns the JSON of a section, or None."""
+
+        def decode_by_path():
+            # Older versions left empty records of paths that never got indexed
+            self.by_path = {path: pdr.ImageRecord(properties)
+                            for path, properties in section_of(pdc.KEY_BY_PATH).items() if properties}
+
+        def decode_by_hash():
+            self.by_hash = {key: set(paths) for key, paths in section_of(pdc.KEY_BY_HASH).items()}
+
+        def decode_by_core_filename():
+            self.by_core_filename = {key: set(paths) for key, paths in section_of(pdc.KEY_BY_FILENAME).items()}
+
+        def decode_by_phash():
+            self.by_phash = dict()
+            self.phash_index = pdsim.HammingIndex()
+            for key, paths in (section_of(pdc.KEY_BY_PHASH) or dict()).items():  # Not in older indexes
+                self._pathset_for_phash(key).update(paths)
+
+        def decode_by_dir():
+            self.by_dir = {path: pdds.DirectorySummary.jsonable_decode(summary)
+                           for path, summary in (section_of(pdc.KEY_BY_DIR) or dict()).items()}  # Not in older indexes
+
+        def decode_image_date_stats():
+            image_date_stats = section_of(pdc.KEY_IMAGE_DATE_STATS)
+            self.newest_image_date = image_date_stats[pdc.KEY_NEWEST]
+            self.oldest_image_date = image_date_stats[pdc.KEY_OLDEST]
+
+        self.defer(["by_path"], decode_by_path)
+        self.defer(["by_hash"], decode_by_hash)
+        self.defer(["by_core_filename"], decode_by_core_filename)
+        self.defer(["by_phash", "phash_index"], decode_by_phash)
+        self.defer(["by_dir"], decode_by_dir)
+        self.defer_derived()
+        self.defer(["oldest_image_date", "newest_image_date"], decode_image_date_stats)
+
     def jsonable_decode(val: Dict):
-        # TODO: This method is not up to date!!
         obj = IndexStoreData()
-        obj.by_path = val[pdc.KEY_BY_PATH]
-        obj.by_hash = val[pdc.KEY_BY_HASH]
-        obj.by_core_filename = val[pdc.KEY_BY_FILENAME]
-        image_date_stats = val[pdc.KEY_IMAGE_DATE_STATS]
-        obj.newest_image_date = image_date_stats[pdc.KEY_NEWEST]
-        obj.oldest_image_date = image_date_stats[pdc.KEY_OLDEST]
-        for key in obj.by_hash:
-            obj.by_hash[key] = set(obj.by_hash[key])
-        for key in obj.by_core_filename:
-            obj.by_core_filename[key] = set(obj.by_core_filename[key])
-        # NOTE: KEY_BY_SERIES gets loaded through calls ot the splitter.
+        obj.defer_sections(val.get)
+        # NOTE: KEY_BY_SERIES gets decoded by the IndexStore.
         return obj
 
 
-class IndexStore:
+class BaseIndexStore(ABC):
+    """
+    What PicDeduper and evaluate() need from an index of the collection.
+    IndexStore keeps it all in memory (and in a JSON file), SqliteIndexStore in a database.
+    """
 
     def __init__(self, platform: pds.Platform) -> None:
         self.platform = platform
+
+    @abstractmethod
+    def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        pass
+
+    @abstractmethod
+    def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
+        """Returns the indexed properties of `path`, or an empty dict to fill in"""
+        pass
+
+    @abstractmethod
+    def known_image_properties(self, path: pds.Path) -> pdc.PropertyDict:
+        """Returns the indexed properties of `path`, or None if it is not indexed"""
+        pass
+
+    @abstractmethod
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        """Merges `image_properties` into those of the indexed `path`. KeyError if it is not indexed."""
+        pass
+
+    @abstractmethod
+    def all_image_properties(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        pass
+
+    @abstractmethod
+    def paths_with_hash(self, file_hash: str) -> pds.PathSet:
+        pass
+
+    @abstractmethod
+    def paths_with_core_filename(self, core_filename: pds.Filename) -> pds.PathSet:
+        pass
+
+    @abstractmethod
+    def paths_with_similar_phash(self, phash: str, max_distance: int) -> Dict[pds.Path, int]:
+        """Returns the paths of the images within `max_distance` bits of perceptual hash `phash`, with their distance"""
+        pass
+
+    @abstractmethod
+    def paths_with_size(self, size: str) -> pds.PathSet:
+        pass
+
+    @abstractmethod
+    def paths_with_partial_hash(self, partial_hash: str) -> pds.PathSet:
+        pass
+
+    @abstractmethod
+    def paths_with_image_properties(self, image_properties: pdc.PropertyDict) -> pds.PathSet:
+        """Returns the paths of the images with the same image_properties_key() as `image_properties`"""
+        pass
+
+    @abstractmethod
+    def image_date_range(self) -> Tuple[str, str]:
+        """Returns the (oldest, newest) image date of the collection"""
+        pass
+
+    @abstractmethod
+    def paths_with_image_time_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        """The paths of the images taken from `oldest` to `newest` (both included, either can be None), oldest first"""
+        pass
+
+    @abstractmethod
+    def remove_paths(self, paths: pds.PathSet):
+        """Takes `paths` out of the index (e.g. files that got deleted or moved)"""
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Returns the number of indexed files"""
+        pass
+
+    @abstractmethod
+    def directory_summary(self, dir_path: pds.Path) -> pdds.DirectorySummary:
+        """Returns the summary of `dir_path` as of the last indexing run, or None"""
+        pass
+
+    @abstractmethod
+    def set_directory_summaries(self, summaries: pdds.DirectorySummaries):
+        pass
+
+    @abstractmethod
+    def _set_indexed_file_hash(self, path: pds.Path, file_hash: str):
+        pass
+
+    @abstractmethod
+    def _set_indexed_partial_hash(self, path: pds.Path, partial_hash: str):
+        pass
+
+    @abstractmethod
+    def save(self, path: pds.Path):
+        pass
+
+    def commit(self):
+        """Called after every batch of adds. Stores that write incrementally persist what they have so far."""
+        pass
+
+    def stop_persisting(self):
+        """What gets added from now on (the candidates) is not part of the collection, and must not get persisted"""
+        pass
+
+    def image_properties_dict_for_paths(self, paths: pds.PathSet) -> Dict[pds.Path, pdc.PropertyDict]:
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        for path in paths:
+            output[path] = self.image_properties_for_path(path)
+        return output
+
+    def _ensure_partial_hash(self, path: pds.Path, image_properties: pdc.PropertyDict, is_indexed: bool) -> str:
+        partial_hash = image_properties.get(pdc.KEY_FILE_PARTIAL_HASH)
+        if not partial_hash:
+            partial_hash = self.platform.partial_file_hash(path)
+            image_properties[pdc.KEY_FILE_PARTIAL_HASH] = partial_hash
+            if is_indexed:
+                self._set_indexed_partial_hash(path, partial_hash)
+        return partial_hash
+
+    def _ensure_file_hash(self, path: pds.Path, image_properties: pdc.PropertyDict, is_indexed: bool) -> str:
+        file_hash = image_properties.get(pdc.KEY_FILE_HASH)
+        if not file_hash:
+            file_hash = self.platform.quick_file_hash(path)
+            image_properties[pdc.KEY_FILE_HASH] = file_hash
+            if is_indexed:
+                self._set_indexed_file_hash(path, file_hash)
+        return file_hash
+
+    def resolve_hash_collisions(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        """
+        Makes sure that `path` and every indexed file it could be an exact dupe of have a (full) hash.
+        Files are only candidates when they have the same size, and then the same partial hash.
+        Any hash that needs to be computed for an indexed file gets backfilled into the index.
+        """
+        size = image_properties.get(pdc.KEY_FILE_SIZE)
+        if not size:
+            self._ensure_file_hash(path, image_properties, is_indexed=False)
+            return
+        for other_path in sorted(self.paths_with_size(size) - {path}):
+            other_properties = self.known_image_properties(other_path)
+            if image_properties.get(pdc.KEY_FILE_HASH) and other_properties.get(pdc.KEY_FILE_HASH):
+                continue  # Nothing to resolve
+            try:
+                if (self._ensure_partial_hash(path, image_properties, is_indexed=False) !=
+                        self._ensure_partial_hash(other_path, other_properties, is_indexed=True)):
+                    continue
+                self._ensure_file_hash(path, image_properties, is_indexed=False)
+                self._ensure_file_hash(other_path, other_properties, is_indexed=True)
+            except OSError:
+                print(f"WARNING: Cannot hash {other_path}. Was it moved or deleted?")
+
+
+class IndexStore(BaseIndexStore, Deferred):
+
+    def __init__(self, platform: pds.Platform) -> None:
+        super().__init__(platform)
         self.data = IndexStoreData()
         self.file_series_splitter = pfs.PictureFileSeriesSplitter()
+        self.journal: pdj.IndexJournal = None
+
+    def defer_sections(self, section_of: SectionGetter):
+        """Lazy load: every section gets decoded on first use. So a run that never adds decodes no series."""
+        self.data = IndexStoreData()
+        self.data.defer_sections(section_of)
+
+        def decode_file_series():
+            self.file_series_splitter = pfs.PictureFileSeriesSplitter()
+            all_file_series = section_of(pdc.KEY_BY_SERIES)
+            if all_file_series is None:  # Not in older indexes
+                for image_path, image_properties in self.data.by_path.items():
+                    self.file_series_splitter.add_path(image_path, image_properties)
+            else:
+                self.file_series_splitter.restore_file_series(jsonable.decode(all_file_series, pfs.PictureFileSeries))
+
+        self.defer(["file_series_splitter"], decode_file_series)
+
+    def _journal_record(self, path: pds.Path):
+        if self.journal is not None:
+            self.journal.record(path, self.data.by_path[path])
 
     def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
         print(f"Indexed: {path}")
+        self.resolve_hash_collisions(path, image_properties)
         self.data.add(path, image_properties)
         self.file_series_splitter.add_path(path, image_properties)
+        self._journal_record(path)
 
     def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
         return self.data.image_properties_for_path(path)
 
+    def known_image_properties(self, path: pds.Path) -> pdc.PropertyDict:
+        return self.data.by_path.get(path)
+
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        self.data.by_path[path].update(image_properties)
+        self._journal_record(path)
+
     def image_properties_dict_for_paths(self, paths: pds.PathSet) -> Dict[pds.Path, pdc.PropertyDict]:
         return self.data.image_properties_dict_for_paths(paths)
 
-    def save(self, path: pds.Path) -> str:
+    def all_image_properties(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        return iter(self.data.by_path.items())
+
+    def paths_with_hash(self, file_hash: str) -> pds.PathSet:
+        return self.data.by_hash.get(file_hash, set())
+
+    def paths_with_core_filename(self, core_filename: pds.Filename) -> pds.PathSet:
+        return self.data.by_core_filename.get(core_filename, set())
+
+    def paths_with_similar_phash(self, phash: str, max_distance: int) -> Dict[pds.Path, int]:
+        output: Dict[pds.Path, int] = dict()
+        similar = self.data.phash_index.within(pdsim.phash_from_string(phash), max_distance)
+        for other_phash, distance in similar.items():
+            for path in self.data.by_phash.get(pdsim.phash_string(other_phash), set()):
+                output[path] = distance
+        return output
+
+    def paths_with_size(self, size: str) -> pds.PathSet:
+        return self.data.by_size.get(size, set())
+
+    def paths_with_partial_hash(self, partial_hash: str) -> pds.PathSet:
+        return self.data.by_partial_hash.get(partial_hash, set())
+
+    def paths_with_image_properties(self, image_properties: pdc.PropertyDict) -> pds.PathSet:
+        key = image_properties_key(image_properties)
+        if not key:
+            return set()
+        return self.data.by_image_properties.get(key, set())
+
+    def image_date_range(self) -> Tuple[str, str]:
+        return self.data.oldest_image_date, self.data.newest_image_date
+
+    def paths_with_image_time_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        return self.data.by_image_time.paths_between(oldest, newest)
+
+    def remove_paths(self, paths: pds.PathSet):
+        self.data.remove_paths(paths)
+        self.file_series_splitter.remove_paths(paths)
+        if self.journal is not None:
+            for path in paths:
+                self.journal.record(path, None)
+
+    def __len__(self) -> int:
+        return len(self.data.by_path)
 
-        # by_series_copy = list()
-        # for val in self.file_series_splitter.all_file_series:
-        #     by_series_copy.append(jsonable.encode(val))
+    def directory_summary(self, dir_path: pds.Path) -> pdds.DirectorySummary:
+        return self.data.by_dir.get(dir_path)
 
-        storage_dict = jsonable.encode(self.data)
-        storage_dict[pdc.KEY_BY_SERIES] = jsonable.encode(sorted(self.file_series_splitter.all_file_series))
+    def set_directory_summaries(self, summaries: pdds.DirectorySummaries):
+        self.data.by_dir.update(summaries)
 
-        json_string = json.dumps(obj=storage_dict, indent=2, sort_keys=True)
-        self.platform.write_text_file(path, json_string)
+    def _set_indexed_file_hash(self, path: pds.Path, file_hash: str):
+        self.data.set_file_hash(path, file_hash)
+        self._journal_record(path)
 
-    def load(path: pds.Path, platform: pds.Platform) -> None:
+    def _set_indexed_partial_hash(self, path: pds.Path, partial_hash: str):
+        self.data.set_partial_hash(path, partial_hash)
+        self._journal_record(path)
+
+    def commit(self):
+        if self.journal is not None:
+            self.journal.flush()
+
+    def stop_persisting(self):
+        self.commit()
+        self.journal = None
+
+    def save(self, path: pds.Path, pretty: bool = False) -> str:
+        """
+        Streams the JSON into a temp file, that replaces `path` once it is complete.
+        With `pretty`, it all gets indented: readable, but built in memory first, and much bigger.
+        """
+        if pretty:
+            storage_dict = jsonable.encode(self.data)
+            storage_dict[pdc.KEY_BY_SERIES] = jsonable.encode(sorted(self.file_series_splitter.all_file_series))
+            chunks = [json.dumps(obj=storage_dict, indent=2, sort_keys=True)]
+        else:
+            sections = self.data.json_section_chunks()
+            sections[pdc.KEY_BY_SERIES] = list_json_chunks(
+                jsonable.encode(file_series) for file_series in sorted(self.file_series_splitter.all_file_series))
+            chunks = sections_json_chunks(sections)
+        self.platform.write_text_chunks(path, chunks)
+
+        # Everything in the journal is in the snapshot now:
+        if self.journal is not None and self.journal.snapshot_path == path:
+            self.journal.clear()
+
+    def load(path: pds.Path, platform: pds.Platform, journaled: bool = False, read_only: bool = False) -> None:
+        """
+        With `journaled`, every add() also goes to an append-only journal next to the JSON file.
+        A journal left behind by a crashed run gets replayed, and compacted into a new snapshot.
+        With `read_only`, such a journal only gets replayed in memory: nothing gets written.
+        """
         index_store = IndexStore(platform)
         if not platform.path_exists(path):
             print("WARNING: No JSON file found. Starting new one.")
-            return index_store
-        content = platform.read_text_file(path)
-        index_store_data_dict = json.loads(content)
-        index_store.data = jsonable.decode(index_store_data_dict, IndexStoreData)
-
-        # Rebuild self.file_series_splitter.all_file_series:
-        for path, properties in index_store.data.by_path.items():
-            index_store.file_series_splitter.add_path(path, properties)
+        else:
+            content = platform.read_text_file(path)
+            sections = json_sections(content)
+            parsed = json.loads(content) if sections is None else None  # Not laid out by save(): parse it all
+            del content
+
+            def section_of(key: str):
+                """Every section gets decoded once. What it was decoded from can go."""
+                if parsed is not None:
+                    return parsed.pop(key, None)
+                return json.loads(sections.pop(key)) if key in sections else None
+            index_store.defer_sections(section_of)
+
+        if journaled or read_only:
+            journal = pdj.IndexJournal(platform, path)
+            if not read_only:
+                index_store.journal = journal
+            if not journal.is_empty():
+                print(f"Replaying {journal.path}...")
+                replayed = dict(journal.records())  # The last record of a path wins
+                removed = {image_path for image_path, properties in replayed.items() if properties is None}
+                index_store.data.remove_paths(removed)
+                index_store.file_series_splitter.remove_paths(removed)
+                for image_path, properties in replayed.items():
+                    if properties is None:
+                        continue
+                    is_new = not image_path in index_store.data.by_path
+                    index_store.data.add(image_path, properties)
+                    if is_new:
+                        index_store.file_series_splitter.add_path(image_path, properties)
+                if not read_only:
+                    index_store.save(path)
 
         return index_store
 
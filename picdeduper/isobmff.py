@@ -0,0 +1,428 @@
+import io
+import re
+import struct
+
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import exif as pdexif
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A minimal ISO base media file format (ISO/IEC 14496-12) box walker, for
+#  the metadata of .HEIC, .MOV and .MP4 files.
+#
+#  It only reads box headers and the few small boxes that hold metadata, and
+#  seeks right past everything else (like the multi-GB `mdat` of a video).
+#
+#  Like exif.py, it returns the kMDItem* keys that mdls would.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01 (Unix epoch):
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+# Never read more than this of a single metadata box:
+MAX_METADATA_BOX_SIZE = 4 * 1024 * 1024
+
+RE_ISO6709 = re.compile(r"^([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)?")
+
+MDTA_KEY_LOCATION = "com.apple.quicktime.location.ISO6709"
+MDTA_KEY_MAKE = "com.apple.quicktime.make"
+MDTA_KEY_MODEL = "com.apple.quicktime.model"
+MDTA_KEY_SOFTWARE = "com.apple.quicktime.software"
+MDTA_KEY_CREATION_DATE = "com.apple.quicktime.creationdate"
+
+
+class IsoBmffError(Exception):
+    pass
+
+
+class Box:
+    def __init__(self, box_type: bytes, start: int, header_size: int, size: int) -> None:
+        self.type = box_type
+        self.start = start
+        self.header_size = header_size
+        self.size = size
+
+    def payload_start(self) -> int:
+        return self.start + self.header_size
+
+    def end(self) -> int:
+        return self.start + self.size
+
+    def payload_size(self) -> int:
+        return self.size - self.header_size
+
+
+def iter_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """Yields the boxes between `start` and `end`, by reading only their headers."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">L4s", header)
+        header_size = 8
+        if size == 1:
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                return
+            (size,) = struct.unpack(">Q", large_size)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise IsoBmffError(f"Invalid size of box {box_type}")
+        yield Box(box_type, pos, header_size, size)
+        pos += size
+
+
+def _file_size(f: BinaryIO) -> int:
+    size = f.seek(0, io.SEEK_END)
+    f.seek(0)
+    return size
+
+
+def _read_payload(f: BinaryIO, box: Box, skip: int = 0) -> bytes:
+    """Reads a (small) box, minus its header, and minus `skip` bytes (e.g. FullBox version & flags)"""
+    size = box.payload_size() - skip
+    if size < 0:
+        raise IsoBmffError(f"Box {box.type} is too small")
+    if size > MAX_METADATA_BOX_SIZE:
+        raise IsoBmffError(f"Box {box.type} is too big for metadata")
+    f.seek(box.payload_start() + skip)
+    return f.read(size)
+
+
+def _children(f: BinaryIO, box: Box, skip: int = 0) -> Dict[bytes, List[Box]]:
+    output: Dict[bytes, List[Box]] = dict()
+    for child in iter_boxes(f, box.payload_start() + skip, box.end()):
+        output.setdefault(child.type, list()).append(child)
+    return output
+
+
+def _first(boxes: Dict[bytes, List[Box]], box_type: bytes) -> Box:
+    found = boxes.get(box_type)
+    return found[0] if found else None
+
+
+def _uint(data: bytes, offset: int, size: int) -> Tuple[int, int]:
+    """Reads a big-endian unsigned int of `size` bytes (0 is allowed). Returns (value, new offset)."""
+    if size == 0:
+        return 0, offset
+    if offset + size > len(data):
+        raise IsoBmffError("Truncated box")
+    return int.from_bytes(data[offset:offset + size], "big"), offset + size
+
+
+def _number_string(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.10g}"
+
+
+def _put(output: pdc.PropertyDict, key: str, value) -> None:
+    if value is None or value == "":
+        return
+    output[key] = value
+
+
+# # # # # # # # # # # # # # # # # # #
+#    HEIF (.HEIC): the `meta` box   #
+# # # # # # # # # # # # # # # # # # #
+
+def _heif_item_types(data: bytes, f: BinaryIO, iinf: Box) -> Dict[int, bytes]:
+    """Returns {item_ID: item_type} from the `infe` boxes in `iinf`"""
+    version = data[0]
+    entry_count_size = 2 if version == 0 else 4
+    item_types: Dict[int, bytes] = dict()
+    for infe in iter_boxes(f, iinf.payload_start() + 4 + entry_count_size, iinf.end()):
+        if infe.type != b"infe":
+            continue
+        payload = _read_payload(f, infe)
+        infe_version = payload[0]
+        if infe_version < 2:
+            continue  # No item types before version 2
+        item_id_size = 2 if infe_version == 2 else 4
+        item_id, offset = _uint(payload, 4, item_id_size)
+        offset += 2  # item_protection_index
+        item_types[item_id] = payload[offset:offset + 4]
+    return item_types
+
+
+def _heif_item_extents(data: bytes) -> Dict[int, List[Tuple[int, int]]]:
+    """Parses `iloc` into {item_ID: [(absolute file offset, length)]}"""
+    version = data[0]
+    offset_size = data[4] >> 4
+    length_size = data[4] & 0x0F
+    base_offset_size = data[5] >> 4
+    index_size = (data[5] & 0x0F) if version in (1, 2) else 0
+    offset = 6
+    item_count, offset = _uint(data, offset, 2 if version < 2 else 4)
+    extents: Dict[int, List[Tuple[int, int]]] = dict()
+    for _ in range(item_count):
+        item_id, offset = _uint(data, offset, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, offset = _uint(data, offset, 2)
+            construction_method &= 0x0F
+        _, offset = _uint(data, offset, 2)  # data_reference_index
+        base_offset, offset = _uint(data, offset, base_offset_size)
+        extent_count, offset = _uint(data, offset, 2)
+        item_extents = list()
+        for _ in range(extent_count):
+            _, offset = _uint(data, offset, index_size)
+            extent_offset, offset = _uint(data, offset, offset_size)
+            extent_length, offset = _uint(data, offset, length_size)
+            item_extents.append((base_offset + extent_offset, extent_length))
+        if construction_method == 0:  # Only plain file offsets. Not `idat` or item references.
+            extents[item_id] = item_extents
+    return extents
+
+
+def _heif_image_size(f: BinaryIO, meta_children: Dict[bytes, List[Box]]) -> Tuple[int, int, int]:
+    """Returns (height, width, bits per pixel) of the biggest image in `iprp/ipco`"""
+    iprp = _first(meta_children, b"iprp")
+    if not iprp:
+        return (None, None, None)
+    ipco = _first(_children(f, iprp), b"ipco")
+    if not ipco:
+        return (None, None, None)
+    properties = _children(f, ipco)
+    height, width, bits = None, None, None
+    for ispe in properties.get(b"ispe", list()):
+        payload = _read_payload(f, ispe, skip=4)
+        if len(payload) < 8:
+            continue
+        ispe_width, ispe_height = struct.unpack_from(">LL", payload)
+        if (not width) or (ispe_width * ispe_height > width * height):
+            width, height = ispe_width, ispe_height
+    pixi = _first(properties, b"pixi")
+    if pixi:
+        payload = _read_payload(f, pixi, skip=4)
+        if payload:
+            bits = sum(payload[1:1 + payload[0]])
+    return (height, width, bits)
+
+
+def _heif_exif(f: BinaryIO, meta_children: Dict[bytes, List[Box]]) -> bytes:
+    """Returns the TIFF part of the `Exif` item, or None"""
+    iinf = _first(meta_children, b"iinf")
+    iloc = _first(meta_children, b"iloc")
+    if not iinf or not iloc:
+        return None
+    item_types = _heif_item_types(_read_payload(f, iinf), f, iinf)
+    extents = _heif_item_extents(_read_payload(f, iloc))
+    for item_id, item_type in item_types.items():
+        if item_type != b"Exif" or not item_id in extents:
+            continue
+        data = b""
+        for extent_offset, extent_length in extents[item_id]:
+            if extent_length > MAX_METADATA_BOX_SIZE:
+                raise IsoBmffError("Exif item is too big")
+            f.seek(extent_offset)
+            data += f.read(extent_length)
+        if len(data) < 4:
+            return None
+        (tiff_header_offset,) = struct.unpack_from(">L", data)
+        return data[4 + tiff_header_offset:]
+    return None
+
+
+def _mdls_properties_of_heif(f: BinaryIO, meta: Box) -> pdc.PropertyDict:
+    output: pdc.PropertyDict = dict()
+    meta_children = _children(f, meta, skip=4)
+    tiff_data = _heif_exif(f, meta_children)
+    if tiff_data:
+        try:
+            output.update(pdexif.mdls_properties_from_tiff(pdexif.parse_tiff(tiff_data)))
+        except pdexif.ExifError:
+            pass
+    height, width, bits = _heif_image_size(f, meta_children)
+    if height and width:
+        output["kMDItemPixelHeight"] = str(height)
+        output["kMDItemPixelWidth"] = str(width)
+    if bits:
+        output["kMDItemBitsPerSample"] = str(bits)
+    return output
+
+
+# # # # # # # # # # # # # # # # # # #
+#   QuickTime (.MOV, .MP4): `moov`  #
+# # # # # # # # # # # # # # # # # # #
+
+def _quicktime_time_string(seconds_since_1904: int) -> str:
+    if not seconds_since_1904:
+        return None
+    timestamp = seconds_since_1904 - QUICKTIME_EPOCH_OFFSET
+    utc = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=timestamp)
+    return utc.strftime("%Y-%m-%d %H:%M:%S +0000")
+
+
+def _iso8601_time_string(iso_time: str) -> str:
+    """e.g. '2019-12-24T19:12:06-0800' -> '2019-12-25 03:12:06 +0000'"""
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z"):
+        try:
+            parsed = datetime.strptime(iso_time.strip(), fmt)
+            return parsed.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S +0000")
+        except ValueError:
+            continue
+    return None
+
+
+def _put_iso6709(output: pdc.PropertyDict, iso6709: str) -> None:
+    """e.g. '+37.3354-121.8930+012.000/'"""
+    matches = RE_ISO6709.match(iso6709 or "")
+    if not matches:
+        return
+    _put(output, "kMDItemLatitude", _number_string(float(matches.group(1))))
+    _put(output, "kMDItemLongitude", _number_string(float(matches.group(2))))
+    if matches.group(3):
+        _put(output, "kMDItemAltitude", _number_string(float(matches.group(3))))
+
+
+def _mvhd_times(payload: bytes) -> Tuple[int, int]:
+    """Returns (creation, modification) time of a `mvhd` (or `tkhd`) box, without its header"""
+    version = payload[0]
+    if version == 1:
+        return struct.unpack_from(">QQ", payload, 4)
+    return struct.unpack_from(">LL", payload, 4)
+
+
+def _tkhd_size(payload: bytes) -> Tuple[int, int]:
+    """Returns (height, width) of a `tkhd` box, without its header"""
+    version = payload[0]
+    offset = 4 + (32 if version == 1 else 20) + 8 + 8 + 36
+    if len(payload) < offset + 8:
+        return (0, 0)
+    width, height = struct.unpack_from(">LL", payload, offset)
+    return (height >> 16, width >> 16)
+
+
+def _udta_string(payload: bytes) -> str:
+    """The payload of a QuickTime `©xxx` user data box: u16 size, u16 language, text"""
+    if len(payload) < 4:
+        return None
+    (size,) = struct.unpack_from(">H", payload)
+    return payload[4:4 + size].decode("utf-8", errors="replace").strip("\x00 ")
+
+
+def _mdta_items(f: BinaryIO, meta: Box) -> Dict[str, object]:
+    """Returns {key: value} of the QuickTime `meta/keys` + `meta/ilst` boxes"""
+    # QuickTime's `meta` is a plain box, MP4's a FullBox. A child `hdlr` tells which one it is.
+    f.seek(meta.payload_start() + 4)
+    skip = 0 if f.read(4) == b"hdlr" else 4
+    children = _children(f, meta, skip=skip)
+    keys_box = _first(children, b"keys")
+    ilst = _first(children, b"ilst")
+    if not keys_box or not ilst:
+        return dict()
+    data = _read_payload(f, keys_box, skip=4)
+    if len(data) < 4:
+        raise IsoBmffError("Truncated keys box")
+    (entry_count,) = struct.unpack_from(">L", data)
+    keys: List[str] = list()
+    offset = 4
+    for _ in range(entry_count):
+        if offset + 8 > len(data):
+            raise IsoBmffError("Key out of the keys box")
+        key_size, _namespace = struct.unpack_from(">L4s", data, offset)
+        if key_size < 8 or offset + key_size > len(data):
+            raise IsoBmffError(f"Bad key size {key_size} in the keys box")
+        keys.append(data[offset + 8:offset + key_size].decode("utf-8", errors="replace"))
+        offset += key_size
+    items: Dict[str, object] = dict()
+    for item in iter_boxes(f, ilst.payload_start(), ilst.end()):
+        key_index = struct.unpack(">L", item.type)[0]
+        if key_index < 1 or key_index > len(keys):
+            continue
+        data_box = _first(_children(f, item), b"data")
+        if not data_box:
+            continue
+        payload = _read_payload(f, data_box)
+        if len(payload) < 8:
+            continue
+        type_indicator = struct.unpack_from(">L", payload)[0] & 0x00FFFFFF
+        value = payload[8:]
+        if type_indicator == 1:  # UTF-8
+            items[keys[key_index - 1]] = value.decode("utf-8", errors="replace")
+    return items
+
+
+def _mdls_properties_of_movie(f: BinaryIO, moov: Box) -> pdc.PropertyDict:
+    output: pdc.PropertyDict = dict()
+    children = _children(f, moov)
+
+    mvhd = _first(children, b"mvhd")
+    if mvhd:
+        creation_time, modification_time = _mvhd_times(_read_payload(f, mvhd))
+        _put(output, "kMDItemContentCreationDate", _quicktime_time_string(creation_time))
+        _put(output, "kMDItemContentModificationDate", _quicktime_time_string(modification_time))
+
+    for trak in children.get(b"trak", list()):
+        tkhd = _first(_children(f, trak), b"tkhd")
+        if not tkhd:
+            continue
+        height, width = _tkhd_size(_read_payload(f, tkhd))
+        if height and width:
+            output["kMDItemPixelHeight"] = str(height)
+            output["kMDItemPixelWidth"] = str(width)
+            break
+
+    udta = _first(children, b"udta")
+    if udta:
+        udta_children = _children(f, udta)
+        for box_type, key in ((b"\xa9mod", "kMDItemAcquisitionModel"), (b"\xa9swr", "kMDItemCreator")):
+            box = _first(udta_children, box_type)
+            if box:
+                _put(output, key, _udta_string(_read_payload(f, box)))
+        xyz = _first(udta_children, b"\xa9xyz")
+        if xyz:
+            _put_iso6709(output, _udta_string(_read_payload(f, xyz)))
+
+    meta = _first(children, b"meta")
+    if meta:
+        items = _mdta_items(f, meta)
+        _put(output, "kMDItemAcquisitionModel", items.get(MDTA_KEY_MODEL))
+        _put(output, "kMDItemCreator", items.get(MDTA_KEY_SOFTWARE))
+        _put_iso6709(output, items.get(MDTA_KEY_LOCATION))
+        if MDTA_KEY_CREATION_DATE in items:
+            creation_date = _iso8601_time_string(items[MDTA_KEY_CREATION_DATE])
+            _put(output, "kMDItemContentCreationDate", creation_date)
+            _put(output, "kMDItemContentModificationDate", creation_date)
+    return output
+
+
+def read_heif_exif(f: BinaryIO) -> bytes:
+    """Returns the TIFF part of the Exif item of a .HEIC file, or None"""
+    try:
+        for box in iter_boxes(f, 0, _file_size(f)):
+            if box.type == b"meta":
+                return _heif_exif(f, _children(f, box, skip=4))
+    except (struct.error, IndexError) as e:
+        raise IsoBmffError(f"Truncated box: {e}")
+    return None
+
+
+def mdls_properties_of_isobmff(f: BinaryIO) -> pdc.PropertyDict:
+    """Returns the kMDItem* properties of a .HEIC (`meta`) or .MOV/.MP4 (`moov`) file"""
+    try:
+        return _mdls_properties_of_isobmff(f)
+    except (struct.error, IndexError) as e:
+        raise IsoBmffError(f"Truncated box: {e}")
+
+
+def _mdls_properties_of_isobmff(f: BinaryIO) -> pdc.PropertyDict:
+    end = _file_size(f)
+    top_level = dict()
+    for box in iter_boxes(f, 0, end):
+        if box.type in (b"meta", b"moov"):
+            top_level[box.type] = box
+    if b"moov" in top_level:
+        return _mdls_properties_of_movie(f, top_level[b"moov"])
+    if b"meta" in top_level:
+        return _mdls_properties_of_heif(f, top_level[b"meta"])
+    raise IsoBmffError("Neither a `moov` nor a `meta` box")
@@ -0,0 +1,73 @@
+import json
+
+from typing import Iterator, List, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  An append-only journal of what got added to (or removed from) an
+#  IndexStore since its last snapshot (the JSON file), next to it:
+#
+#     picdedupe.json  +  picdedupe.json.journal
+#
+#  One compact JSON line per record: [path, image_properties], or
+#  [path, null] for a path that got removed.
+#
+#  Records get appended (and fsync'ed) in groups. Loading the IndexStore
+#  replays the journal on top of the snapshot, so a crashed run loses at
+#  most the last group. A torn last line gets ignored.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+JOURNAL_EXT = ".journal"
+
+DEFAULT_FLUSH_EVERY = 64  # records
+
+
+def journal_path_of(snapshot_path: pds.Path) -> pds.Path:
+    return snapshot_path + JOURNAL_EXT
+
+
+class IndexJournal:
+
+    def __init__(self, platform: pds.Platform, snapshot_path: pds.Path, flush_every: int = DEFAULT_FLUSH_EVERY) -> None:
+        self.platform = platform
+        self.snapshot_path = snapshot_path
+        self.path = journal_path_of(snapshot_path)
+        self.flush_every = flush_every
+        self.pending: List[str] = list()
+
+    def record(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        """Serializes right away: `image_properties` may still change after this. None for a removal."""
+        record = [path, None if image_properties is None else dict(image_properties)]
+        line = json.dumps(record, separators=(",", ":"), sort_keys=True) + "\n"
+        self.pending.append(line)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.platform.append_text_file(self.path, "".join(self.pending))
+        self.pending = list()
+
+    def is_empty(self) -> bool:
+        return not self.platform.path_exists(self.path) or not self.platform.read_text_file(self.path)
+
+    def records(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        if not self.platform.path_exists(self.path):
+            return
+        for line in self.platform.read_text_file(self.path).splitlines():
+            try:
+                path, image_properties = json.loads(line)
+            except ValueError:
+                print(f"WARNING: Ignoring the torn end of {self.path}.")
+                return
+            yield path, image_properties
+
+    def clear(self):
+        """Once the records made it into a new snapshot"""
+        self.pending = list()
+        self.platform.write_text_file(self.path, "")
@@ -0,0 +1,328 @@
+import struct
+
+from typing import Dict, List, Tuple
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A DC-only JPEG decoder: a 1/8-scale grayscale version of a JPEG, without
+#  any inverse DCT. Every 8x8 block of the luma channel becomes one pixel.
+#
+#  The AC coefficients still have to be Huffman-decoded (to find where the
+#  next block starts), but they get dropped right away.
+#
+#  Handles baseline & extended Huffman JPEGs, and the first (DC) scan of
+#  progressive JPEGs. Plenty for a perceptual hash; nothing more.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+MARKER_SOI = 0xD8
+MARKER_EOI = 0xD9
+MARKER_SOS = 0xDA
+MARKER_DQT = 0xDB
+MARKER_DHT = 0xC4
+MARKER_DRI = 0xDD
+MARKER_SOF_BASELINE = (0xC0, 0xC1)
+MARKER_SOF_PROGRESSIVE = 0xC2
+MARKERS_RST = range(0xD0, 0xD8)
+
+FAST_BITS = 9
+
+
+class JpegDcError(Exception):
+    pass
+
+
+class _HuffmanTable:
+
+    def __init__(self, counts: bytes, symbols: bytes) -> None:
+        if sum(counts) > len(symbols):
+            raise JpegDcError("Truncated Huffman table")
+        self.fast: List[Tuple[int, int]] = [None] * (1 << FAST_BITS)
+        self.max_code = [-1] * 17
+        self.first_code = [0] * 17
+        self.first_index = [0] * 17
+        self.symbols = symbols
+        code = 0
+        index = 0
+        for length in range(1, 17):
+            count = counts[length - 1]
+            self.first_code[length] = code
+            self.first_index[length] = index
+            if code + count > (1 << length):
+                raise JpegDcError(f"Too many Huffman codes of {length} bits")
+            for _ in range(count):
+                if length <= FAST_BITS:
+                    shift = FAST_BITS - length
+                    for fast_index in range(code << shift, (code + 1) << shift):
+                        self.fast[fast_index] = (length, symbols[index])
+                code += 1
+                index += 1
+            self.max_code[length] = code - 1 if count else -1
+            code <<= 1
+
+
+class _BitReader:
+    """Reads the entropy-coded data, dropping the stuffed zero after every 0xFF"""
+
+    def __init__(self, data: bytes, pos: int) -> None:
+        self.data = data
+        self.pos = pos
+        self.acc = 0
+        self.bits = 0
+
+    def _fill(self, count: int) -> None:
+        data = self.data
+        while self.bits < count:
+            byte = 0
+            if self.pos < len(data):
+                byte = data[self.pos]
+                if byte != 0xFF:
+                    self.pos += 1
+                elif self.pos + 1 < len(data) and data[self.pos + 1] == 0x00:
+                    self.pos += 2
+                else:
+                    byte = 0  # A marker: pad with zeros, and stay in front of it
+            self.acc = (self.acc << 8) | byte
+            self.bits += 8
+
+    def peek(self, count: int) -> int:
+        if self.bits < count:
+            self._fill(count)
+        return (self.acc >> (self.bits - count)) & ((1 << count) - 1)
+
+    def skip(self, count: int) -> None:
+        self.bits -= count
+        self.acc &= (1 << self.bits) - 1
+
+    def receive(self, count: int) -> int:
+        if not count:
+            return 0
+        value = self.peek(count)
+        self.skip(count)
+        return value
+
+    def decode(self, table: _HuffmanTable) -> int:
+        entry = table.fast[self.peek(FAST_BITS)]
+        if entry:
+            self.skip(entry[0])
+            return entry[1]
+        code = self.peek(16)
+        for length in range(FAST_BITS + 1, 17):
+            prefix = code >> (16 - length)
+            if prefix <= table.max_code[length]:
+                self.skip(length)
+                return table.symbols[table.first_index[length] + prefix - table.first_code[length]]
+        raise JpegDcError("Invalid Huffman code")
+
+    def restart(self) -> None:
+        """Skips to right after the next RSTn marker"""
+        self.acc = 0
+        self.bits = 0
+        data = self.data
+        while self.pos + 1 < len(data):
+            if data[self.pos] == 0xFF and data[self.pos + 1] in MARKERS_RST:
+                self.pos += 2
+                return
+            self.pos += 1
+
+
+def _extend(value: int, size: int) -> int:
+    if size and value < (1 << (size - 1)):
+        return value - (1 << size) + 1
+    return value
+
+
+def _skip_entropy_data(data: bytes, pos: int) -> int:
+    """Returns the position of the next marker that is not a RSTn"""
+    while pos + 1 < len(data):
+        if data[pos] == 0xFF and data[pos + 1] != 0x00 and not data[pos + 1] in MARKERS_RST:
+            return pos
+        pos += 1
+    return len(data)
+
+
+class _Component:
+
+    def __init__(self, component_id: int, h: int, v: int, quant_table: int) -> None:
+        self.id = component_id
+        self.h = h
+        self.v = v
+        self.quant_table = quant_table
+
+
+class _Frame:
+
+    def __init__(self, payload: bytes, progressive: bool) -> None:
+        self.progressive = progressive
+        _precision, self.height, self.width, count = struct.unpack_from(">BHHB", payload)
+        self.components: List[_Component] = list()
+        for i in range(count):
+            component_id, hv, quant_table = struct.unpack_from(">BBB", payload, 6 + 3 * i)
+            self.components.append(_Component(component_id, hv >> 4, hv & 0x0F, quant_table))
+        if not self.components or not self.width or not self.height:
+            raise JpegDcError("Invalid frame header")
+        if any(not (1 <= x.h <= 4 and 1 <= x.v <= 4) for x in self.components):
+            raise JpegDcError("Invalid sampling factors")
+        self.h_max = max(x.h for x in self.components)
+        self.v_max = max(x.v for x in self.components)
+        self.mcus_x = -(-self.width // (8 * self.h_max))
+        self.mcus_y = -(-self.height // (8 * self.v_max))
+        self.luma_blocks_x, self.luma_blocks_y = self.blocks_of(self.components[0])
+
+    def blocks_of(self, component: _Component) -> Tuple[int, int]:
+        """Blocks per line & per column of a component, when it is alone in a scan"""
+        width = -(-self.width * component.h // self.h_max)
+        height = -(-self.height * component.v // self.v_max)
+        return -(-width // 8), -(-height // 8)
+
+
+class _Decoder:
+
+    def __init__(self, data: bytes, max_blocks: int = None) -> None:
+        self.data = data
+        self.max_blocks = max_blocks
+        self.dc_quant: Dict[int, int] = dict()
+        self.dc_tables: Dict[int, _HuffmanTable] = dict()
+        self.ac_tables: Dict[int, _HuffmanTable] = dict()
+        self.restart_interval = 0
+        self.frame: _Frame = None
+
+    def _read_dqt(self, payload: bytes) -> None:
+        pos = 0
+        while pos + 1 < len(payload):
+            precision, table_id = payload[pos] >> 4, payload[pos] & 0x0F
+            if precision:
+                (self.dc_quant[table_id],) = struct.unpack_from(">H", payload, pos + 1)
+                pos += 1 + 128
+            else:
+                self.dc_quant[table_id] = payload[pos + 1]
+                pos += 1 + 64
+
+    def _read_dht(self, payload: bytes) -> None:
+        pos = 0
+        while pos + 17 <= len(payload):
+            table_class, table_id = payload[pos] >> 4, payload[pos] & 0x0F
+            counts = payload[pos + 1:pos + 17]
+            total = sum(counts)
+            symbols = payload[pos + 17:pos + 17 + total]
+            tables = self.ac_tables if table_class else self.dc_tables
+            tables[table_id] = _HuffmanTable(counts, symbols)
+            pos += 17 + total
+
+    def _decode_scan(self, payload: bytes, pos: int, output: List[int]) -> Tuple[int, bool]:
+        """Decodes one scan. Returns where it ends, and whether the luma DC is complete."""
+        frame = self.frame
+        count = payload[0]
+        scan_components = list()
+        for i in range(count):
+            component_id, tables = payload[1 + 2 * i], payload[2 + 2 * i]
+            component = next((x for x in frame.components if x.id == component_id), None)
+            if not component:
+                raise JpegDcError("Unknown component in scan")
+            scan_components.append((component, tables >> 4, tables & 0x0F))
+        spectral_start, _spectral_end, approximation = struct.unpack_from(">BBB", payload, 1 + 2 * count)
+        successive_high, successive_low = approximation >> 4, approximation & 0x0F
+        luma = frame.components[0]
+
+        is_dc_scan = (spectral_start == 0) and (successive_high == 0)
+        if (not is_dc_scan) or (not any(x[0] is luma for x in scan_components)):
+            return _skip_entropy_data(self.data, pos), False
+
+        reader = _BitReader(self.data, pos)
+        with_ac = not frame.progressive
+        predictions = [0] * len(scan_components)
+        if len(scan_components) == 1:
+            blocks_x, blocks_y = frame.blocks_of(scan_components[0][0])
+            layout = [(0, 0, 0)]
+            mcus_x, mcus_y = blocks_x, blocks_y
+        else:
+            layout = [(i, bx, by)
+                      for i, (component, _, _) in enumerate(scan_components)
+                      for by in range(component.v) for bx in range(component.h)]
+            mcus_x, mcus_y = frame.mcus_x, frame.mcus_y
+
+        for mcu in range(mcus_x * mcus_y):
+            if self.restart_interval and mcu and (mcu % self.restart_interval == 0):
+                reader.restart()
+                predictions = [0] * len(scan_components)
+            mcu_x, mcu_y = mcu % mcus_x, mcu // mcus_x
+            for i, bx, by in layout:
+                component, dc_table_id, ac_table_id = scan_components[i]
+                size = reader.decode(self.dc_tables[dc_table_id])
+                predictions[i] += _extend(reader.receive(size), size)
+                if with_ac:
+                    ac_table = self.ac_tables[ac_table_id]
+                    k = 1
+                    while k < 64:
+                        run_size = reader.decode(ac_table)
+                        run, size = run_size >> 4, run_size & 0x0F
+                        if size:
+                            k += run + 1
+                            reader.receive(size)
+                        elif run == 15:
+                            k += 16
+                        else:
+                            break
+                if component is luma:
+                    if len(scan_components) == 1:
+                        x, y = mcu_x, mcu_y
+                    else:
+                        x, y = mcu_x * component.h + bx, mcu_y * component.v + by
+                    if x < frame.luma_blocks_x and y < frame.luma_blocks_y:
+                        output[y * frame.luma_blocks_x + x] = predictions[i] << successive_low
+        return _skip_entropy_data(self.data, reader.pos), True
+
+    def decode(self) -> Tuple[List[int], int, int]:
+        data = self.data
+        if data[:2] != bytes([0xFF, MARKER_SOI]):
+            raise JpegDcError("Not a JPEG")
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                raise JpegDcError("Invalid marker")
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker == MARKER_EOI:
+                break
+            (length,) = struct.unpack_from(">H", data, pos + 2)
+            payload = data[pos + 4:pos + 2 + length]
+            pos += 2 + length
+            if marker == MARKER_DQT:
+                self._read_dqt(payload)
+            elif marker == MARKER_DHT:
+                self._read_dht(payload)
+            elif marker == MARKER_DRI:
+                (self.restart_interval,) = struct.unpack_from(">H", payload)
+            elif marker in MARKER_SOF_BASELINE or marker == MARKER_SOF_PROGRESSIVE:
+                self.frame = _Frame(payload, progressive=(marker == MARKER_SOF_PROGRESSIVE))
+                if self.max_blocks and self.frame.luma_blocks_x * self.frame.luma_blocks_y > self.max_blocks:
+                    raise JpegDcError(f"Too large to DC-decode ({self.frame.width}x{self.frame.height})")
+            elif (marker & 0xF0) == 0xC0 and not marker in (MARKER_DHT, 0xC8, 0xCC):
+                raise JpegDcError(f"Unsupported JPEG coding (SOF{marker & 0x0F})")
+            elif marker == MARKER_SOS:
+                if not self.frame:
+                    raise JpegDcError("Scan before frame header")
+                output = [0] * (self.frame.luma_blocks_x * self.frame.luma_blocks_y)
+                try:
+                    pos, is_done = self._decode_scan(payload, pos, output)
+                except (KeyError, IndexError) as e:
+                    raise JpegDcError(f"Corrupt scan: {e}")
+                if is_done:
+                    quant = self.dc_quant.get(self.frame.components[0].quant_table, 1)
+                    pixels = [min(255, max(0, 128 + (dc * quant) // 8)) for dc in output]
+                    return pixels, self.frame.luma_blocks_x, self.frame.luma_blocks_y
+        raise JpegDcError("No luma DC scan found")
+
+
+def decode_dc_grayscale(data: bytes, max_blocks: int = None) -> Tuple[List[int], int, int]:
+    """
+    Returns (pixels, width, height) of the 1/8-scale grayscale version of JPEG `data`.
+    Every pixel is the mean brightness (0-255) of an 8x8 block of the original.
+    Raises JpegDcError for a JPEG of more than `max_blocks` luma blocks, as it decodes every AC symbol in Python.
+    """
+    try:
+        return _Decoder(data, max_blocks).decode()
+    except struct.error as e:
+        raise JpegDcError(f"Truncated JPEG: {e}")
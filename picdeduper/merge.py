@@ -0,0 +1,141 @@
+import heapq
+
+from typing import Dict, List, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import evaluation as pdeval
+from picdeduper import fileseries as pfs
+from picdeduper import platform as pds
+from picdeduper import records as pdr
+from picdeduper import time as pdt
+from picdeduper.indexstore import IndexStore, IndexStoreData
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Merges indexes that were built independently (e.g. of different volumes,
+#  on different machines) into one, without adding every entry again:
+#
+#     by_path                 union. A path in more than one index keeps one
+#                             entry, see resolve_path_conflict()
+#     by_hash, by_filename,   union of the path sets
+#     by_phash
+#     image date stats        min of the oldest, max of the newest
+#     by_dir                  union. The last index wins
+#     series                  k-way merge, by file prefix & number
+#
+#  The lookups that are not persisted get rebuilt on first use, as on load.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def _is_modified_later(a: pdc.PropertyDict, b: pdc.PropertyDict) -> bool:
+    if not pdeval.is_legacy_quick_signature(a) and not pdeval.is_legacy_quick_signature(b):
+        return int(a[pdc.KEY_FILE_MTIME_NS]) > int(b[pdc.KEY_FILE_MTIME_NS])
+    return pdt.timestamp_from_string(a[pdc.KEY_FILE_DATE]) > pdt.timestamp_from_string(b[pdc.KEY_FILE_DATE])
+
+
+def resolve_path_conflict(a: pdc.PropertyDict, b: pdc.PropertyDict) -> pdc.PropertyDict:
+    """
+    Returns the entry to keep of `a` & `b`, entries of the same path in different indexes.
+    Same quick signature: the same file, with what either of them knows (e.g. a backfilled hash).
+    Otherwise, the file changed in between: the entry of the last modification wins.
+    """
+    if pdeval.is_quick_signature_equal(a, b):
+        output = pdr.ImageRecord(a)
+        for key, value in b.items():
+            if output.get(key) is None:
+                output[key] = value
+        return output
+    return b if _is_modified_later(b, a) else a
+
+
+def _union_into(output: Dict[str, pds.PathSet], other: Dict[str, pds.PathSet]):
+    """Takes over the path sets of `other`, for the keys that `output` does not have yet"""
+    common_keys = output.keys() & other.keys()
+    for key in common_keys:
+        output[key] |= other[key]
+    if common_keys:
+        output.update((key, paths) for key, paths in other.items() if not key in common_keys)
+    else:
+        output.update(other)
+
+
+def _unindex_dropped(data: IndexStoreData, path: pds.Path, dropped: pdc.PropertyDict):
+    """Takes `path` out of the lookups of the `dropped` entry that do not match the entry it kept"""
+    kept = data.by_path[path]
+    for key, by_key in [(pdc.KEY_FILE_HASH, data.by_hash), (pdc.KEY_IMAGE_PHASH, data.by_phash)]:
+        value = dropped.get(key)
+        if value and value != kept.get(key) and value in by_key:
+            by_key[value].discard(path)
+            if not by_key[value]:
+                del by_key[value]
+    file_hash = kept.get(pdc.KEY_FILE_HASH)
+    if file_hash:
+        data._pathset_for_hash(file_hash).add(path)
+    phash = kept.get(pdc.KEY_IMAGE_PHASH)
+    if phash:
+        data._pathset_for_phash(phash).add(path)
+
+
+def _file_series_key(file_series: pfs.PictureFileSeries) -> Tuple[str, int]:
+    return (file_series.file_prefix or "", file_series.file_num or 0)
+
+
+def merge_file_series(all_file_series_lists: List[List[pfs.PictureFileSeries]]) -> List[pfs.PictureFileSeries]:
+    """
+    K-way merge of the series of every index, by file prefix & number.
+    The same series in more than one is kept once.
+    """
+    output: List[pfs.PictureFileSeries] = list()
+    same_key: List[pfs.PictureFileSeries] = list()  # The merged series with the key of the last one
+    sorted_lists = [sorted(all_file_series, key=_file_series_key) for all_file_series in all_file_series_lists]
+    for file_series in heapq.merge(*sorted_lists, key=_file_series_key):
+        if same_key and _file_series_key(same_key[0]) != _file_series_key(file_series):
+            same_key = list()
+        if file_series in same_key:
+            continue
+        same_key.append(file_series)
+        output.append(file_series)
+    return output
+
+
+def merge_index_stores(index_stores: List[IndexStore]) -> IndexStore:
+    """
+    Returns one index of everything in `index_stores`.
+    NOTE: The merged index takes over the entries, path sets & series of `index_stores`:
+    they should not be used anymore.
+    """
+    output = IndexStore(index_stores[0].platform)
+    data = output.data
+    dropped: List[Tuple[pds.Path, pdc.PropertyDict]] = list()
+
+    for index_store in index_stores:
+        other = index_store.data
+        for path, image_properties in other.by_path.items():
+            known = data.by_path.get(path)
+            if known is None:
+                data.by_path[path] = image_properties
+                continue
+            kept = resolve_path_conflict(known, image_properties)
+            data.by_path[path] = kept
+            dropped.extend((path, entry) for entry in [known, image_properties] if entry is not kept)
+        _union_into(data.by_hash, other.by_hash)
+        _union_into(data.by_core_filename, other.by_core_filename)
+        for phash, paths in other.by_phash.items():
+            data._pathset_for_phash(phash).update(paths)
+        data.by_dir.update(other.by_dir)
+        data.oldest_image_date = min(data.oldest_image_date, other.oldest_image_date)
+        data.newest_image_date = max(data.newest_image_date, other.newest_image_date)
+
+    for path, entry in dropped:
+        _unindex_dropped(data, path, entry)
+    data.defer_derived()
+
+    output.file_series_splitter.restore_file_series(merge_file_series(
+        [index_store.file_series_splitter.all_file_series for index_store in index_stores]))
+    return output
+
+
+def merge_index_files(paths: List[pds.Path], platform: pds.Platform) -> IndexStore:
+    print(f"Merging {len(paths)} indexes...")
+    return merge_index_stores([IndexStore.load(path, platform) for path in paths])
@@ -0,0 +1,121 @@
+import io
+import threading
+
+from typing import BinaryIO, Dict, List, Tuple
+
+from picdeduper import exif as pdexif
+from picdeduper import isobmff as pdbmff
+from picdeduper import jpegdc
+from picdeduper import platform as pds
+from picdeduper import similarity as pdsim
+
+try:
+    from PIL import Image  # Optional. For the files without a thumbnail.
+except ImportError:
+    Image = None
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Perceptual hashes, without fully decoding 48 MP images. From cheap to less cheap:
+#
+#   1. SOURCE_THUMBNAIL: the JPEG thumbnail in the EXIF data (JPEG & HEIC),
+#                        DC-decoded. Only reads the header of the file.
+#   2. SOURCE_REDUCED:   a reduced-size decode through PIL, if it is installed
+#                        (1/8 scale for a JPEG; a HEIC needs pillow-heif).
+#   3. SOURCE_DC:        without PIL, the 1/8-scale, DC-only decode of a JPEG.
+#                        It still Huffman-decodes every AC symbol, in Python:
+#                        only for small JPEGs (MAX_DC_BLOCKS, MAX_DC_FILE_SIZE).
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+SOURCE_THUMBNAIL = "thumbnail"
+SOURCE_DC = "dc"
+SOURCE_REDUCED = "reduced"
+SOURCE_NONE = "none"
+SOURCES = [SOURCE_THUMBNAIL, SOURCE_REDUCED, SOURCE_DC, SOURCE_NONE]
+
+JPEG_EXTS = (".JPG", ".JPEG")
+HEIF_EXTS = (".HEIC",)
+
+# Size of the reduced decode (PIL picks the closest 1/2, 1/4 or 1/8 JPEG scale above it)
+REDUCED_SIZE = (64, 64)
+
+# Largest JPEG that gets DC-decoded in Python: 8192 blocks of 8x8 is about 0.5 MP (thumbnails are far below)
+MAX_DC_BLOCKS = 8192
+MAX_DC_FILE_SIZE = 4 * 1024 * 1024
+
+PHASH_ERRORS = (pdexif.ExifError, pdbmff.IsoBmffError, jpegdc.JpegDcError, OSError, ValueError)
+
+
+def _embedded_thumbnail(f: BinaryIO, ext: str) -> bytes:
+    tiff_data = None
+    if ext in JPEG_EXTS:
+        tiff_data = pdexif.read_jpeg_header(f).exif
+    elif ext in HEIF_EXTS:
+        tiff_data = pdbmff.read_heif_exif(f)
+    if not tiff_data:
+        return None
+    return pdexif.thumbnail_of_tiff(pdexif.parse_tiff(tiff_data))
+
+
+def _dhash_of_jpeg(data: bytes) -> pdsim.PerceptualHash:
+    pixels, width, height = jpegdc.decode_dc_grayscale(data, max_blocks=MAX_DC_BLOCKS)
+    return pdsim.dhash_of_grayscale(pixels, width, height)
+
+
+def _dhash_of_reduced_decode(f: BinaryIO) -> pdsim.PerceptualHash:
+    with Image.open(f) as image:
+        image.draft("L", REDUCED_SIZE)
+        image = image.convert("L")
+        image.thumbnail(REDUCED_SIZE)
+        return pdsim.dhash_of_grayscale(list(image.getdata()), image.width, image.height)
+
+
+class PerceptualHasher:
+    """Computes the perceptual hash of pictures, and counts which source each one came from"""
+
+    def __init__(self, platform: pds.Platform) -> None:
+        self.platform = platform
+        self.counters: Dict[str, int] = {x: 0 for x in SOURCES}
+        self.counters_lock = threading.Lock()  # Fingerprinting runs on a thread pool
+
+    def _phash_and_source_of(self, path: pds.Path) -> Tuple[pdsim.PerceptualHash, str]:
+        ext = pds.filename_ext(path).upper()
+        if not ext in JPEG_EXTS + HEIF_EXTS:
+            return None, SOURCE_NONE
+        with self.platform.open_binary_file(path) as f:
+            try:
+                thumbnail = _embedded_thumbnail(f, ext)
+                if thumbnail:
+                    return _dhash_of_jpeg(thumbnail), SOURCE_THUMBNAIL
+            except PHASH_ERRORS:
+                pass
+            if Image:
+                try:
+                    f.seek(0)
+                    return _dhash_of_reduced_decode(f), SOURCE_REDUCED
+                except PHASH_ERRORS:
+                    pass
+            if ext in JPEG_EXTS and f.seek(0, io.SEEK_END) <= MAX_DC_FILE_SIZE:
+                try:
+                    f.seek(0)
+                    return _dhash_of_jpeg(f.read()), SOURCE_DC
+                except PHASH_ERRORS:
+                    pass
+        return None, SOURCE_NONE
+
+    def phash_of(self, path: pds.Path) -> str:
+        """Returns the perceptual hash of `path` as a string, or None if there is no way to get one"""
+        try:
+            phash, source = self._phash_and_source_of(path)
+        except OSError as e:
+            print(f"WARNING: Cannot read {path}: {e}")
+            phash, source = None, SOURCE_NONE
+        with self.counters_lock:
+            self.counters[source] += 1
+        return pdsim.phash_string(phash) if phash is not None else None
+
+    def summary(self) -> str:
+        with self.counters_lock:
+            parts: List[str] = [f"{self.counters[x]} from {x}" for x in SOURCES]
+        return "Perceptual hashes: " + ", ".join(parts)
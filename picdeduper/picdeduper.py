@@ -1,9 +1,18 @@
-from picdeduper.indexstore import IndexStore
+from picdeduper.indexstore import BaseIndexStore
+from picdeduper import common as pdc
+from picdeduper import dirsummaries as pdds
 from picdeduper import fingerprinting as pdf
 from picdeduper import fixits as fixits
 from picdeduper import evaluation as pdeval
 from picdeduper import platform as pds
 from picdeduper import images
+from picdeduper import pipeline
+from picdeduper import probe as pdprobe
+
+import concurrent.futures
+import os
+
+from typing import Dict, Iterator
 
 
 class PicDeduper:
@@ -13,37 +22,125 @@ class PicDeduper:
         self.fingerprinter = fingerprinter
         self.fixit_processor = fixit_processor
         self.should_quit = False
+        self.lazy_hashing = False  # Only hash files when their size collides with another file
+        self.jobs = os.cpu_count() or 1  # Number of fingerprinting threads
+        self.skip_unchanged_dirs = True  # Skip the directories whose summary did not change since the last run
+        self.collection_probe: pdprobe.CollectionProbe = None  # Gets what is added to the index, if any
 
-    def is_processed_file(self, image_path: pds.Path, index_store: IndexStore) -> bool:
+    def is_processed_file(self, image_path: pds.Path, index_store: BaseIndexStore,
+                          upgraded_signatures: Dict[pds.Path, pdc.PropertyDict]) -> bool:
         """
         Returns True if the image's quick signature matches the one we have in the JSON-loaded results.  
         This assumes that no changes were made to the file. 
         This is not necessarily true, though! A hash should be used for certainty.
+        Entries from older indexes get their quick signature upgraded: it goes into `upgraded_signatures`,
+        for the thread that owns the index to apply (update_known_image_properties()).
         """
-        if not image_path in index_store.data.by_path:
+        known_signature = index_store.known_image_properties(image_path)
+        if known_signature is None:
+            return False
+        try:
+            quick_signature = self.fingerprinter.quick_image_signature_dict_of(image_path)
+        except OSError:
+            return False  # Fingerprinting it tells why
+        if not pdeval.is_quick_signature_equal(quick_signature, known_signature):
             return False
-        quick_signature = self.fingerprinter.quick_image_signature_dict_of(image_path)
-        known_signature = index_store.data.by_path[image_path]
-        return pdeval.is_quick_signature_equal(quick_signature, known_signature)
+        if pdeval.is_legacy_quick_signature(known_signature):
+            upgraded_signatures[image_path] = quick_signature
+        return True
+
+    def unprocessed_paths(self, image_paths: pds.PathList, index_store: BaseIndexStore,
+                          upgraded_signatures: Dict[pds.Path, pdc.PropertyDict]) -> pds.PathList:
+        """Batched version of is_processed_file(), returning the paths that still need processing."""
+        output = list()
+        for image_path in image_paths:
+            if self.is_processed_file(image_path, index_store, upgraded_signatures):
+                print(f"Skipping untouched: {image_path}")
+                continue
+            output.append(image_path)
+        return output
 
-    def _index_dir(self, index_store: IndexStore, start_dir: pds.Path, skip_untouched=True, do_evaluation=True):
+    def _fingerprint_chunk(self, index_store: BaseIndexStore, chunk: pds.PathList, skip_untouched: bool):
+        """
+        Runs on a worker thread: it only reads the index.
+        Returns the paths that need processing, their signatures & the upgraded signatures of the skipped ones.
+        """
+        upgraded_signatures: Dict[pds.Path, pdc.PropertyDict] = dict()
+        if skip_untouched:
+            chunk = self.unprocessed_paths(chunk, index_store, upgraded_signatures)
+        signatures = self.fingerprinter.image_signature_dicts_of(chunk, with_hash=not self.lazy_hashing)
+        return chunk, signatures, upgraded_signatures
 
+    def _index_dir(self, index_store: BaseIndexStore, start_dir: pds.Path, skip_untouched=True, do_evaluation=True):
         print(f"Indexing from {start_dir}...")
 
-        all_image_paths = images.every_image_path(self.platform, start_dir)
-        for image_path in all_image_paths:
+        dir_summaries: pdds.DirectorySummaries = dict()
+        if skip_untouched and self.skip_unchanged_dirs:
+            image_paths = pdds.iter_changed_image_paths(
+                self.platform, start_dir, index_store.directory_summary, dir_summaries)
+        else:
+            image_paths = images.iter_image_paths(self.platform, start_dir)
+
+        self._index_image_paths(index_store, image_paths, skip_untouched, do_evaluation)
+
+        if dir_summaries and not self.should_quit:
+            index_store.set_directory_summaries(dir_summaries)
+            index_store.commit()
+
+        print(f"Indexing of {start_dir} is done.")
+
+    def _index_image_paths(self, index_store: BaseIndexStore, image_paths: Iterator[pds.Path], skip_untouched: bool,
+                           do_evaluation: bool):
+        """
+        Walks, fingerprints & hashes on background threads, in parallel.
+        Evaluation and IndexStore.add() happen on this thread, in the original walking order.
+        """
+
+        def should_quit() -> bool:
+            return self.should_quit
+
+        max_in_flight = 2 * self.jobs
+        all_image_paths = pipeline.background_iter(
+            image_paths,
+            max_queued=max_in_flight * pdf.MDLS_BATCH_SIZE,
+            should_quit=should_quit)
+        chunks = pipeline.chunked(all_image_paths, pdf.MDLS_BATCH_SIZE)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs,
+                                                   thread_name_prefix="Fingerprinter") as executor:
+            fingerprinted_chunks = pipeline.ordered_map(
+                lambda chunk: self._fingerprint_chunk(index_store, chunk, skip_untouched),
+                chunks,
+                executor,
+                max_in_flight=max_in_flight,
+                should_quit=should_quit)
+            try:
+                for chunk, signatures, upgraded_signatures in fingerprinted_chunks:
+                    for image_path, quick_signature in upgraded_signatures.items():
+                        index_store.update_known_image_properties(image_path, quick_signature)
+                    self._process_fingerprinted_paths(index_store, chunk, signatures, do_evaluation)
+                    index_store.commit()  # One batch per chunk
+            finally:
+                fingerprinted_chunks.close()  # Cancels what did not start yet
+
+    def _process_fingerprinted_paths(self, index_store: BaseIndexStore, image_paths: pds.PathList,
+                                     signatures: Dict[pds.Path, pdc.PropertyDict], do_evaluation: bool):
+        for image_path in image_paths:
 
             # Stop iterating upon CTRL+C
-            if self.should_quit: 
+            if self.should_quit:
                 break
 
-            if skip_untouched and self.is_processed_file(image_path, index_store):
-                print(f"Skipping untouched: {image_path}")
-                continue
-
             # print(f"Processing image: {image_path}")
-            image_properties = index_store.image_properties_for_path(image_path)
-            self.fingerprinter.image_signature_dict_of(image_path, image_properties)
+            if not image_path in signatures:
+                continue  # It could not be fingerprinted: moved or deleted since the walk?
+
+            # A copy: the index needs what it had, to update its lookups on add()
+            image_properties = dict(index_store.image_properties_for_path(image_path))
+            if image_properties and not pdeval.is_quick_signature_equal(signatures[image_path], image_properties):
+                for key in pdeval.FILE_CONTENT_KEYS:  # The file changed: what it had is not what it has
+                    image_properties.pop(key, None)
+            image_properties.update(signatures[image_path])
 
             if do_evaluation:
                 result = pdeval.evaluate(image_path, image_properties, index_store)
@@ -82,6 +179,13 @@ class PicDeduper:
                     # TODO:   Add a ./SIMILAR/{filename}.txt with original
                     continue
 
+                if result.has_similar_images():
+                    similar_paths = result.paths_with_similar_image()
+                    print(f"~ SIMILAR ~ {image_path} looks like {similar_paths}")
+                    fixit = self._similar_image_fixit(index_store, image_path, image_properties, similar_paths)
+                    if self.fixit_processor.process(fixit):
+                        continue
+
                 if result.has_core_filename_dupes():
                     print(f"? NAME ? {image_path} shares the name of {result.paths_with_same_core_filename()}")
                     # TODO: IF "better version" of same filename minus ext:
@@ -96,9 +200,22 @@ class PicDeduper:
 
                 print(f". UNIQ . {image_path}")
             index_store.add(image_path, image_properties)
-        print(f"Indexing of {start_dir} is done.")
+            if self.collection_probe is not None:
+                self.collection_probe.add(image_properties)
+            self.fingerprinter.remember(image_properties)  # With the hashes it might have gotten since
+
+    def _similar_image_fixit(self, index_store: BaseIndexStore, image_path: pds.Path,
+                             image_properties: pdc.PropertyDict,
+                             similar_paths: pds.PathSet) -> fixits.SimilarImageFixIt:
+        similar_image_properties = index_store.image_properties_dict_for_paths(similar_paths).values()
+        qualities = [pdeval.compare_image_quality(image_properties, x) for x in similar_image_properties]
+        if min(qualities) > 0:
+            return fixits.BetterQualityVersionFixIt(self.platform, image_path, similar_paths)
+        if max(qualities) < 0:
+            return fixits.WorseQualityVersionFixIt(self.platform, image_path, similar_paths)
+        return fixits.SimilarImageFixIt(self.platform, image_path, similar_paths)
 
-    def index_established_collection_dir(self, index_store: IndexStore, start_dir: pds.Path):
+    def index_established_collection_dir(self, index_store: BaseIndexStore, start_dir: pds.Path):
         self._index_dir(
             index_store,
             start_dir,
@@ -106,10 +223,40 @@ class PicDeduper:
             do_evaluation=False,
         )
 
-    def evaluate_candidate_dir(self, index_store: IndexStore, start_dir: pds.Path):
+    def evaluate_candidate_dir(self, index_store: BaseIndexStore, start_dir: pds.Path):
         self._index_dir(
             index_store,
             start_dir,
             skip_untouched=False,
             do_evaluation=True,
         )
+
+    def evaluate_candidate_paths(self, index_store: BaseIndexStore, image_paths: pds.PathList):
+        self._index_image_paths(
+            index_store,
+            iter(image_paths),
+            skip_untouched=False,
+            do_evaluation=True,
+        )
+
+    def probe_candidate_dir(self, collection_probe: pdprobe.CollectionProbe, start_dir: pds.Path) -> pds.PathList:
+        """
+        Checks the candidates against `collection_probe` only:
+        the ones that are certainly not exact dupes get reported right away.
+        Returns the others, which may be exact dupes. Only the index of the collection can tell.
+        """
+        output = list()
+        for image_path in images.iter_image_paths(self.platform, start_dir):
+            if self.should_quit:
+                break
+            try:
+                quick_signature = self.fingerprinter.quick_image_signature_dict_of(image_path)
+            except OSError as e:
+                print(f"WARNING: Cannot stat {image_path}. Was it moved or deleted? {e}")
+                continue
+            if collection_probe.may_have_dupe(image_path, quick_signature, self.platform):
+                print(f"? MAYBE ? {image_path} may be a file dupe")
+                output.append(image_path)
+                continue
+            print(f". UNIQ . {image_path}")
+        return output
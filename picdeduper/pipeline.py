@@ -0,0 +1,116 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+
+from typing import Callable, Deque, Iterable, Iterator, List, TypeVar
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Building blocks for a staged pipeline:
+#
+#     walk (1 thread)  ->  bounded queue  ->  chunks  ->  worker pool  ->  in order
+#
+#  Every stage only runs ahead of the next one by a bounded amount, so memory
+#  stays capped. Results come out in the order the items went in, no matter
+#  which worker finished first.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+T = TypeVar("T")
+R = TypeVar("R")
+ShouldQuit = Callable[[], bool]
+
+_END_OF_ITERATION = object()
+_POLL_INTERVAL = 0.1  # seconds
+
+
+def _never_quit() -> bool:
+    return False
+
+
+class _RaisedInBackground:
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+def background_iter(iterable: Iterable[T], max_queued: int, should_quit: ShouldQuit = _never_quit) -> Iterator[T]:
+    """
+    Runs `iterable` on its own thread, while the caller consumes the items.
+    The thread blocks when `max_queued` items are waiting to be consumed.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not (stop.is_set() or should_quit()):
+            try:
+                items.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put(item):
+                    return
+        except BaseException as e:
+            _put(_RaisedInBackground(e))
+            return
+        _put(_END_OF_ITERATION)
+
+    producer = threading.Thread(target=_produce, name="background_iter", daemon=True)
+    producer.start()
+    try:
+        while not should_quit():
+            try:
+                item = items.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is _END_OF_ITERATION:
+                break
+            if isinstance(item, _RaisedInBackground):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def ordered_map(func: Callable[[T], R],
+                items: Iterable[T],
+                executor: concurrent.futures.Executor,
+                max_in_flight: int,
+                should_quit: ShouldQuit = _never_quit) -> Iterator[R]:
+    """
+    Like executor.map(), but it only pulls a new item from `items` when fewer
+    than `max_in_flight` are being worked on (or waiting to be consumed).
+    Stops early, and cancels what has not started yet, when `should_quit()`.
+    """
+    in_flight: Deque[concurrent.futures.Future] = collections.deque()
+    try:
+        for item in items:
+            if should_quit():
+                return
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            if should_quit():
+                return
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
@@ -1,14 +1,19 @@
+import asyncio
+import contextlib
 import os
 import pathlib
 import platform
 import re
 import subprocess
 import hashlib
+import io
+import mmap
 
 from picdeduper import time as pdt
+from picdeduper import hashing as pdh
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Set, Callable
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Set, Callable, Tuple
 
 Filename = str
 FilenameFilter = Callable[[Filename], bool]
@@ -75,6 +80,26 @@ def sorted_filenames(filenames: List[Filename]) -> List[Filename]:
     return sorted(filenames, key=lambda x: x.replace(' ', '~'))
 
 
+class FileStat:
+    """The subset of os.stat() that we care about, to tell whether a file was touched"""
+
+    def __init__(self, size: int, mtime_ns: int, inode: int = 0, device: int = 0) -> None:
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.device = device
+
+    def mtime(self) -> pdt.Timestamp:
+        return self.mtime_ns / 1e9
+
+    def from_os_stat(st: os.stat_result):
+        return FileStat(st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+
+
+class CommandTimeoutError(Exception):
+    pass
+
+
 class Style:
     RESET = "\033[0m"
 
@@ -143,6 +168,33 @@ class Platform(ABC):
     def write_text_file(self, path: Path, content: str):
         pass
 
+    @abstractmethod
+    def write_text_chunks(self, path: Path, chunks: Iterable[str]):
+        """
+        Writes the `chunks` one by one to a temp file, which only replaces `path` once it is all on disk.
+        So `path` is never half-written, and the content never needs to be in memory all at once.
+        """
+        pass
+
+    @abstractmethod
+    def append_text_file(self, path: Path, content: str):
+        """Appends `content`, and only returns once it is on disk (it survives a crash)"""
+        pass
+
+    @abstractmethod
+    def open_binary_file(self, path: Path) -> BinaryIO:
+        pass
+
+    @abstractmethod
+    def write_binary_file(self, path: Path, content: bytes):
+        """Replaces the file atomically, so maps of the old one stay valid"""
+        pass
+
+    @abstractmethod
+    def map_binary_file(self, path: Path) -> memoryview:
+        """Read-only map of the whole file. Pages get read on first access, and are shared between processes."""
+        pass
+
     @abstractmethod
     def raw_stdout_of(self, cmd_parts: CommandLineParts) -> str:
         pass
@@ -151,10 +203,23 @@ class Platform(ABC):
         """Returns stringified version of _byte_stdout_of()"""
         return self.raw_stdout_of(cmd_parts).decode("utf-8").strip()
 
+    async def async_raw_stdout_of(self, cmd_parts: CommandLineParts) -> bytes:
+        """Async version of raw_stdout_of(). By default, it blocks a worker thread instead of the event loop."""
+        return await asyncio.to_thread(self.raw_stdout_of, cmd_parts)
+
     @abstractmethod
     def set_mtime(self, path: Path, timestamp: pdt.Timestamp) -> None:
         pass
 
+    @abstractmethod
+    def file_stat(self, path: Path) -> FileStat:
+        pass
+
+    @abstractmethod
+    def dir_entries(self, dir_path: Path) -> Tuple[List[Filename], Dict[Filename, FileStat]]:
+        """Returns the (subdirectory names, file stats by filename) in `dir_path`, from a single scan"""
+        pass
+
     def _openssl_digest(self, algorithm: str, path: Path) -> str:
         parts = self.stdout_of(["openssl", algorithm, "-r", path]).split(" ")
         if len(parts) == 0:
@@ -200,12 +265,14 @@ class Platform(ABC):
     def _file_shasum_sha512256_hash(self, path: Path) -> str:
         return self._shasum_digest("512256", path)
 
+    def file_hasher(self) -> pdh.FileHasher:
+        """The in-process hashing engine, created on first use"""
+        if not getattr(self, "_file_hasher", None):
+            self._file_hasher = pdh.FileHasher(self.open_binary_file)
+        return self._file_hasher
+
     def _file_hashlib_hash(self, hashlib_func, path: Path) -> str:
-        hash = hashlib_func()
-        with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash.update(chunk)
-        return hash.hexdigest()
+        return self.file_hasher().hash_file(path, hashlib_func)
 
     def _file_hashlib_md5_hash(self, path: Path) -> str:
         return self._file_hashlib_hash(hashlib.md5, path)
@@ -224,16 +291,31 @@ class Platform(ABC):
 
     def quick_file_hash(self, path: Path) -> str:
         # NOTE: SHA256 is actually faster than MD4 on M1+ Macs!  :o
-        return self._file_openssl_sha256_hash(path)
+        # NOTE: Same digest as _file_openssl_sha256_hash(), but without spawning openssl.
+        return self.file_hasher().hash_file(path, "sha256")
+
+    def quick_file_hashes(self, paths: PathList) -> Dict[Path, str]:
+        """Same as quick_file_hash(), but for many files at once (on a thread pool)"""
+        return self.file_hasher().hash_files(paths, "sha256")
+
+    def partial_file_hash(self, path: Path) -> str:
+        """Cheap hash of the head & tail of a file. Only meaningful between files of the same size."""
+        return self.file_hasher().hash_file_head_tail(path, "sha256")
 
     def second_opinion_file_hash(self, path: Path) -> str:
         # NOTE: MD4 may not be secure but good enough as second opinion (and fast!)
+        # NOTE: hashlib may lack MD4 (OpenSSL 3 without the legacy provider).
+        if pdh.is_available("md4"):
+            return self.file_hasher().hash_file(path, "md4")
         return self._file_openssl_md4_hash(path)
 
     @abstractmethod
     def every_file_path(self, dir_path: Path, filter: FilenameFilter = None) -> PathList:
         pass
 
+    def iter_file_paths(self, dir_path: Path, filter: FilenameFilter = None) -> Iterator[Path]:
+        return iter(self.every_file_path(dir_path, filter))
+
 
 class MacOSPlatform(Platform):
 
@@ -255,35 +337,94 @@ class MacOSPlatform(Platform):
         with open(path, "w") as output_file:
             output_file.write(content)
 
+    def write_text_chunks(self, path: Path, chunks: Iterable[str]):
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "w") as output_file:
+                for chunk in chunks:
+                    output_file.write(chunk)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+        except BaseException:
+            with contextlib.suppress(OSError):  # E.g. it could not even get created: that is not the error to raise
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+
+    def append_text_file(self, path: Path, content: str):
+        with open(path, "a") as output_file:
+            output_file.write(content)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+    def open_binary_file(self, path: Path) -> BinaryIO:
+        return open(path, "rb", buffering=0)
+
+    def write_binary_file(self, path: Path, content: bytes):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as output_file:
+            output_file.write(content)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(temp_path, path)
+
+    def map_binary_file(self, path: Path) -> memoryview:
+        with open(path, "rb") as input_file:
+            return memoryview(mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ))
+
     def raw_stdout_of(self, cmd_parts: CommandLineParts) -> str:
         """Returns stdout of command line, in raw bytes"""
         return subprocess.run(cmd_parts, stdout=subprocess.PIPE).stdout
 
+    async def async_raw_stdout_of(self, cmd_parts: CommandLineParts) -> bytes:
+        """Same as raw_stdout_of(), without blocking. Kills the process if the call gets cancelled."""
+        process = await asyncio.create_subprocess_exec(*cmd_parts, stdout=asyncio.subprocess.PIPE)
+        try:
+            stdout, _ = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        return stdout
+
     def set_mtime(self, path: Path, timestamp: pdt.Timestamp) -> None:
         atime = os.stat(path).st_atime
         mtime = timestamp
         os.utime(path, times=(atime, mtime))
 
-    def _every_file_path(self, io_path_list: PathList, dir_path: Path, filter: FilenameFilter):
-        """Recursive part of every_file_path()"""
+    def file_stat(self, path: Path) -> FileStat:
+        return FileStat.from_os_stat(os.stat(path))
+
+    def dir_entries(self, dir_path: Path) -> Tuple[List[Filename], Dict[Filename, FileStat]]:
+        subdirs: List[Filename] = list()
+        file_stats: Dict[Filename, FileStat] = dict()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    file_stats[entry.name] = FileStat.from_os_stat(entry.stat())
+        return subdirs, file_stats
+
+    def iter_file_paths(self, dir_path: Path, filter: FilenameFilter = None) -> Iterator[Path]:
+        """Same as every_file_path(), but yields the paths while walking"""
+        if not filter:
+            filter = (lambda filename: True)
         for root, subdirs, filenames in os.walk(dir_path):
+            subdirs.sort()
             for filename in sorted_filenames(filenames):
                 path = root + "/" + filename
                 if not filter(filename):
                     print(f"Skipping non-image: {path}")
                     continue
-                io_path_list.append(path)
+                yield path
 
     def every_file_path(self, dir_path: Path, filter: FilenameFilter = None) -> PathList:
         """
         Returns a list of full paths of every file that passess `filter`.
         The files are sorted within a subdir.
         """
-        if not filter:
-            filter = (lambda filename: True)
-        path_list = list()
-        self._every_file_path(path_list, dir_path, filter)
-        return path_list
+        return list(self.iter_file_paths(dir_path, filter))
 
 
 class FakePlatform(Platform):
@@ -291,12 +432,18 @@ class FakePlatform(Platform):
     def __init__(self) -> None:
         self.existing_paths: Dict[Filename, bool] = dict()
         self.text_files: Dict[Filename, str] = dict()
+        self.binary_files: Dict[Filename, bytes] = dict()
         self.raw_cmd_output: Dict[str, bytes] = dict()
         self.catchall_raw_cmd_output: bytes = None
         self.image_files: Dict[Path, List[Path]] = dict()
+        self.dirs: Dict[Path, Tuple[List[Filename], Dict[Filename, FileStat]]] = dict()
         self.called_cmd_lines = list()
         self.mtimes: Dict[Path, pdt.Timestamp] = dict()
+        self.file_stats: Dict[Path, FileStat] = dict()
         self.os_is_mac: bool = True
+        self.async_cmd_delay: float = None
+        self.cmds_in_flight = 0
+        self.max_cmds_in_flight = 0
 
     def configure_is_mac_os(self, value: bool = True):
         self.os_is_mac = value
@@ -329,6 +476,29 @@ class FakePlatform(Platform):
         self.configure_text_file(path, content)
         self.configure_path_exists(path, True)
 
+    def write_text_chunks(self, path: Path, chunks: Iterable[str]):
+        self.write_text_file(path, "".join(chunks))
+
+    def append_text_file(self, path: Path, content: str):
+        self.write_text_file(path, self.text_files.get(path, "") + content)
+
+    def configure_binary_file(self, path: Path, content: bytes) -> None:
+        self.binary_files[path] = content
+
+    def open_binary_file(self, path: Path) -> BinaryIO:
+        if not path in self.binary_files:
+            raise Exception(f"Not configured: Binary file: {path}")
+        return io.BytesIO(self.binary_files[path])
+
+    def write_binary_file(self, path: Path, content: bytes):
+        self.configure_binary_file(path, content)
+        self.configure_path_exists(path, True)
+
+    def map_binary_file(self, path: Path) -> memoryview:
+        if not path in self.binary_files:
+            raise Exception(f"Not configured: Binary file: {path}")
+        return memoryview(self.binary_files[path])
+
     def configure_catchall_raw_cmd_output(self, output: bytes = None) -> str:
         self.catchall_raw_cmd_output = output
 
@@ -342,9 +512,41 @@ class FakePlatform(Platform):
             return self.catchall_raw_cmd_output
         return self.raw_cmd_output[cmd_line]
 
+    def configure_async_delay(self, seconds: float) -> None:
+        """Async mode: every async command takes `seconds`, and the max number of them in flight gets tracked"""
+        self.async_cmd_delay = seconds
+
+    async def async_raw_stdout_of(self, cmd_parts: CommandLineParts) -> bytes:
+        if self.async_cmd_delay is None:
+            return await super().async_raw_stdout_of(cmd_parts)
+        self.cmds_in_flight += 1
+        self.max_cmds_in_flight = max(self.max_cmds_in_flight, self.cmds_in_flight)
+        try:
+            await asyncio.sleep(self.async_cmd_delay)
+            return self.raw_stdout_of(cmd_parts)
+        finally:
+            self.cmds_in_flight -= 1
+
     def set_mtime(self, path: Path, timestamp: pdt.Timestamp) -> None:
         self.mtimes[path] = timestamp
 
+    def configure_file_stat(self, path: Path, file_stat: FileStat) -> None:
+        self.file_stats[path] = file_stat
+
+    def file_stat(self, path: Path) -> FileStat:
+        if not path in self.file_stats:
+            raise Exception(f"Not configured: File stat: {path}")
+        return self.file_stats[path]
+
+    def configure_dir_entries(self, dir_path: Path, subdirs: List[Filename], file_stats: Dict[Filename, FileStat]):
+        self.dirs[dir_path] = (subdirs, file_stats)
+
+    def dir_entries(self, dir_path: Path) -> Tuple[List[Filename], Dict[Filename, FileStat]]:
+        if not dir_path in self.dirs:
+            raise Exception(f"Not configured: Directory: {dir_path}")
+        subdirs, file_stats = self.dirs[dir_path]
+        return list(subdirs), dict(file_stats)
+
     def configure_every_file_path(self, dir_path: Path, paths: PathList):
         self.image_files[dir_path] = paths
 
@@ -352,3 +554,54 @@ class FakePlatform(Platform):
         if not dir_path in self.image_files:
             raise f"Not configured: Image files in: {dir_path}"
         return self.image_files[dir_path]
+
+
+class AsyncPlatform:
+    """
+    Runs the command lines of a Platform asynchronously, keeping up to
+    `max_in_flight` of them running at once, each with a `timeout` (in seconds).
+    """
+
+    DEFAULT_MAX_IN_FLIGHT = 8
+    DEFAULT_TIMEOUT = 60.0
+
+    def __init__(self, platform: Platform, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.platform = platform
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._semaphore: asyncio.Semaphore = None
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created on first use, so that it belongs to the running event loop
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def raw_stdout_of(self, cmd_parts: CommandLineParts) -> bytes:
+        async with self._slots():
+            try:
+                return await asyncio.wait_for(self.platform.async_raw_stdout_of(cmd_parts), self.timeout)
+            except asyncio.TimeoutError:
+                raise CommandTimeoutError(f"Timed out after {self.timeout}s: {' '.join(cmd_parts)}")
+
+    async def stdout_of(self, cmd_parts: CommandLineParts) -> str:
+        return (await self.raw_stdout_of(cmd_parts)).decode("utf-8").strip()
+
+    async def _in_process(self, func: Callable, *args):
+        """In-process work (e.g. hashlib) runs on a worker thread, within the same limit"""
+        async with self._slots():
+            return await asyncio.to_thread(func, *args)
+
+    async def quick_file_hash(self, path: Path) -> str:
+        return await self._in_process(self.platform.quick_file_hash, path)
+
+    async def quick_file_hashes(self, paths: PathList) -> Dict[Path, str]:
+        file_hashes = await asyncio.gather(*[self.quick_file_hash(path) for path in paths])
+        return dict(zip(paths, file_hashes))
+
+    async def second_opinion_file_hash(self, path: Path) -> str:
+        if pdh.is_available("md4"):
+            return await self._in_process(self.platform.second_opinion_file_hash, path)
+        parts = (await self.stdout_of(["openssl", "md4", "-r", path])).split(" ")
+        return parts[0]
@@ -0,0 +1,132 @@
+import struct
+
+from picdeduper import bloom as pdb
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+from picdeduper.indexstore import BaseIndexStore
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A collection probe: a Bloom filter of what it takes to tell that a file
+#  is certainly not an exact dupe of a file of the collection, without the
+#  index of the collection (e.g. to triage an SD card on a laptop):
+#
+#     size:<size>                 every entry
+#     hash:<file hash>            the entries with a (full) hash
+#     partial:<size>:<hash>       the entries with only a partial hash,
+#     partial_size:<size>         and that there are some of that size
+#     unhashed_size:<size>        there are entries of that size without any hash
+#
+#  A candidate is a miss as soon as a key it needs is not in there. So it
+#  only needs a stat(), and hashes when its size is in the collection.
+#  About 2 keys per entry: a few bytes per entry at a 1% false positive rate.
+#
+#  File layout, to be used through mmap:
+#
+#     header | Bloom filter bits
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+PROBE_EXTS = [".PDPROBE"]
+
+MAGIC = b"PDPROBE\x01"
+HEADER = struct.Struct("<8sIIQ")  # magic, hash count, reserved, entry count
+
+KEYS_PER_ENTRY = 2
+GROWTH_HEADROOM = 1.25  # Room for the entries that get added after the export, before the false positive rate degrades
+
+
+class ProbeError(Exception):
+    pass
+
+
+def is_probe_path(path: pds.Path) -> bool:
+    return pds.filename_ext(pds.path_filename(path)).upper() in PROBE_EXTS
+
+
+def _size_key(size: str) -> str:
+    return f"size:{size}"
+
+
+def _hash_key(file_hash: str) -> str:
+    return f"hash:{file_hash}"
+
+
+def _partial_hash_key(size: str, partial_hash: str) -> str:
+    return f"partial:{size}:{partial_hash}"
+
+
+def _partial_size_key(size: str) -> str:
+    return f"partial_size:{size}"
+
+
+def _unhashed_size_key(size: str) -> str:
+    return f"unhashed_size:{size}"
+
+
+class CollectionProbe:
+
+    def __init__(self, bloom_filter: pdb.BloomFilter, entry_count: int = 0) -> None:
+        self.bloom_filter = bloom_filter
+        self.entry_count = entry_count
+
+    def for_capacity(entry_count: int, false_positive_rate: float = pdb.DEFAULT_FALSE_POSITIVE_RATE):
+        return CollectionProbe(pdb.BloomFilter.for_capacity(entry_count * KEYS_PER_ENTRY, false_positive_rate))
+
+    def of(index_store: BaseIndexStore, false_positive_rate: float = pdb.DEFAULT_FALSE_POSITIVE_RATE):
+        """A probe of every entry of `index_store`, with room for more"""
+        output = CollectionProbe.for_capacity(int(len(index_store) * GROWTH_HEADROOM) + 1, false_positive_rate)
+        for _, image_properties in index_store.all_image_properties():
+            output.add(image_properties)
+        return output
+
+    def add(self, image_properties: pdc.PropertyDict):
+        if isinstance(self.bloom_filter.bits, memoryview):  # Mapped: copy on first write
+            self.bloom_filter.bits = bytearray(self.bloom_filter.bits)
+        size = image_properties.get(pdc.KEY_FILE_SIZE)
+        file_hash = image_properties.get(pdc.KEY_FILE_HASH)
+        partial_hash = image_properties.get(pdc.KEY_FILE_PARTIAL_HASH)
+        self.bloom_filter.add(_size_key(size))
+        if file_hash:
+            self.bloom_filter.add(_hash_key(file_hash))
+        elif partial_hash:
+            self.bloom_filter.add(_partial_hash_key(size, partial_hash))
+            self.bloom_filter.add(_partial_size_key(size))
+        else:
+            self.bloom_filter.add(_unhashed_size_key(size))
+        self.entry_count += 1
+
+    def may_have_dupe(self, path: pds.Path, image_properties: pdc.PropertyDict, platform: pds.Platform) -> bool:
+        """
+        False if `path` is certainly not an exact dupe of a file of the collection.
+        True if it may be: only the index can tell.
+        Any hash it takes to tell goes into `image_properties`.
+        """
+        size = image_properties[pdc.KEY_FILE_SIZE]
+        if not _size_key(size) in self.bloom_filter:
+            return False
+        if _unhashed_size_key(size) in self.bloom_filter:
+            return True
+        if _partial_size_key(size) in self.bloom_filter:
+            if not image_properties.get(pdc.KEY_FILE_PARTIAL_HASH):
+                image_properties[pdc.KEY_FILE_PARTIAL_HASH] = platform.partial_file_hash(path)
+            if _partial_hash_key(size, image_properties[pdc.KEY_FILE_PARTIAL_HASH]) in self.bloom_filter:
+                return True
+        if not image_properties.get(pdc.KEY_FILE_HASH):
+            image_properties[pdc.KEY_FILE_HASH] = platform.quick_file_hash(path)
+        return _hash_key(image_properties[pdc.KEY_FILE_HASH]) in self.bloom_filter
+
+    def save(self, path: pds.Path, platform: pds.Platform):
+        header = HEADER.pack(MAGIC, self.bloom_filter.hash_count, 0, self.entry_count)
+        platform.write_binary_file(path, header + bytes(self.bloom_filter.bits))
+
+    def load(path: pds.Path, platform: pds.Platform):
+        """Maps the file: the bits only get read as candidates get probed"""
+        data = platform.map_binary_file(path)
+        if len(data) <= HEADER.size:
+            raise ProbeError(f"Not a collection probe: {path}")
+        magic, hash_count, _, entry_count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ProbeError(f"Not a collection probe (or of another version): {path}")
+        bits = data[HEADER.size:]
+        return CollectionProbe(pdb.BloomFilter(len(bits) * 8, hash_count, bits), entry_count)
@@ -0,0 +1,62 @@
+from typing import Iterable, Iterator
+
+from picdeduper import images
+from picdeduper import platform as pds
+from picdeduper.indexstore import BaseIndexStore
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Takes the files that are not in the collection anymore (deleted, moved)
+#  out of the index, in bulk:
+#
+#     1. walk the collection, one scan per directory: the paths that exist
+#     2. a single merge of those & the indexed paths under the collection,
+#        both sorted: the indexed paths that do not exist anymore are stale
+#     3. remove them from the index, with every lookup & series they are in
+#
+#  Indexed paths outside of the collection directory are left as they are.
+#  A walk that finds no image at all, while the index has some under the
+#  collection, most likely hit an unmounted or empty mount point: that
+#  does not get pruned, unless forced.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+def iter_existing_image_paths(platform: pds.Platform, start_dir: pds.Path) -> Iterator[pds.Path]:
+    """The image paths under `start_dir`, from a single scan of every directory. Not in any particular order."""
+    dir_paths = [start_dir]
+    while dir_paths:
+        dir_path = dir_paths.pop()
+        subdirs, file_stats = platform.dir_entries(dir_path)
+        for filename in file_stats:
+            if images.is_image_filename(filename):
+                yield dir_path + "/" + filename
+        dir_paths.extend(dir_path + "/" + subdir for subdir in subdirs)
+
+
+def iter_stale_paths(sorted_indexed_paths: Iterable[pds.Path],
+                     sorted_existing_paths: Iterable[pds.Path]) -> Iterator[pds.Path]:
+    """The indexed paths that do not exist, from a single merge of both sorted sequences"""
+    existing_paths = iter(sorted_existing_paths)
+    existing_path = next(existing_paths, None)
+    for indexed_path in sorted_indexed_paths:
+        while existing_path is not None and existing_path < indexed_path:
+            existing_path = next(existing_paths, None)
+        if existing_path != indexed_path:
+            yield indexed_path
+
+
+def prune_index(index_store: BaseIndexStore, platform: pds.Platform, start_dir: pds.Path,
+                force: bool = False) -> pds.PathSet:
+    """Removes the indexed files under `start_dir` that are not there anymore. Returns their paths."""
+    prefix = start_dir + "/"  # As the paths got indexed
+    sorted_indexed_paths = sorted(path for path, _ in index_store.all_image_properties() if path.startswith(prefix))
+    sorted_existing_paths = sorted(iter_existing_image_paths(platform, start_dir))
+    if sorted_indexed_paths and not sorted_existing_paths and not force:
+        print(f"WARNING: No images found in {start_dir}, but {len(sorted_indexed_paths)} indexed there. Not pruning.")
+        return set()
+    stale_paths = set(iter_stale_paths(sorted_indexed_paths, sorted_existing_paths))
+    if stale_paths:
+        index_store.remove_paths(stale_paths)
+        index_store.commit()
+    return stale_paths
@@ -0,0 +1,83 @@
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+from picdeduper import time as pdt
+from picdeduper.indexstore import BaseIndexStore
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Answers "what do we have ..." from the lookups of the index, not a scan.
+#  The most selective filter picks the candidates:
+#
+#     file hash       by hash
+#     core filename   by core filename
+#     time range      by image time (two binary searches)
+#
+#  The other filters (creator too) only get checked on those candidates.
+#  Only a query on nothing but the creator needs to go through every entry.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+DAY_LENGTH = len("2019-12-25")
+
+
+def time_bound(value: str, is_newest: bool) -> pdt.Timestamp:
+    """
+    The timestamp of a time string, or of a day (as "2019-12-25", in UTC):
+    its first second, or its last one for `is_newest`.
+    Raises ValueError for anything else.
+    """
+    if len(value) == DAY_LENGTH:
+        value += " 23:59:59 +0000" if is_newest else " 00:00:00 +0000"
+    return pdt.timestamp_from_string(value)
+
+
+class IndexQuery:
+
+    def __init__(self,
+                 file_hash: str = None,
+                 core_filename: pds.Filename = None,
+                 oldest: pdt.Timestamp = None,
+                 newest: pdt.Timestamp = None,
+                 creator: str = None) -> None:
+        self.file_hash = file_hash
+        self.core_filename = core_filename
+        self.oldest = oldest
+        self.newest = newest
+        self.creator = creator  # Any part of it, in any case
+
+    def _has_time_range(self) -> bool:
+        return self.oldest is not None or self.newest is not None
+
+    def _is_match(self, path: pds.Path, image_properties: pdc.PropertyDict) -> bool:
+        if image_properties is None:
+            return False
+        if self.file_hash and image_properties.get(pdc.KEY_FILE_HASH) != self.file_hash:
+            return False
+        if self.core_filename and pds.path_core_filename(path) != self.core_filename:
+            return False
+        if self._has_time_range():
+            timestamp = pdt.timestamp_from_string(image_properties.get(pdc.KEY_IMAGE_DATE))
+            if timestamp is None:
+                return False
+            if self.oldest is not None and timestamp < self.oldest:
+                return False
+            if self.newest is not None and timestamp > self.newest:
+                return False
+        if self.creator and not self.creator.lower() in (image_properties.get(pdc.KEY_IMAGE_CREATOR) or "").lower():
+            return False
+        return True
+
+    def paths(self, index_store: BaseIndexStore) -> pds.PathList:
+        """The matching paths: oldest first for a time range, by path otherwise"""
+        if self.file_hash:
+            candidates = sorted(index_store.paths_with_hash(self.file_hash))
+        elif self.core_filename:
+            candidates = sorted(index_store.paths_with_core_filename(self.core_filename))
+        elif self._has_time_range():
+            candidates = index_store.paths_with_image_time_between(self.oldest, self.newest)
+            if not self.creator:
+                return candidates  # Nothing else to check
+        else:
+            return sorted(path for path, image_properties in index_store.all_image_properties()
+                          if self._is_match(path, image_properties))
+        return [path for path in candidates if self._is_match(path, index_store.known_image_properties(path))]
@@ -0,0 +1,201 @@
+import re
+import sys
+
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import jsonable
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A compact record of the properties of one indexed image.
+#
+#  A PropertyDict holds about a dozen strings per image. An ImageRecord has
+#  one __slots__ field per known key instead, in the cheapest exact form:
+#
+#     digests     -> raw bytes        "9f86d0..." (64 chars) -> 32 bytes
+#     numbers     -> int              "4772278" -> 4772278
+#     dates       -> packed int       "2019-12-25 03:12:06 +0000" -> 2019122503120610000
+#     phashes     -> int
+#     creator...  -> interned str     one copy for all the images of a camera
+#
+#  Values that do not have the exact expected form stay as they are, so
+#  every value reads back exactly as it was set. It is a MutableMapping:
+#  callers keep using it like the PropertyDict it replaces.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+RE_DATE = re.compile(r"^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d) ([+-])(\d{4})$")
+RE_PHASH = re.compile(r"^[0-9a-f]{16}$")
+
+TZ_FACTOR = 100000  # Packed dates: YYYYMMDDhhmmss * TZ_FACTOR + sign (1 or 2) * 10000 + hhmm
+
+
+def _encode_digest(value: str) -> Any:
+    if len(value) % 2 == 0:
+        try:
+            digest = bytes.fromhex(value)
+        except ValueError:
+            return value
+        if digest.hex() == value:
+            return digest
+    return value
+
+
+def _decode_digest(value: bytes) -> str:
+    return value.hex()
+
+
+def _encode_number(value: str) -> Any:
+    if value.isdigit() and str(int(value)) == value:
+        return int(value)
+    return value
+
+
+def _decode_number(value: int) -> str:
+    return str(value)
+
+
+def _encode_date(value: str) -> Any:
+    match = RE_DATE.match(value)
+    if not match:
+        return value
+    year, month, day, hour, minute, second, sign, tz = match.groups()
+    digits = int(year + month + day + hour + minute + second)
+    return digits * TZ_FACTOR + (1 if sign == "+" else 2) * 10000 + int(tz)
+
+
+def _decode_date(value: int) -> str:
+    digits, tz_code = divmod(value, TZ_FACTOR)
+    sign, tz = divmod(tz_code, 10000)
+    d = f"{digits:014d}"
+    return f"{d[0:4]}-{d[4:6]}-{d[6:8]} {d[8:10]}:{d[10:12]}:{d[12:14]} {'+' if sign == 1 else '-'}{tz:04d}"
+
+
+def _encode_phash(value: str) -> Any:
+    return int(value, 16) if RE_PHASH.match(value) else value
+
+
+def _decode_phash(value: int) -> str:
+    return f"{value:016x}"
+
+
+def _encode_interned(value: str) -> Any:
+    return sys.intern(value)
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+Codec = Tuple[str, Callable[[str], Any], Callable[[Any], str]]
+
+# PropertyDict key -> (slot, encode, decode). Encoders only get strings, decoders only what is not a string.
+CODECS: Dict[str, Codec] = {
+    pdc.KEY_FILE_DATE: ("file_date", _encode_date, _decode_date),
+    pdc.KEY_FILE_SIZE: ("file_size", _encode_number, _decode_number),
+    pdc.KEY_FILE_MTIME_NS: ("file_mtime_ns", _encode_number, _decode_number),
+    pdc.KEY_FILE_INODE: ("file_inode", _encode_number, _decode_number),
+    pdc.KEY_FILE_DEVICE: ("file_device", _encode_number, _decode_number),
+    pdc.KEY_FILE_HASH: ("file_hash", _encode_digest, _decode_digest),
+    pdc.KEY_FILE_PARTIAL_HASH: ("file_partial_hash", _encode_digest, _decode_digest),
+    pdc.KEY_FILE_SECOND_HASH: ("file_second_hash", _encode_digest, _decode_digest),
+    pdc.KEY_FILE_CORE_NAME: ("file_core_name", _identity, _identity),
+    pdc.KEY_IMAGE_DATE: ("image_date", _encode_date, _decode_date),
+    pdc.KEY_IMAGE_RES: ("image_res", _encode_interned, _identity),
+    pdc.KEY_IMAGE_LOC: ("image_loc", _identity, _identity),
+    pdc.KEY_IMAGE_CREATOR: ("image_creator", _encode_interned, _identity),
+    pdc.KEY_IMAGE_ANGLES: ("image_angles", _encode_interned, _identity),
+    pdc.KEY_IMAGE_CAMSET: ("image_camset", _encode_interned, _identity),
+    pdc.KEY_IMAGE_PHASH: ("image_phash", _encode_phash, _decode_phash),
+}
+
+
+class ImageRecord(MutableMapping):
+    """A PropertyDict, with its known keys in slots. A slot that is not set is a key that is not there."""
+
+    __slots__ = tuple(slot for slot, _, _ in CODECS.values()) + ("extra",)
+
+    def __init__(self, image_properties: pdc.PropertyDict = None) -> None:
+        if image_properties:
+            for key, value in image_properties.items():
+                codec = CODECS.get(key)
+                if codec is None:
+                    self[key] = value
+                else:
+                    setattr(self, codec[0], codec[1](value) if value.__class__ is str else value)
+
+    def of(image_properties: pdc.PropertyDict):
+        """Returns `image_properties` as an ImageRecord, without a copy if it already is one"""
+        if isinstance(image_properties, ImageRecord):
+            return image_properties
+        return ImageRecord(image_properties)
+
+    def __getitem__(self, key: str) -> str:
+        codec = CODECS.get(key)
+        if codec is None:
+            extra = getattr(self, "extra", None)
+            if extra is None or not key in extra:
+                raise KeyError(key)
+            return extra[key]
+        slot, _, decode = codec
+        try:
+            value = getattr(self, slot)
+        except AttributeError:
+            raise KeyError(key)
+        if value is None or isinstance(value, str):
+            return value
+        return decode(value)
+
+    def get(self, key: str, default: Any = None) -> str:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: str) -> None:
+        codec = CODECS.get(key)
+        if codec is None:
+            if getattr(self, "extra", None) is None:
+                self.extra = dict()
+            self.extra[key] = value
+            return
+        slot, encode, _ = codec
+        setattr(self, slot, encode(value) if isinstance(value, str) else value)
+
+    def __delitem__(self, key: str) -> None:
+        codec = CODECS.get(key)
+        try:
+            if codec is None:
+                del self.extra[key]
+            else:
+                delattr(self, codec[0])
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        codec = CODECS.get(key)
+        if codec is None:
+            extra = getattr(self, "extra", None)
+            return extra is not None and key in extra
+        return hasattr(self, codec[0])
+
+    def __iter__(self) -> Iterator[str]:
+        for key, (slot, _, _) in CODECS.items():
+            if hasattr(self, slot):
+                yield key
+        extra = getattr(self, "extra", None)
+        if extra:
+            yield from extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"ImageRecord({dict(self)!r})"
+
+
+@jsonable.encode.register
+def _(val: ImageRecord) -> Dict:
+    return dict(val)
@@ -0,0 +1,442 @@
+import json
+import re
+import threading
+
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Set, Tuple
+
+from picdeduper import bloom as pdb
+from picdeduper import common as pdc
+from picdeduper import dirsummaries as pdds
+from picdeduper import journal as pdj
+from picdeduper import jsonable
+from picdeduper import platform as pds
+from picdeduper import time as pdt
+from picdeduper.indexstore import BaseIndexStore, IndexStore, NO_NEWEST_IMAGE_DATE, NO_OLDEST_IMAGE_DATE
+from picdeduper.indexstore import image_properties_key
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  An index split into shards by the month an image was taken:
+#
+#     picdedupe.pdshards          the manifest, with a ShardSummary per shard,
+#                                 and the DirectorySummary of every directory
+#     picdedupe-2019-12.json      an IndexStore per YYYY-MM of KEY_IMAGE_DATE
+#     picdedupe-undated.json      ... and one for the images without a date
+#
+#  Nothing but the manifest gets read on load. A lookup only loads the
+#  shards whose summary says they may have a match: Bloom filters of the
+#  paths, sizes, hashes, core filenames & image properties keys, and a
+#  histogram of the sizes. An image properties key includes the image date,
+#  so that lookup goes to a single shard. Similar perceptual hashes cannot
+#  be summarized that way: they get looked up in every shard that has any.
+#
+#  At most MAX_LOADED_SHARDS stay loaded. Shards with changes stay until
+#  they are saved.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+MANIFEST_EXTS = [".PDSHARDS"]
+MANIFEST_VERSION = 1
+
+UNDATED_SHARD = "undated"
+RE_SHARD_OF_IMAGE_DATE = re.compile(r"^(\d{4}-\d\d)-")
+
+MAX_LOADED_SHARDS = 24
+
+# The image dates of a shard are compared as strings: its oldest & newest are off by up to that, in time
+MAX_UTC_OFFSET_SPREAD = 26 * 3600  # From UTC-12:00 to UTC+14:00
+
+SIZE_BUCKETS_PER_OCTAVE = 8
+
+KEY_JSON_VERSION = "version"
+KEY_JSON_SHARDS = "shards"
+KEY_JSON_DIRECTORIES = "directories"
+KEY_JSON_ENTRY_COUNT = "entries"
+KEY_JSON_OLDEST_IMAGE_DATE = "oldest_image_date"
+KEY_JSON_NEWEST_IMAGE_DATE = "newest_image_date"
+KEY_JSON_SIZE_HISTOGRAM = "size_histogram"
+KEY_JSON_PHASH_COUNT = "phashes"
+KEY_JSON_BLOOMS = "blooms"
+
+BLOOM_PATHS = "paths"
+BLOOM_SIZES = "sizes"
+BLOOM_FILE_HASHES = "file_hashes"
+BLOOM_PARTIAL_HASHES = "partial_hashes"
+BLOOM_CORE_FILENAMES = "core_filenames"
+BLOOM_IMAGE_PROPERTIES = "image_properties"
+BLOOM_NAMES = [
+    BLOOM_PATHS,
+    BLOOM_SIZES,
+    BLOOM_FILE_HASHES,
+    BLOOM_PARTIAL_HASHES,
+    BLOOM_CORE_FILENAMES,
+    BLOOM_IMAGE_PROPERTIES,
+]
+
+
+def is_sharded_path(path: pds.Path) -> bool:
+    return pds.filename_ext(pds.path_filename(path)).upper() in MANIFEST_EXTS
+
+
+def shard_of_image_date(image_date: str) -> str:
+    """e.g. '2019-12-25 03:12:06 +0000' -> '2019-12'"""
+    match = RE_SHARD_OF_IMAGE_DATE.match(image_date or "")
+    return match.group(1) if match else UNDATED_SHARD
+
+
+def shard_path_of(manifest_path: pds.Path, shard: str) -> pds.Path:
+    """e.g. ('/c/picdedupe.pdshards', '2019-12') -> '/c/picdedupe-2019-12.json'"""
+    ext = pds.filename_ext(manifest_path)
+    return f"{manifest_path[:len(manifest_path) - len(ext)]}-{shard}.json"
+
+
+def size_bucket(size: int) -> int:
+    """The octave of `size`, cut in SIZE_BUCKETS_PER_OCTAVE: e.g. the sizes in [3.5 MiB, 4 MiB) share a bucket"""
+    bits = size.bit_length()
+    if bits <= 3:
+        return size
+    return bits * SIZE_BUCKETS_PER_OCTAVE + ((size >> (bits - 4)) & (SIZE_BUCKETS_PER_OCTAVE - 1))
+
+
+class ShardSummary(jsonable.Jsonable):
+    """What the manifest knows about a shard, without loading it"""
+
+    def __init__(self) -> None:
+        self.entry_count = 0
+        self.oldest_image_date = NO_OLDEST_IMAGE_DATE
+        self.newest_image_date = NO_NEWEST_IMAGE_DATE
+        self.size_histogram: Dict[str, int] = dict()  # str(size_bucket()) -> count
+        self.phash_count = 0
+        self.blooms: Dict[str, pdb.BloomFilter] = {name: pdb.BloomFilter.for_capacity(0) for name in BLOOM_NAMES}
+
+    def of(index_store: BaseIndexStore):
+        output = ShardSummary()
+        values: Dict[str, List[str]] = {name: list() for name in BLOOM_NAMES}
+        for path, image_properties in index_store.all_image_properties():
+            output.entry_count += 1
+            values[BLOOM_PATHS].append(path)
+            values[BLOOM_CORE_FILENAMES].append(pds.path_core_filename(path))
+            size = image_properties.get(pdc.KEY_FILE_SIZE)
+            if size:
+                values[BLOOM_SIZES].append(size)
+                bucket = str(size_bucket(int(size)))
+                output.size_histogram[bucket] = output.size_histogram.get(bucket, 0) + 1
+            for name, key in [(BLOOM_FILE_HASHES, pdc.KEY_FILE_HASH),
+                              (BLOOM_PARTIAL_HASHES, pdc.KEY_FILE_PARTIAL_HASH)]:
+                value = image_properties.get(key)
+                if value:
+                    values[name].append(value)
+            image_key = image_properties_key(image_properties)
+            if image_key:
+                values[BLOOM_IMAGE_PROPERTIES].append(image_key)
+            if image_properties.get(pdc.KEY_IMAGE_PHASH):
+                output.phash_count += 1
+        output.oldest_image_date, output.newest_image_date = index_store.image_date_range()
+        output.blooms = {name: pdb.BloomFilter.of(values[name], len(values[name])) for name in BLOOM_NAMES}
+        return output
+
+    def may_have(self, bloom_name: str, value: str) -> bool:
+        return value in self.blooms[bloom_name]
+
+    def may_have_size(self, size: str) -> bool:
+        if not str(size_bucket(int(size))) in self.size_histogram:
+            return False
+        return self.may_have(BLOOM_SIZES, size)
+
+    def jsonable_encode(self) -> Dict:
+        return {
+            KEY_JSON_ENTRY_COUNT: self.entry_count,
+            KEY_JSON_OLDEST_IMAGE_DATE: self.oldest_image_date,
+            KEY_JSON_NEWEST_IMAGE_DATE: self.newest_image_date,
+            KEY_JSON_SIZE_HISTOGRAM: jsonable.encode(self.size_histogram),
+            KEY_JSON_PHASH_COUNT: self.phash_count,
+            KEY_JSON_BLOOMS: jsonable.encode(self.blooms),
+        }
+
+    def jsonable_decode(val: Dict):
+        output = ShardSummary()
+        output.entry_count = val[KEY_JSON_ENTRY_COUNT]
+        output.oldest_image_date = val[KEY_JSON_OLDEST_IMAGE_DATE]
+        output.newest_image_date = val[KEY_JSON_NEWEST_IMAGE_DATE]
+        output.size_histogram = dict(val[KEY_JSON_SIZE_HISTOGRAM])
+        output.phash_count = val[KEY_JSON_PHASH_COUNT]
+        output.blooms = {name: pdb.BloomFilter.jsonable_decode(bloom) for name, bloom in val[KEY_JSON_BLOOMS].items()}
+        return output
+
+
+class ShardedIndexStore(BaseIndexStore):
+
+    def __init__(self, platform: pds.Platform, manifest_path: pds.Path) -> None:
+        super().__init__(platform)
+        self.manifest_path = manifest_path
+        self.summaries: Dict[str, ShardSummary] = dict()
+        self.directory_summaries: pdds.DirectorySummaries = dict()
+        self.shards: Dict[str, IndexStore] = OrderedDict()  # The loaded ones, least recently used first
+        self.dirty: Set[str] = set()  # Shards with changes that are not saved yet
+        self.lock = threading.RLock()  # Worker threads look up processed files
+        self.is_persisting = True
+
+    def _shard_path(self, shard: str) -> pds.Path:
+        return shard_path_of(self.manifest_path, shard)
+
+    def _shard(self, shard: str) -> IndexStore:
+        """Returns the loaded shard, loading (or creating) it if needed"""
+        with self.lock:
+            if shard in self.shards:
+                self.shards.move_to_end(shard)
+                return self.shards[shard]
+            if shard in self.summaries:
+                index_store = IndexStore.load(self._shard_path(shard), self.platform,
+                                              journaled=self.is_persisting, read_only=not self.is_persisting)
+            else:
+                index_store = IndexStore(self.platform)
+                self.summaries[shard] = ShardSummary()
+                if self.is_persisting:
+                    index_store.journal = pdj.IndexJournal(self.platform, self._shard_path(shard))
+                    self._save_manifest(self.manifest_path)  # So a crashed run finds the journal of the new shard
+            self.shards[shard] = index_store
+            self._unload_shards_over_max()
+            return index_store
+
+    def _unload_shards_over_max(self):
+        for shard in list(self.shards):
+            if len(self.shards) <= MAX_LOADED_SHARDS:
+                return
+            if not shard in self.dirty:
+                del self.shards[shard]
+
+    def _read_shard(self, shard: str) -> IndexStore:
+        """Returns the shard, without keeping it loaded"""
+        if shard in self.shards:
+            return self.shards[shard]
+        return IndexStore.load(self._shard_path(shard), self.platform, read_only=not self.is_persisting)
+
+    def _shards_that_may_have(self, bloom_name: str, value: str) -> Iterator[IndexStore]:
+        for shard, summary in sorted(self.summaries.items()):
+            if shard in self.shards or summary.may_have(bloom_name, value):
+                yield self._shard(shard)
+
+    def _shard_with_path(self, path: pds.Path) -> str:
+        """Returns the name of the (loaded) shard that has `path`, or None"""
+        with self.lock:
+            for shard, summary in sorted(self.summaries.items()):
+                if shard in self.shards or summary.may_have(BLOOM_PATHS, path):
+                    if self._shard(shard).known_image_properties(path) is not None:
+                        return shard
+            return None
+
+    def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        print(f"Indexed: {path}")
+        self.resolve_hash_collisions(path, image_properties)
+        shard = shard_of_image_date(image_properties.get(pdc.KEY_IMAGE_DATE))
+        with self.lock:
+            old_shard = self._shard_with_path(path)
+            if old_shard is not None and old_shard != shard:  # Its image date changed
+                self._shard(old_shard).remove_paths({path})
+                self.dirty.add(old_shard)
+            index_store = self._shard(shard)
+            index_store.data.add(path, image_properties)
+            index_store.file_series_splitter.add_path(path, image_properties)
+            index_store._journal_record(path)
+            self.dirty.add(shard)
+
+    def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
+        known = self.known_image_properties(path)
+        return dict() if known is None else known
+
+    def known_image_properties(self, path: pds.Path) -> pdc.PropertyDict:
+        with self.lock:
+            shard = self._shard_with_path(path)
+            return None if shard is None else self.shards[shard].known_image_properties(path)
+
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        with self.lock:
+            shard = self._shard_with_path(path)
+            if shard is None:
+                raise KeyError(path)
+            self.shards[shard].update_known_image_properties(path, image_properties)
+            self.dirty.add(shard)
+
+    def all_image_properties(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        for shard, summary in sorted(self.summaries.items()):
+            if summary.entry_count or shard in self.shards:
+                yield from self._read_shard(shard).all_image_properties()
+
+    def paths_with_hash(self, file_hash: str) -> pds.PathSet:
+        output: pds.PathSet = set()
+        for index_store in self._shards_that_may_have(BLOOM_FILE_HASHES, file_hash):
+            output |= index_store.paths_with_hash(file_hash)
+        return output
+
+    def paths_with_core_filename(self, core_filename: pds.Filename) -> pds.PathSet:
+        output: pds.PathSet = set()
+        for index_store in self._shards_that_may_have(BLOOM_CORE_FILENAMES, core_filename):
+            output |= index_store.paths_with_core_filename(core_filename)
+        return output
+
+    def paths_with_size(self, size: str) -> pds.PathSet:
+        output: pds.PathSet = set()
+        for shard, summary in sorted(self.summaries.items()):
+            if shard in self.shards or summary.may_have_size(size):
+                output |= self._shard(shard).paths_with_size(size)
+        return output
+
+    def paths_with_partial_hash(self, partial_hash: str) -> pds.PathSet:
+        output: pds.PathSet = set()
+        for index_store in self._shards_that_may_have(BLOOM_PARTIAL_HASHES, partial_hash):
+            output |= index_store.paths_with_partial_hash(partial_hash)
+        return output
+
+    def paths_with_image_properties(self, image_properties: pdc.PropertyDict) -> pds.PathSet:
+        key = image_properties_key(image_properties)
+        shard = shard_of_image_date(image_properties.get(pdc.KEY_IMAGE_DATE))
+        if not key or not shard in self.summaries:
+            return set()
+        if not shard in self.shards and not self.summaries[shard].may_have(BLOOM_IMAGE_PROPERTIES, key):
+            return set()
+        return self._shard(shard).paths_with_image_properties(image_properties)
+
+    def paths_with_similar_phash(self, phash: str, max_distance: int) -> Dict[pds.Path, int]:
+        output: Dict[pds.Path, int] = dict()
+        for shard, summary in sorted(self.summaries.items()):
+            if shard in self.shards or summary.phash_count:
+                output.update(self._shard(shard).paths_with_similar_phash(phash, max_distance))
+        return output
+
+    def image_date_range(self) -> Tuple[str, str]:
+        oldest, newest = NO_OLDEST_IMAGE_DATE, NO_NEWEST_IMAGE_DATE
+        for shard, summary in self.summaries.items():
+            if shard in self.shards:
+                shard_oldest, shard_newest = self.shards[shard].image_date_range()
+            else:
+                shard_oldest, shard_newest = summary.oldest_image_date, summary.newest_image_date
+            oldest, newest = min(oldest, shard_oldest), max(newest, shard_newest)
+        return oldest, newest
+
+    def __len__(self) -> int:
+        return sum(len(self.shards[shard]) if shard in self.shards else summary.entry_count
+                   for shard, summary in self.summaries.items())
+
+    def paths_with_image_time_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        """Only loads the shards with images of that time"""
+        entries = list()
+        with self.lock:
+            for shard, summary in sorted(self.summaries.items()):
+                if shard in self.shards:
+                    shard_oldest, shard_newest = self.shards[shard].image_date_range()
+                else:
+                    shard_oldest, shard_newest = summary.oldest_image_date, summary.newest_image_date
+                if shard_oldest == NO_OLDEST_IMAGE_DATE or shard_newest == NO_NEWEST_IMAGE_DATE:
+                    continue  # Nothing dated
+                if newest is not None and pdt.timestamp_from_string(shard_oldest) - MAX_UTC_OFFSET_SPREAD > newest:
+                    continue
+                if oldest is not None and pdt.timestamp_from_string(shard_newest) + MAX_UTC_OFFSET_SPREAD < oldest:
+                    continue
+                entries.extend(self._shard(shard).data.by_image_time.entries_between(oldest, newest))
+        return [path for _, path in sorted(entries)]
+
+    def remove_paths(self, paths: pds.PathSet):
+        """NOTE: The Bloom filters of the shards only lose the paths once they get summarized again, on save()"""
+        with self.lock:
+            by_shard: Dict[str, pds.PathSet] = dict()
+            for path in paths:
+                shard = self._shard_with_path(path)
+                if shard is not None:
+                    by_shard.setdefault(shard, set()).add(path)
+            for shard, shard_paths in by_shard.items():
+                self._shard(shard).remove_paths(shard_paths)
+                self.dirty.add(shard)
+
+    def directory_summary(self, dir_path: pds.Path) -> pdds.DirectorySummary:
+        return self.directory_summaries.get(dir_path)
+
+    def set_directory_summaries(self, summaries: pdds.DirectorySummaries):
+        self.directory_summaries.update(summaries)
+
+    def _set_indexed_file_hash(self, path: pds.Path, file_hash: str):
+        with self.lock:
+            shard = self._shard_with_path(path)
+            self.shards[shard]._set_indexed_file_hash(path, file_hash)
+            self.dirty.add(shard)
+
+    def _set_indexed_partial_hash(self, path: pds.Path, partial_hash: str):
+        with self.lock:
+            shard = self._shard_with_path(path)
+            self.shards[shard]._set_indexed_partial_hash(path, partial_hash)
+            self.dirty.add(shard)
+
+    def commit(self):
+        with self.lock:
+            for index_store in self.shards.values():
+                index_store.commit()
+
+    def stop_persisting(self):
+        with self.lock:
+            for index_store in self.shards.values():
+                index_store.stop_persisting()
+            self.is_persisting = False
+
+    def import_index_store(self, index_store: BaseIndexStore) -> int:
+        """Adds every entry of `index_store` to its shard, as is. Returns how many."""
+        count = 0
+        for path, image_properties in index_store.all_image_properties():
+            shard = shard_of_image_date(image_properties.get(pdc.KEY_IMAGE_DATE))
+            self._shard(shard).data.add(path, image_properties)
+            self.shards[shard].file_series_splitter.add_path(path, image_properties)
+            self.dirty.add(shard)
+            count += 1
+        return count
+
+    def _save_manifest(self, path: pds.Path):
+        storage_dict = {
+            KEY_JSON_VERSION: MANIFEST_VERSION,
+            KEY_JSON_SHARDS: jsonable.encode(self.summaries),
+            KEY_JSON_DIRECTORIES: jsonable.encode(self.directory_summaries),
+        }
+        self.platform.write_text_chunks(path, [json.dumps(obj=storage_dict, indent=2, sort_keys=True)])
+
+    def save(self, path: pds.Path):
+        """Saves the shards with changes, and the manifest. Or every shard, when saving somewhere else."""
+        with self.lock:
+            is_in_place = path == self.manifest_path
+            for shard in sorted(self.summaries):
+                if is_in_place and not shard in self.dirty:
+                    continue
+                index_store = self._read_shard(shard)
+                index_store.save(shard_path_of(path, shard))
+                if shard in self.dirty:
+                    self.summaries[shard] = ShardSummary.of(index_store)
+            if is_in_place:
+                self.dirty.clear()
+                self._unload_shards_over_max()
+            self._save_manifest(path)
+
+    def load(path: pds.Path, platform: pds.Platform, read_only: bool = False):
+        """
+        Only reads the manifest. Shards with journals left behind by a crashed run
+        get replayed, compacted & summarized again right away, as the manifest does not know what they got.
+        With `read_only`, they only get replayed & summarized in memory: nothing gets written.
+        """
+        index_store = ShardedIndexStore(platform, path)
+        index_store.is_persisting = not read_only
+        if not platform.path_exists(path):
+            print("WARNING: No manifest found. Starting new sharded index.")
+            return index_store
+        storage_dict = json.loads(platform.read_text_file(path))
+        if storage_dict.get(KEY_JSON_VERSION) != MANIFEST_VERSION:
+            raise ValueError(f"{path} is not a manifest of a sharded index (of version {MANIFEST_VERSION})")
+        index_store.summaries = {shard: ShardSummary.jsonable_decode(summary)
+                                 for shard, summary in storage_dict[KEY_JSON_SHARDS].items()}
+        directory_summaries = storage_dict.get(KEY_JSON_DIRECTORIES, dict())
+        index_store.directory_summaries = {dir_path: pdds.DirectorySummary.jsonable_decode(summary)
+                                           for dir_path, summary in directory_summaries.items()}
+
+        is_replayed = False
+        for shard in sorted(index_store.summaries):
+            if not pdj.IndexJournal(platform, index_store._shard_path(shard)).is_empty():
+                index_store.summaries[shard] = ShardSummary.of(index_store._shard(shard))
+                is_replayed = True
+        if is_replayed and not read_only:
+            index_store._save_manifest(path)
+        return index_store
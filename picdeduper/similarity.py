@@ -0,0 +1,146 @@
+import itertools
+import math
+
+from typing import Dict, Iterator, List, Sequence, Set, Tuple
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Perceptual hashes, and an index to find the ones within a Hamming distance.
+#
+#  HammingIndex is a multi-index hash table: every 64-bit hash is cut into
+#  4 segments of 16 bits, with one table per segment. Two hashes within
+#  distance k share at least one segment within distance k // 4 (pigeonhole),
+#  so a query only probes a few hundred table slots, and then checks the
+#  few candidates it found. No scan over all the hashes.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+PerceptualHash = int
+
+PHASH_BITS = 64
+PHASH_SEGMENTS = 4
+
+# Grid of the difference hash: 9 columns compared pairwise, on 8 rows -> 64 bits
+DHASH_WIDTH = 9
+DHASH_HEIGHT = 8
+
+
+def hamming_distance(a: PerceptualHash, b: PerceptualHash) -> int:
+    return bin(a ^ b).count("1")
+
+
+def phash_string(value: PerceptualHash) -> str:
+    """This is how perceptual hashes get stored in a PropertyDict"""
+    return f"{value:016x}"
+
+
+def phash_from_string(value: str) -> PerceptualHash:
+    return int(value, 16)
+
+
+def _area_weights(size: int, to_size: int) -> List[List[Tuple[int, float]]]:
+    """For every output pixel: the (source pixel, weight) pairs it covers, with fractional edges"""
+    output = list()
+    for i in range(to_size):
+        start = i * size / to_size
+        end = (i + 1) * size / to_size
+        weights = [(j, min(end, j + 1) - max(start, j)) for j in range(int(start), min(size, math.ceil(end)))]
+        total = sum(w for _, w in weights)
+        output.append([(j, w / total) for j, w in weights])
+    return output
+
+
+def _resized_grayscale(pixels: Sequence[int], width: int, height: int, to_width: int, to_height: int) -> List[float]:
+    """Area-weighted box filter, first along the rows, then along the columns."""
+    column_weights = _area_weights(width, to_width)
+    row_weights = _area_weights(height, to_height)
+    rows = list()
+    for y in range(height):
+        offset = y * width
+        rows.append([sum(pixels[offset + j] * w for j, w in weights) for weights in column_weights])
+    output = list()
+    for weights in row_weights:
+        for x in range(to_width):
+            output.append(round(sum(rows[j][x] * w for j, w in weights), 6))  # No float noise on flat areas
+    return output
+
+
+def dhash_of_grayscale(pixels: Sequence[int], width: int, height: int) -> PerceptualHash:
+    """
+    Difference hash of a grayscale image (`pixels` row by row, any size).
+    Every bit tells if a pixel of the 9x8 thumbnail is brighter than its right neighbor.
+    """
+    if width < 1 or height < 1 or len(pixels) < width * height:
+        raise ValueError(f"Not a {width}x{height} image")
+    grid = _resized_grayscale(pixels, width, height, DHASH_WIDTH, DHASH_HEIGHT)
+    value = 0
+    for y in range(DHASH_HEIGHT):
+        row = grid[y * DHASH_WIDTH:(y + 1) * DHASH_WIDTH]
+        for x in range(DHASH_WIDTH - 1):
+            value = (value << 1) | (1 if row[x] > row[x + 1] else 0)
+    return value
+
+
+def _variants_within(value: int, bits: int, max_distance: int) -> Iterator[int]:
+    """Yields every value within `max_distance` bit flips of `value` (itself included)"""
+    for distance in range(max_distance + 1):
+        for positions in itertools.combinations(range(bits), distance):
+            variant = value
+            for position in positions:
+                variant ^= 1 << position
+            yield variant
+
+
+class HammingIndex:
+
+    def __init__(self, bits: int = PHASH_BITS, segments: int = PHASH_SEGMENTS) -> None:
+        assert bits % segments == 0
+        self.bits = bits
+        self.segments = segments
+        self.segment_bits = bits // segments
+        self.segment_mask = (1 << self.segment_bits) - 1
+        self.tables: List[Dict[int, Set[PerceptualHash]]] = [dict() for _ in range(segments)]
+        self.values: Set[PerceptualHash] = set()
+
+    def _segments_of(self, value: PerceptualHash) -> List[int]:
+        return [(value >> (i * self.segment_bits)) & self.segment_mask for i in range(self.segments)]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, value: PerceptualHash) -> bool:
+        return value in self.values
+
+    def add(self, value: PerceptualHash) -> None:
+        if value in self.values:
+            return
+        self.values.add(value)
+        for table, segment in zip(self.tables, self._segments_of(value)):
+            if not segment in table:
+                table[segment] = set()
+            table[segment].add(value)
+
+    def remove(self, value: PerceptualHash) -> None:
+        if not value in self.values:
+            return
+        self.values.remove(value)
+        for table, segment in zip(self.tables, self._segments_of(value)):
+            table[segment].discard(value)
+            if not table[segment]:
+                del table[segment]
+
+    def within(self, value: PerceptualHash, max_distance: int) -> Dict[PerceptualHash, int]:
+        """Returns every indexed value within `max_distance` of `value`, with its distance"""
+        segment_distance = max_distance // self.segments
+        output: Dict[PerceptualHash, int] = dict()
+        checked: Set[PerceptualHash] = set()
+        for table, segment in zip(self.tables, self._segments_of(value)):
+            for variant in _variants_within(segment, self.segment_bits, segment_distance):
+                for candidate in table.get(variant, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+                    distance = hamming_distance(value, candidate)
+                    if distance <= max_distance:
+                        output[candidate] = distance
+        return output
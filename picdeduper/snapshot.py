@@ -0,0 +1,449 @@
+import struct
+
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import dirsummaries as pdds
+from picdeduper import platform as pds
+from picdeduper import similarity as pdsim
+from picdeduper import time as pdt
+from picdeduper import timeindex as pdti
+from picdeduper.indexstore import BaseIndexStore, IndexStore, NO_NEWEST_IMAGE_DATE, NO_OLDEST_IMAGE_DATE
+from picdeduper.indexstore import image_properties_key
+from picdeduper.shardedindexstore import ShardedIndexStore, is_sharded_path
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  A compact binary snapshot of an index, to be used through mmap:
+#
+#     header | section directory | sections (8-byte aligned)
+#
+#  Sections:
+#     string offsets, strings     every path, key & value, UTF-8, deduplicated
+#     entries                     (path, first property, property count), by path
+#     properties                  (key, value) string ids
+#     by hash, by partial hash    (raw digest, entry), by digest
+#     by core filename            (string, entry), by string
+#     by image properties         (string, entry), by string (of image_properties_key())
+#     by size, by phash           (number, entry), by number
+#
+#  Every table is sorted with fixed-width rows, so a lookup is a binary
+#  search that only touches the pages it needs. Nothing gets decoded on
+#  load, and processes that map the same file share its pages.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+SNAPSHOT_EXTS = [".PDIDX"]
+
+MAGIC = b"PDIDX\x00\x00\x02"
+DEFAULT_DIGEST_WIDTH = 32  # SHA-256
+NO_STRING = 0xFFFFFFFF
+
+HEADER = struct.Struct("<8sIIII")   # magic, digest width, entry count, oldest & newest image date
+SECTION = struct.Struct("<QQ")      # offset, row count (byte count for the strings)
+STRING_OFFSET = struct.Struct("<Q")
+ENTRY = struct.Struct("<III")       # path, first property, property count
+PROPERTY = struct.Struct("<II")     # key, value
+BY_STRING = struct.Struct("<II")    # string, entry
+BY_NUMBER = struct.Struct("<QI")    # number, entry
+ENTRY_INDEX = struct.Struct("<I")   # follows the digest, in the by-digest tables
+
+(SECTION_STRING_OFFSETS,
+ SECTION_STRINGS,
+ SECTION_ENTRIES,
+ SECTION_PROPERTIES,
+ SECTION_BY_HASH,
+ SECTION_BY_PARTIAL_HASH,
+ SECTION_BY_CORE_FILENAME,
+ SECTION_BY_SIZE,
+ SECTION_BY_PHASH,
+ SECTION_BY_IMAGE_PROPERTIES) = range(10)
+SECTION_COUNT = 10
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def is_snapshot_path(path: pds.Path) -> bool:
+    return pds.filename_ext(pds.path_filename(path)).upper() in SNAPSHOT_EXTS
+
+
+def _lower_bound(count: int, key_at: Callable[[int], object], key: object) -> int:
+    """Index of the first row whose key is not less than `key`"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key_at(mid) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class _StringTable:
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = dict()
+        self.encoded: List[bytes] = list()
+
+    def id_of(self, value: str) -> int:
+        if value is None:
+            return NO_STRING
+        if not value in self.ids:
+            self.ids[value] = len(self.encoded)
+            self.encoded.append(value.encode("utf-8"))
+        return self.ids[value]
+
+
+def snapshot_bytes_of(entries: Iterable[Tuple[pds.Path, pdc.PropertyDict]], image_date_range: Tuple[str, str]) -> bytes:
+    strings = _StringTable()
+    entry_rows = list()
+    property_rows = list()
+    by_digest = {pdc.KEY_FILE_HASH: list(), pdc.KEY_FILE_PARTIAL_HASH: list()}
+    by_core_filename = list()
+    by_size = list()
+    by_phash = list()
+    by_image_properties = list()
+    digest_width = None
+
+    for entry, (path, image_properties) in enumerate(sorted(entries)):
+        entry_rows.append(ENTRY.pack(strings.id_of(path), len(property_rows), len(image_properties)))
+        for key in sorted(image_properties):
+            value = image_properties[key]
+            if value is not None and not isinstance(value, str):
+                raise SnapshotError(f"{path}: {key} is not a string")
+            property_rows.append(PROPERTY.pack(strings.id_of(key), strings.id_of(value)))
+        for key, rows in by_digest.items():
+            value = image_properties.get(key)
+            if not value:
+                continue
+            try:
+                digest = bytes.fromhex(value)
+            except ValueError:
+                raise SnapshotError(f"{path}: {key} is not a hex digest")
+            digest_width = digest_width or len(digest)
+            if len(digest) != digest_width:
+                raise SnapshotError(f"{path}: {key} is not a {digest_width}-byte digest")
+            rows.append((digest, entry))
+        by_core_filename.append((pds.path_core_filename(path).encode("utf-8"), entry))
+        size = image_properties.get(pdc.KEY_FILE_SIZE)
+        if size:
+            by_size.append((int(size), entry))
+        phash = image_properties.get(pdc.KEY_IMAGE_PHASH)
+        if phash:
+            by_phash.append((pdsim.phash_from_string(phash), entry))
+        image_key = image_properties_key(image_properties)
+        if image_key:
+            by_image_properties.append((image_key.encode("utf-8"), entry))
+
+    oldest, newest = image_date_range
+    header = HEADER.pack(MAGIC, digest_width or DEFAULT_DIGEST_WIDTH, len(entry_rows),
+                         strings.id_of(oldest), strings.id_of(newest))
+    string_ids = {encoded: strings.id_of(encoded.decode("utf-8"))
+                  for encoded, _ in by_core_filename + by_image_properties}
+
+    offsets = [0]
+    for encoded in strings.encoded:
+        offsets.append(offsets[-1] + len(encoded))
+    sections = [
+        (b"".join(STRING_OFFSET.pack(offset) for offset in offsets), len(offsets)),
+        (b"".join(strings.encoded), offsets[-1]),
+        (b"".join(entry_rows), len(entry_rows)),
+        (b"".join(property_rows), len(property_rows)),
+    ]
+    for key in [pdc.KEY_FILE_HASH, pdc.KEY_FILE_PARTIAL_HASH]:
+        rows = sorted(by_digest[key])
+        sections.append((b"".join(digest + ENTRY_INDEX.pack(entry) for digest, entry in rows), len(rows)))
+    rows = sorted(by_core_filename)
+    sections.append((b"".join(BY_STRING.pack(string_ids[name], entry) for name, entry in rows), len(rows)))
+    for rows in [sorted(by_size), sorted(by_phash)]:
+        sections.append((b"".join(BY_NUMBER.pack(number, entry) for number, entry in rows), len(rows)))
+    rows = sorted(by_image_properties)
+    sections.append((b"".join(BY_STRING.pack(string_ids[key], entry) for key, entry in rows), len(rows)))
+
+    output = bytearray(header)
+    directory_start = len(output)
+    output += bytes(SECTION.size * SECTION_COUNT)
+    for i, (content, count) in enumerate(sections):
+        output += bytes(-len(output) % 8)
+        SECTION.pack_into(output, directory_start + i * SECTION.size, len(output), count)
+        output += content
+    return bytes(output)
+
+
+class IndexSnapshot:
+    """Read-only view of the snapshot in `buffer`. Only decodes what gets looked up."""
+
+    def __init__(self, buffer: memoryview) -> None:
+        self.buffer = buffer
+        if len(buffer) < HEADER.size + SECTION.size * SECTION_COUNT:
+            raise SnapshotError("Truncated snapshot")
+        magic, self.digest_width, self.entry_count, oldest_id, newest_id = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not an index snapshot (or of another version)")
+        self.sections = [SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size) for i in range(SECTION_COUNT)]
+        self.oldest_image_date = self._string(oldest_id)
+        self.newest_image_date = self._string(newest_id)
+
+    def _row_offset(self, section: int, row_size: int, row: int) -> int:
+        return self.sections[section][0] + row * row_size
+
+    def _row_count(self, section: int) -> int:
+        return self.sections[section][1]
+
+    def _string_bytes(self, string_id: int) -> bytes:
+        offset = self._row_offset(SECTION_STRING_OFFSETS, STRING_OFFSET.size, string_id)
+        start, end = struct.unpack_from("<QQ", self.buffer, offset)
+        strings_start = self.sections[SECTION_STRINGS][0]
+        return bytes(self.buffer[strings_start + start:strings_start + end])
+
+    def _string(self, string_id: int) -> str:
+        if string_id == NO_STRING:
+            return None
+        return self._string_bytes(string_id).decode("utf-8")
+
+    def _entry(self, entry: int) -> Tuple[int, int, int]:
+        return ENTRY.unpack_from(self.buffer, self._row_offset(SECTION_ENTRIES, ENTRY.size, entry))
+
+    def path_of(self, entry: int) -> pds.Path:
+        return self._string(self._entry(entry)[0])
+
+    def properties_of(self, entry: int) -> pdc.PropertyDict:
+        _, first_property, property_count = self._entry(entry)
+        output: pdc.PropertyDict = dict()
+        for i in range(first_property, first_property + property_count):
+            key_id, value_id = PROPERTY.unpack_from(self.buffer, self._row_offset(SECTION_PROPERTIES, PROPERTY.size, i))
+            output[self._string(key_id)] = self._string(value_id)
+        return output
+
+    def entry_of_path(self, path: pds.Path) -> int:
+        """Returns the entry of `path`, or None"""
+        key = path.encode("utf-8")
+        entry = _lower_bound(self.entry_count, lambda i: self._string_bytes(self._entry(i)[0]), key)
+        if entry < self.entry_count and self._string_bytes(self._entry(entry)[0]) == key:
+            return entry
+        return None
+
+    def iter_entries(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        for entry in range(self.entry_count):
+            yield self.path_of(entry), self.properties_of(entry)
+
+    def _entries_in(self, section: int, row_size: int, key_at: Callable[[int], object], key: object) -> List[int]:
+        output = list()
+        row = _lower_bound(self._row_count(section), key_at, key)
+        while row < self._row_count(section) and key_at(row) == key:
+            entry_offset = self._row_offset(section, row_size, row + 1) - ENTRY_INDEX.size
+            output.append(ENTRY_INDEX.unpack_from(self.buffer, entry_offset)[0])
+            row += 1
+        return output
+
+    def _entries_with_digest(self, section: int, value: str) -> List[int]:
+        try:
+            digest = bytes.fromhex(value)
+        except ValueError:
+            return list()
+        row_size = self.digest_width + ENTRY_INDEX.size
+        return self._entries_in(section, row_size,
+                                lambda row: self._digest_at(section, row_size, row),
+                                digest)
+
+    def _digest_at(self, section: int, row_size: int, row: int) -> bytes:
+        start = self._row_offset(section, row_size, row)
+        return bytes(self.buffer[start:start + self.digest_width])
+
+    def entries_with_hash(self, file_hash: str) -> List[int]:
+        return self._entries_with_digest(SECTION_BY_HASH, file_hash)
+
+    def entries_with_partial_hash(self, partial_hash: str) -> List[int]:
+        return self._entries_with_digest(SECTION_BY_PARTIAL_HASH, partial_hash)
+
+    def _entries_with_string(self, section: int, value: str) -> List[int]:
+        return self._entries_in(section, BY_STRING.size,
+                                lambda row: self._string_bytes(self._by_string_row(section, row)[0]),
+                                value.encode("utf-8"))
+
+    def _by_string_row(self, section: int, row: int) -> Tuple[int, int]:
+        return BY_STRING.unpack_from(self.buffer, self._row_offset(section, BY_STRING.size, row))
+
+    def entries_with_core_filename(self, core_filename: pds.Filename) -> List[int]:
+        return self._entries_with_string(SECTION_BY_CORE_FILENAME, core_filename)
+
+    def entries_with_image_properties_key(self, key: str) -> List[int]:
+        return self._entries_with_string(SECTION_BY_IMAGE_PROPERTIES, key)
+
+    def _entries_with_number(self, section: int, number: int) -> List[int]:
+        def number_at(row: int) -> int:
+            return BY_NUMBER.unpack_from(self.buffer, self._row_offset(section, BY_NUMBER.size, row))[0]
+
+        return self._entries_in(section, BY_NUMBER.size, number_at, number)
+
+    def entries_with_size(self, size: int) -> List[int]:
+        return self._entries_with_number(SECTION_BY_SIZE, size)
+
+    def entries_with_phash(self, phash: pdsim.PerceptualHash) -> List[int]:
+        return self._entries_with_number(SECTION_BY_PHASH, phash)
+
+    def all_phashes(self) -> Iterator[pdsim.PerceptualHash]:
+        for row in range(self._row_count(SECTION_BY_PHASH)):
+            yield BY_NUMBER.unpack_from(self.buffer, self._row_offset(SECTION_BY_PHASH, BY_NUMBER.size, row))[0]
+
+
+def empty_snapshot() -> IndexSnapshot:
+    return IndexSnapshot(memoryview(snapshot_bytes_of([], (NO_OLDEST_IMAGE_DATE, NO_NEWEST_IMAGE_DATE))))
+
+
+def save_index(index_store: BaseIndexStore, path: pds.Path):
+    """Writes any index store as a snapshot (*.pdidx), as shards (*.pdshards), or as JSON"""
+    if is_snapshot_path(path):
+        index_store.platform.write_binary_file(
+            path, snapshot_bytes_of(index_store.all_image_properties(), index_store.image_date_range()))
+        return
+    if is_sharded_path(path):
+        if not isinstance(index_store, ShardedIndexStore):
+            sharded_store = ShardedIndexStore(index_store.platform, path)
+            sharded_store.stop_persisting()  # Nothing to journal: it all gets saved right away
+            sharded_store.import_index_store(index_store)
+            index_store = sharded_store
+        index_store.save(path)
+        return
+    if not isinstance(index_store, IndexStore):
+        json_store = IndexStore(index_store.platform)
+        for image_path, image_properties in index_store.all_image_properties():
+            json_store.data.add(image_path, image_properties)
+            json_store.file_series_splitter.add_path(image_path, image_properties)
+        index_store = json_store
+    index_store.save(path)
+
+
+class MappedIndexStore(BaseIndexStore):
+    """
+    An index store on top of a mapped snapshot.
+    What gets added or backfilled goes to an in-memory IndexStore, which takes precedence.
+    """
+
+    def __init__(self, platform: pds.Platform, snapshot: IndexSnapshot = None) -> None:
+        super().__init__(platform)
+        self.snapshot = snapshot or empty_snapshot()
+        self.overlay = IndexStore(platform)
+        self.phash_index: pdsim.HammingIndex = None  # Of the snapshot, built on first use
+        self.time_index: pdti.ImageTimeIndex = None  # Of the snapshot, built on first use
+        self.removed_paths: pds.PathSet = set()  # Of the snapshot, until it gets saved again
+
+    def _snapshot_paths(self, entries: List[int]) -> pds.PathSet:
+        paths = {self.snapshot.path_of(entry) for entry in entries}
+        return paths - self.overlay.data.by_path.keys() - self.removed_paths
+
+    def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        print(f"Indexed: {path}")
+        self.resolve_hash_collisions(path, image_properties)
+        self.overlay.data.add(path, image_properties)
+        self.removed_paths.discard(path)
+
+    def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
+        known = self.known_image_properties(path)
+        return dict() if known is None else known
+
+    def known_image_properties(self, path: pds.Path) -> pdc.PropertyDict:
+        if path in self.overlay.data.by_path:
+            return self.overlay.data.by_path[path]
+        if path in self.removed_paths:
+            return None
+        entry = self.snapshot.entry_of_path(path)
+        return None if entry is None else self.snapshot.properties_of(entry)
+
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        known = self.known_image_properties(path)
+        if known is None:
+            raise KeyError(path)
+        known.update(image_properties)
+        if not path in self.overlay.data.by_path:
+            self.overlay.data.add(path, known)
+
+    def all_image_properties(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        for path, image_properties in self.snapshot.iter_entries():
+            if not path in self.overlay.data.by_path and not path in self.removed_paths:
+                yield path, image_properties
+        yield from self.overlay.all_image_properties()
+
+    def paths_with_hash(self, file_hash: str) -> pds.PathSet:
+        return (self._snapshot_paths(self.snapshot.entries_with_hash(file_hash)) |
+                self.overlay.paths_with_hash(file_hash))
+
+    def paths_with_core_filename(self, core_filename: pds.Filename) -> pds.PathSet:
+        return (self._snapshot_paths(self.snapshot.entries_with_core_filename(core_filename)) |
+                self.overlay.paths_with_core_filename(core_filename))
+
+    def paths_with_size(self, size: str) -> pds.PathSet:
+        return self._snapshot_paths(self.snapshot.entries_with_size(int(size))) | self.overlay.paths_with_size(size)
+
+    def paths_with_partial_hash(self, partial_hash: str) -> pds.PathSet:
+        return (self._snapshot_paths(self.snapshot.entries_with_partial_hash(partial_hash)) |
+                self.overlay.paths_with_partial_hash(partial_hash))
+
+    def paths_with_image_properties(self, image_properties: pdc.PropertyDict) -> pds.PathSet:
+        key = image_properties_key(image_properties)
+        if not key:
+            return set()
+        return (self._snapshot_paths(self.snapshot.entries_with_image_properties_key(key)) |
+                self.overlay.paths_with_image_properties(image_properties))
+
+    def paths_with_similar_phash(self, phash: str, max_distance: int) -> Dict[pds.Path, int]:
+        if self.phash_index is None:
+            self.phash_index = pdsim.HammingIndex()
+            for value in self.snapshot.all_phashes():
+                self.phash_index.add(value)
+        output: Dict[pds.Path, int] = dict()
+        for other_phash, distance in self.phash_index.within(pdsim.phash_from_string(phash), max_distance).items():
+            for path in self._snapshot_paths(self.snapshot.entries_with_phash(other_phash)):
+                output[path] = distance
+        output.update(self.overlay.paths_with_similar_phash(phash, max_distance))
+        return output
+
+    def paths_with_image_time_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        if self.time_index is None:
+            self.time_index = pdti.ImageTimeIndex.of(
+                (pdt.timestamp_from_string(image_properties[pdc.KEY_IMAGE_DATE]), path)
+                for path, image_properties in self.snapshot.iter_entries() if image_properties.get(pdc.KEY_IMAGE_DATE))
+        entries = [(timestamp, path) for timestamp, path in self.time_index.entries_between(oldest, newest)
+                   if not path in self.overlay.data.by_path and not path in self.removed_paths]
+        entries.extend(self.overlay.data.by_image_time.entries_between(oldest, newest))
+        return [path for _, path in sorted(entries)]
+
+    def image_date_range(self) -> Tuple[str, str]:
+        overlay_oldest, overlay_newest = self.overlay.image_date_range()
+        return (min(self.snapshot.oldest_image_date, overlay_oldest),
+                max(self.snapshot.newest_image_date, overlay_newest))
+
+    def __len__(self) -> int:
+        new_path_count = sum(1 for path in self.overlay.data.by_path if self.snapshot.entry_of_path(path) is None)
+        return self.snapshot.entry_count + new_path_count - len(self.removed_paths)
+
+    def remove_paths(self, paths: pds.PathSet):
+        """The snapshot is read-only: its paths only go once it gets saved again"""
+        self.overlay.remove_paths(paths)
+        self.removed_paths.update(path for path in paths if self.snapshot.entry_of_path(path) is not None)
+
+    def directory_summary(self, dir_path: pds.Path) -> pdds.DirectorySummary:
+        return self.overlay.directory_summary(dir_path)
+
+    def set_directory_summaries(self, summaries: pdds.DirectorySummaries):
+        """NOTE: Snapshots do not keep these: every run quick-checks every file again."""
+        self.overlay.set_directory_summaries(summaries)
+
+    def _set_indexed_file_hash(self, path: pds.Path, file_hash: str):
+        self.update_known_image_properties(path, {pdc.KEY_FILE_HASH: file_hash})
+        self.overlay.data.set_file_hash(path, file_hash)
+
+    def _set_indexed_partial_hash(self, path: pds.Path, partial_hash: str):
+        self.update_known_image_properties(path, {pdc.KEY_FILE_PARTIAL_HASH: partial_hash})
+        self.overlay.data.set_partial_hash(path, partial_hash)
+
+    def save(self, path: pds.Path):
+        save_index(self, path)
+
+    def load(path: pds.Path, platform: pds.Platform):
+        if not platform.path_exists(path):
+            print("WARNING: No snapshot file found. Starting new one.")
+            return MappedIndexStore(platform)
+        return MappedIndexStore(platform, IndexSnapshot(platform.map_binary_file(path)))
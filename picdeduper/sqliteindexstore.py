@@ -0,0 +1,303 @@
+import json
+import sqlite3
+import threading
+
+from typing import Dict, Iterator, List, Tuple
+
+from picdeduper import common as pdc
+from picdeduper import dirsummaries as pdds
+from picdeduper import platform as pds
+from picdeduper import similarity as pdsim
+from picdeduper import time as pdt
+from picdeduper.indexstore import BaseIndexStore, IndexStore, NO_NEWEST_IMAGE_DATE, NO_OLDEST_IMAGE_DATE
+from picdeduper.indexstore import image_properties_key
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  An IndexStore in a SQLite database, instead of in memory & in JSON:
+#
+#     images: path -> (indexed lookup columns..., the PropertyDict as JSON)
+#     directories: path -> DirectorySummary
+#
+#  Opening it does not read anything, and lookups go through real indexes,
+#  so startup is O(1) and memory follows the working set, not the collection.
+#  Adds get committed in batches (see commit()), in WAL mode.
+#
+#  Perceptual hashes are the exception: similarity lookups need a
+#  HammingIndex, which gets built from the phash column on first use.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+SQLITE_EXTS = [".SQLITE", ".SQLITE3", ".DB"]
+
+SCHEMA_VERSION = 3  # 2: image_key, 3: image_time
+
+ROWS_PER_FETCH = 1000
+
+TABLES = [
+    """CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS images (
+        path TEXT PRIMARY KEY,
+        file_hash TEXT,
+        file_size INTEGER,
+        partial_hash TEXT,
+        core_filename TEXT NOT NULL,
+        image_date TEXT,
+        phash TEXT,
+        image_key TEXT,
+        image_time REAL,
+        properties TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS directories (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        child_count INTEGER NOT NULL,
+        digest TEXT NOT NULL
+    )""",
+]
+
+# After TABLES got upgraded (see _upgrade_schema()), as they can be on added columns
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS images_by_hash ON images (file_hash)",
+    "CREATE INDEX IF NOT EXISTS images_by_size ON images (file_size)",
+    "CREATE INDEX IF NOT EXISTS images_by_partial_hash ON images (partial_hash)",
+    "CREATE INDEX IF NOT EXISTS images_by_core_filename ON images (core_filename)",
+    "CREATE INDEX IF NOT EXISTS images_by_image_date ON images (image_date)",
+    "CREATE INDEX IF NOT EXISTS images_by_phash ON images (phash)",
+    "CREATE INDEX IF NOT EXISTS images_by_image_key ON images (image_key)",
+    "CREATE INDEX IF NOT EXISTS images_by_image_time ON images (image_time)",
+]
+
+INSERT_SQL = """INSERT OR REPLACE INTO images
+    (path, file_hash, file_size, partial_hash, core_filename, image_date, phash, image_key, image_time, properties)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+def is_sqlite_path(path: pds.Path) -> bool:
+    return pds.filename_ext(pds.path_filename(path)).upper() in SQLITE_EXTS
+
+
+def _row_of(path: pds.Path, image_properties: pdc.PropertyDict) -> Tuple:
+    size = image_properties.get(pdc.KEY_FILE_SIZE)
+    return (
+        path,
+        image_properties.get(pdc.KEY_FILE_HASH) or None,
+        int(size) if size else None,
+        image_properties.get(pdc.KEY_FILE_PARTIAL_HASH) or None,
+        pds.path_core_filename(path),
+        image_properties.get(pdc.KEY_IMAGE_DATE) or None,
+        image_properties.get(pdc.KEY_IMAGE_PHASH) or None,
+        image_properties_key(image_properties),
+        pdt.timestamp_from_string(image_properties.get(pdc.KEY_IMAGE_DATE)),
+        json.dumps(dict(image_properties), sort_keys=True),
+    )
+
+
+class SqliteIndexStore(BaseIndexStore):
+
+    def __init__(self, platform: pds.Platform, db_path: pds.Path = ":memory:") -> None:
+        super().__init__(platform)
+        self.db_path = db_path
+        self.lock = threading.RLock()  # Worker threads look up processed files
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in TABLES:
+            self.connection.execute(statement)
+        self._upgrade_schema()
+        for statement in INDEXES:
+            self.connection.execute(statement)
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                                (str(SCHEMA_VERSION),))
+        self.connection.commit()
+        self.phash_index: pdsim.HammingIndex = None  # Built on first use
+        self.is_persisting = True
+
+    def _upgrade_schema(self):
+        """Adds & fills in the columns that databases of older versions lack"""
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(images)")}
+        if not "image_key" in columns:
+            self.connection.execute("ALTER TABLE images ADD COLUMN image_key TEXT")
+            rows = self.connection.execute("SELECT path, properties FROM images").fetchall()
+            self.connection.executemany(
+                "UPDATE images SET image_key = ? WHERE path = ?",
+                [(image_properties_key(json.loads(properties)), path) for path, properties in rows])
+        if not "image_time" in columns:
+            self.connection.execute("ALTER TABLE images ADD COLUMN image_time REAL")
+            rows = self.connection.execute(
+                "SELECT path, image_date FROM images WHERE image_date IS NOT NULL").fetchall()
+            self.connection.executemany(
+                "UPDATE images SET image_time = ? WHERE path = ?",
+                [(pdt.timestamp_from_string(image_date), path) for path, image_date in rows])
+
+    def _fetch_paths(self, sql: str, parameters: Tuple) -> pds.PathSet:
+        with self.lock:
+            return {row[0] for row in self.connection.execute(sql, parameters)}
+
+    def _properties_of_paths(self, paths: List[pds.Path]) -> Dict[pds.Path, pdc.PropertyDict]:
+        output: Dict[pds.Path, pdc.PropertyDict] = dict()
+        with self.lock:
+            for path in paths:
+                row = self.connection.execute("SELECT properties FROM images WHERE path = ?", (path,)).fetchone()
+                if row:
+                    output[path] = json.loads(row[0])
+        return output
+
+    def _insert(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        with self.lock:
+            self.connection.execute(INSERT_SQL, _row_of(path, image_properties))
+            phash = image_properties.get(pdc.KEY_IMAGE_PHASH)
+            if phash and self.phash_index is not None:
+                self.phash_index.add(pdsim.phash_from_string(phash))
+
+    def add(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        print(f"Indexed: {path}")
+        self.resolve_hash_collisions(path, image_properties)
+        self._insert(path, image_properties)
+
+    def image_properties_for_path(self, path: pds.Path) -> pdc.PropertyDict:
+        known = self.known_image_properties(path)
+        return dict() if known is None else known
+
+    def known_image_properties(self, path: pds.Path) -> pdc.PropertyDict:
+        return self._properties_of_paths([path]).get(path)
+
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        with self.lock:
+            known = self.known_image_properties(path)
+            if known is None:
+                raise KeyError(path)
+            known.update(image_properties)
+            self._insert(path, known)
+
+    def image_properties_dict_for_paths(self, paths: pds.PathSet) -> Dict[pds.Path, pdc.PropertyDict]:
+        output = self._properties_of_paths(sorted(paths))
+        for path in paths:
+            if not path in output:
+                output[path] = dict()
+        return output
+
+    def all_image_properties(self) -> Iterator[Tuple[pds.Path, pdc.PropertyDict]]:
+        """Fetches the rows a batch at a time, so the whole collection is never in memory"""
+        with self.lock:
+            cursor = self.connection.execute("SELECT path, properties FROM images ORDER BY path")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(ROWS_PER_FETCH)
+            if not rows:
+                return
+            for path, properties in rows:
+                yield path, json.loads(properties)
+
+    def paths_with_hash(self, file_hash: str) -> pds.PathSet:
+        return self._fetch_paths("SELECT path FROM images WHERE file_hash = ?", (file_hash,))
+
+    def paths_with_core_filename(self, core_filename: pds.Filename) -> pds.PathSet:
+        return self._fetch_paths("SELECT path FROM images WHERE core_filename = ?", (core_filename,))
+
+    def paths_with_size(self, size: str) -> pds.PathSet:
+        return self._fetch_paths("SELECT path FROM images WHERE file_size = ?", (int(size),))
+
+    def paths_with_partial_hash(self, partial_hash: str) -> pds.PathSet:
+        return self._fetch_paths("SELECT path FROM images WHERE partial_hash = ?", (partial_hash,))
+
+    def paths_with_image_properties(self, image_properties: pdc.PropertyDict) -> pds.PathSet:
+        key = image_properties_key(image_properties)
+        if not key:
+            return set()
+        return self._fetch_paths("SELECT path FROM images WHERE image_key = ?", (key,))
+
+    def paths_with_similar_phash(self, phash: str, max_distance: int) -> Dict[pds.Path, int]:
+        with self.lock:
+            if self.phash_index is None:
+                self.phash_index = pdsim.HammingIndex()
+                for row in self.connection.execute("SELECT DISTINCT phash FROM images WHERE phash IS NOT NULL"):
+                    self.phash_index.add(pdsim.phash_from_string(row[0]))
+            similar = self.phash_index.within(pdsim.phash_from_string(phash), max_distance)
+        output: Dict[pds.Path, int] = dict()
+        for other_phash, distance in similar.items():
+            phash_string = pdsim.phash_string(other_phash)
+            for path in self._fetch_paths("SELECT path FROM images WHERE phash = ?", (phash_string,)):
+                output[path] = distance
+        return output
+
+    def image_date_range(self) -> Tuple[str, str]:
+        with self.lock:
+            oldest, newest = self.connection.execute("SELECT MIN(image_date), MAX(image_date) FROM images").fetchone()
+        return oldest or NO_OLDEST_IMAGE_DATE, newest or NO_NEWEST_IMAGE_DATE
+
+    def paths_with_image_time_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT path FROM images WHERE image_time >= ? AND image_time <= ? ORDER BY image_time, path",
+                (float("-inf") if oldest is None else oldest, float("inf") if newest is None else newest))
+            return [row[0] for row in rows]
+
+    def remove_paths(self, paths: pds.PathSet):
+        with self.lock:
+            self.connection.executemany("DELETE FROM images WHERE path = ?", ((path,) for path in paths))
+            self.phash_index = None  # Rebuilt on next use, without the phashes that went
+
+    def directory_summary(self, dir_path: pds.Path) -> pdds.DirectorySummary:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT mtime_ns, child_count, digest FROM directories WHERE path = ?", (dir_path,)).fetchone()
+        return None if row is None else pdds.DirectorySummary(*row)
+
+    def set_directory_summaries(self, summaries: pdds.DirectorySummaries):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO directories (path, mtime_ns, child_count, digest) VALUES (?, ?, ?, ?)",
+                ((path, summary.mtime_ns, summary.child_count, summary.digest) for path, summary in summaries.items()))
+
+    def _set_indexed_file_hash(self, path: pds.Path, file_hash: str):
+        self.update_known_image_properties(path, {pdc.KEY_FILE_HASH: file_hash})
+
+    def _set_indexed_partial_hash(self, path: pds.Path, partial_hash: str):
+        self.update_known_image_properties(path, {pdc.KEY_FILE_PARTIAL_HASH: partial_hash})
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def commit(self):
+        if not self.is_persisting:
+            return
+        with self.lock:
+            self.connection.commit()
+
+    def stop_persisting(self):
+        self.commit()
+        self.is_persisting = False
+
+    def save(self, path: pds.Path):
+        """The database gets written in place. This only commits what was added since the last batch."""
+        if path != self.db_path:
+            print(f"WARNING: The SQLite index is saved in {self.db_path}, not in {path}.")
+        self.commit()
+
+    def close(self):
+        self.commit()
+        with self.lock:
+            self.connection.close()
+
+    def import_index_store(self, index_store: IndexStore) -> int:
+        """One-shot import of an in-memory IndexStore, in a single transaction. Returns the number of entries."""
+        with self.lock:
+            self.connection.executemany(INSERT_SQL, (
+                _row_of(path, image_properties) for path, image_properties in index_store.all_image_properties()))
+            self.connection.commit()
+            self.phash_index = None
+        return len(index_store.data.by_path)
+
+    def import_json(self, json_path: pds.Path) -> int:
+        """One-shot import of a picdedupe.json. Returns the number of entries."""
+        return self.import_index_store(IndexStore.load(json_path, self.platform))
+
+    def load(path: pds.Path, platform: pds.Platform):
+        if not platform.path_exists(path):
+            print("WARNING: No SQLite file found. Starting new one.")
+        return SqliteIndexStore(platform, path)
@@ -1,16 +1,76 @@
-from datetime import datetime
+import functools
+import re
+
+from datetime import date, datetime
 
 Timestamp = float
 TimeString = str
 
+RE_DAY_STRING = re.compile(r"(\d{4})-(\d\d)-(\d\d)$")
+RE_TIME_OF_DAY_STRING = re.compile(r"(\d\d):(\d\d):(\d\d)$")
+RE_OFFSET_STRING = re.compile(r"([+-])(\d\d)(\d\d)$")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _day_seconds(day_string: str) -> int:
+    match = RE_DAY_STRING.match(day_string)
+    if not match:
+        return None
+    try:
+        return (date(*map(int, match.groups())).toordinal() - EPOCH_ORDINAL) * 86400
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=1 << 17)
+def _time_of_day_seconds(time_of_day_string: str) -> int:
+    match = RE_TIME_OF_DAY_STRING.match(time_of_day_string)
+    if not match:
+        return None
+    hour, minute, second = map(int, match.groups())
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return hour * 3600 + minute * 60 + second
+
+
+@functools.lru_cache(maxsize=1 << 10)
+def _offset_seconds(offset_string: str) -> int:
+    match = RE_OFFSET_STRING.match(offset_string)
+    if not match:
+        return None
+    sign, hours, minutes = match.groups()
+    if int(hours) > 23 or int(minutes) > 59:
+        return None
+    offset = int(hours) * 3600 + int(minutes) * 60
+    return offset if sign == "+" else -offset
+
 
 def datetime_from_string(time_string: TimeString) -> datetime:
     if not time_string: return None
     return datetime.strptime(time_string, "%Y-%m-%d %H:%M:%S %z")
 
 
+def _parsed_timestamp(time_string: TimeString) -> Timestamp:
+    """
+    Same as datetime_from_string().timestamp(), without strptime(), for the usual layout. None for anything else.
+    Collections share few days, times of day & UTC offsets: every one of them only gets parsed once.
+    """
+    if len(time_string) != 25 or time_string[10] != " " or time_string[19] != " ":
+        return None
+    day = _day_seconds(time_string[:10])
+    time_of_day = _time_of_day_seconds(time_string[11:19])
+    offset = _offset_seconds(time_string[20:])
+    if day is None or time_of_day is None or offset is None:
+        return None
+    return float(day + time_of_day - offset)
+
+
 def timestamp_from_string(time_string: TimeString) -> Timestamp:
     if not time_string: return None
+    timestamp = _parsed_timestamp(time_string)
+    if timestamp is not None:
+        return timestamp
     return datetime_from_string(time_string).timestamp()
 
 
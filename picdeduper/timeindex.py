@@ -0,0 +1,88 @@
+import bisect
+
+from array import array
+from typing import Iterable, List, Set, Tuple
+
+from picdeduper import platform as pds
+from picdeduper import time as pdt
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  The indexed files by the time their image was taken, to answer range
+#  queries ("what do we have of those days") with two binary searches:
+#
+#     timestamps    array of doubles, sorted
+#     paths         the path of every timestamp, in the same order
+#
+#  Two parallel arrays, rather than a list of (timestamp, path) tuples:
+#  8 bytes per timestamp and a reference to the (shared) path string,
+#  instead of a tuple and a float object per entry.
+#
+#  Adds & removes only get noted, and merged in with a single sort before
+#  the next query: inserting into the arrays would cost O(N) per add.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class ImageTimeIndex:
+
+    def __init__(self) -> None:
+        self.timestamps = array("d")
+        self.paths: pds.PathList = list()
+        self.pending_adds: Set[Tuple[pdt.Timestamp, pds.Path]] = set()
+        self.pending_removes: Set[Tuple[pdt.Timestamp, pds.Path]] = set()  # Still in the arrays
+
+    def of(entries: Iterable[Tuple[pdt.Timestamp, pds.Path]]):
+        """Sorts once, instead of inserting every entry"""
+        output = ImageTimeIndex()
+        output._set_entries(sorted(entries))
+        return output
+
+    def _set_entries(self, sorted_entries: List[Tuple[pdt.Timestamp, pds.Path]]) -> None:
+        self.timestamps = array("d", (timestamp for timestamp, _ in sorted_entries))
+        self.paths = [path for _, path in sorted_entries]
+
+    def _settle(self) -> None:
+        """Merges in what got added & removed since the last query"""
+        if not self.pending_adds and not self.pending_removes:
+            return
+        entries = [entry for entry in zip(self.timestamps, self.paths) if not entry in self.pending_removes]
+        entries.extend(self.pending_adds)
+        entries.sort()  # Mostly one sorted run already
+        self._set_entries(entries)
+        self.pending_adds = set()
+        self.pending_removes = set()
+
+    def __len__(self) -> int:
+        self._settle()
+        return len(self.timestamps)
+
+    def add(self, timestamp: pdt.Timestamp, path: pds.Path) -> None:
+        entry = (timestamp, path)
+        if entry in self.pending_removes:
+            self.pending_removes.discard(entry)
+        else:
+            self.pending_adds.add(entry)
+
+    def remove(self, timestamp: pdt.Timestamp, path: pds.Path) -> None:
+        entry = (timestamp, path)
+        if entry in self.pending_adds:
+            self.pending_adds.discard(entry)
+        else:
+            self.pending_removes.add(entry)
+
+    def _range_of(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> Tuple[int, int]:
+        self._settle()
+        start = 0 if oldest is None else bisect.bisect_left(self.timestamps, oldest)
+        end = len(self.timestamps) if newest is None else bisect.bisect_right(self.timestamps, newest)
+        return start, end
+
+    def paths_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> pds.PathList:
+        """The paths of the images taken from `oldest` to `newest` (both included, either can be None), oldest first"""
+        start, end = self._range_of(oldest, newest)
+        return self.paths[start:end]
+
+    def entries_between(self, oldest: pdt.Timestamp, newest: pdt.Timestamp) -> List[Tuple[pdt.Timestamp, pds.Path]]:
+        """Same as paths_between(), with their timestamps: to merge the results of several indexes"""
+        start, end = self._range_of(oldest, newest)
+        return list(zip(self.timestamps[start:end], self.paths[start:end]))
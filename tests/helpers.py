@@ -0,0 +1,26 @@
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+from picdeduper.indexstore import BaseIndexStore
+
+
+def image_properties(path: pds.Path, size: int, file_hash: str = None) -> pdc.PropertyDict:
+    """What the fingerprinter gets of a file without any image metadata"""
+    return {
+        pdc.KEY_FILE_CORE_NAME: pds.path_core_filename(path),
+        pdc.KEY_FILE_HASH: file_hash,
+        pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+        pdc.KEY_FILE_SIZE: str(size),
+        pdc.KEY_IMAGE_RES: None,
+        pdc.KEY_IMAGE_LOC: None,
+        pdc.KEY_IMAGE_CREATOR: None,
+        pdc.KEY_IMAGE_DATE: None,
+        pdc.KEY_IMAGE_ANGLES: None,
+        pdc.KEY_IMAGE_CAMSET: None,
+    }
+
+
+def add_file(platform: pds.FakePlatform, index_store: BaseIndexStore, path: pds.Path, content: bytes,
+             **extra_properties):
+    """Configures the file at `path` with `content`, and indexes it: with its size, and `extra_properties` over that"""
+    platform.configure_binary_file(path, content)
+    index_store.add(path, {**image_properties(path, len(content)), **extra_properties})
@@ -0,0 +1,28 @@
+import json
+import unittest
+
+from picdeduper import jsonable
+from picdeduper.bloom import BloomFilter
+
+
+class BloomFilterTests(unittest.TestCase):
+
+    def test_has_what_got_added(self):
+        bloom = BloomFilter.of([f"IMG_{i:04d}" for i in range(1000)], 1000)
+        for i in range(1000):
+            self.assertIn(f"IMG_{i:04d}", bloom)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter.of([f"IMG_{i:04d}" for i in range(1000)], 1000, false_positive_rate=0.01)
+        false_positives = sum(1 for i in range(10000) if f"DSC_{i:04d}" in bloom)
+        self.assertLess(false_positives, 300)
+
+    def test_empty(self):
+        bloom = BloomFilter.for_capacity(0)
+        self.assertNotIn("IMG_0001", bloom)
+
+    def test_json_round_trip(self):
+        bloom = BloomFilter.of(["IMG_0001", "IMG_0002"], 2)
+        decoded = BloomFilter.jsonable_decode(json.loads(json.dumps(jsonable.encode(bloom))))
+        self.assertEqual(decoded, bloom)
+        self.assertIn("IMG_0002", decoded)
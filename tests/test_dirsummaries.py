@@ -0,0 +1,106 @@
+import unittest
+
+from picdeduper import dirsummaries as pdds
+from picdeduper import platform as pds
+from picdeduper import shardedindexstore as pdshard
+from picdeduper.indexstore import IndexStore
+from picdeduper.sqliteindexstore import SqliteIndexStore
+
+from tests.test_shardedindexstore import MANIFEST_PATH
+
+
+class DirectorySummaryTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.platform.configure_file_stat("/c", pds.FileStat(0, 100))
+        self.platform.configure_file_stat("/c/2019", pds.FileStat(0, 200))
+        self.platform.configure_dir_entries("/c", ["2019"], {
+            "IMG_0001.JPG": pds.FileStat(1, 1000),
+            "notes.txt": pds.FileStat(5, 1000),
+        })
+        self.platform.configure_dir_entries("/c/2019", [], {
+            "IMG_0002.JPG": pds.FileStat(2, 2000),
+            "IMG_0003.HEIC": pds.FileStat(3, 3000),
+        })
+
+    def _changed_image_paths(self, known_summaries: pdds.DirectorySummaries):
+        summaries = dict()
+        paths = list(pdds.iter_changed_image_paths(self.platform, "/c", known_summaries.get, summaries))
+        return paths, summaries
+
+    def test_summary_of(self):
+        def summary_of(dir_mtime_ns: int, file_mtime_ns: int) -> pdds.DirectorySummary:
+            children = {"IMG_0001.JPG": pds.FileStat(1, file_mtime_ns)}
+            return pdds.DirectorySummary.of(pds.FileStat(0, dir_mtime_ns), children)
+
+        summary = summary_of(100, 1000)
+
+        self.assertEqual(summary, summary_of(100, 1000))
+        self.assertEqual(summary.child_count, 1)
+        self.assertNotEqual(summary, summary_of(101, 1000))
+        self.assertNotEqual(summary, summary_of(100, 1001))
+        self.assertEqual(pdds.DirectorySummary.jsonable_decode(summary.jsonable_encode()), summary)
+
+    def test_first_run_yields_every_image(self):
+        paths, summaries = self._changed_image_paths(dict())
+
+        self.assertEqual(paths, ["/c/IMG_0001.JPG", "/c/2019/IMG_0002.JPG", "/c/2019/IMG_0003.HEIC"])
+        self.assertEqual(set(summaries), {"/c", "/c/2019"})
+        self.assertEqual(summaries["/c"].child_count, 1)  # Not the .txt
+
+    def test_untouched_directories_are_skipped(self):
+        _, known_summaries = self._changed_image_paths(dict())
+
+        paths, summaries = self._changed_image_paths(known_summaries)
+
+        self.assertEqual(paths, [])
+        self.assertEqual(summaries, known_summaries)
+
+    def test_modified_image_only_yields_its_directory(self):
+        _, known_summaries = self._changed_image_paths(dict())
+        self.platform.configure_dir_entries("/c/2019", [], {
+            "IMG_0002.JPG": pds.FileStat(2, 2000),
+            "IMG_0003.HEIC": pds.FileStat(4, 4000),  # Modified in place: same directory mtime
+        })
+
+        paths, summaries = self._changed_image_paths(known_summaries)
+
+        self.assertEqual(paths, ["/c/2019/IMG_0002.JPG", "/c/2019/IMG_0003.HEIC"])
+        self.assertEqual(summaries["/c"], known_summaries["/c"])
+        self.assertNotEqual(summaries["/c/2019"], known_summaries["/c/2019"])
+
+    def test_json_index_keeps_summaries(self):
+        _, summaries = self._changed_image_paths(dict())
+        index_store = IndexStore(self.platform)
+        index_store.set_directory_summaries(summaries)
+        index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        self.assertEqual(loaded.directory_summary("/c/2019"), summaries["/c/2019"])
+        self.assertIsNone(loaded.directory_summary("/d"))
+
+    def test_sqlite_index_keeps_summaries(self):
+        _, summaries = self._changed_image_paths(dict())
+        index_store = SqliteIndexStore(self.platform)
+        index_store.set_directory_summaries(summaries)
+        index_store.commit()
+
+        self.assertEqual(index_store.directory_summary("/c/2019"), summaries["/c/2019"])
+        self.assertIsNone(index_store.directory_summary("/d"))
+
+    def test_sharded_index_keeps_summaries(self):
+        _, summaries = self._changed_image_paths(dict())
+        self.platform.configure_path_exists(MANIFEST_PATH, False)
+        index_store = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        index_store.set_directory_summaries(summaries)
+        index_store.save(MANIFEST_PATH)
+
+        loaded = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+
+        self.assertEqual(loaded.directory_summary("/c/2019"), summaries["/c/2019"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,3 +19,51 @@ class EvaluationTests(unittest.TestCase):
             pdc.KEY_IMAGE_DATE: "2022-11-16 22:55:32 -0300",
             pdc.KEY_FILE_DATE: "2022-11-16 22:55:32 +0300",
         }))
+
+    def test_is_quick_signature_equal(self):
+        signature = {
+            pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+            pdc.KEY_FILE_SIZE: "4772278",
+            pdc.KEY_FILE_MTIME_NS: "1577243526123456789",
+            pdc.KEY_FILE_INODE: "1234",
+            pdc.KEY_FILE_DEVICE: "16777220",
+        }
+        self.assertTrue(pde.is_quick_signature_equal(signature, dict(signature)))
+        self.assertTrue(pde.is_quick_signature_equal(signature, {**signature, pdc.KEY_FILE_DEVICE: "42"}))
+        self.assertFalse(pde.is_quick_signature_equal(signature, {**signature, pdc.KEY_FILE_SIZE: "1"}))
+        self.assertFalse(pde.is_quick_signature_equal(signature, {**signature, pdc.KEY_FILE_INODE: "1"}))
+        self.assertFalse(pde.is_quick_signature_equal(signature, {
+            **signature,
+            pdc.KEY_FILE_MTIME_NS: "1577243526000000000",
+        }))
+
+    def test_is_quick_signature_equal_to_legacy_signature(self):
+        signature = {
+            pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+            pdc.KEY_FILE_SIZE: "4772278",
+            pdc.KEY_FILE_MTIME_NS: "1577243526123456789",
+            pdc.KEY_FILE_INODE: "1234",
+            pdc.KEY_FILE_DEVICE: "16777220",
+        }
+        self.assertTrue(pde.is_legacy_quick_signature({
+            pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+            pdc.KEY_FILE_SIZE: "4772278",
+        }))
+        self.assertTrue(pde.is_quick_signature_equal(signature, {
+            pdc.KEY_FILE_DATE: "2019-12-25 04:12:06 +0100",
+            pdc.KEY_FILE_SIZE: "4772278",
+        }))
+        self.assertFalse(pde.is_quick_signature_equal(signature, {
+            pdc.KEY_FILE_DATE: "2019-12-25 03:12:07 +0000",
+            pdc.KEY_FILE_SIZE: "4772278",
+        }))
+
+    def test_compare_image_quality(self):
+        heic = {pdc.KEY_IMAGE_RES: "3024x4032@24", pdc.KEY_FILE_SIZE: "1500000"}
+        jpeg = {pdc.KEY_IMAGE_RES: "3024x4032@24", pdc.KEY_FILE_SIZE: "2500000"}
+        small_jpeg = {pdc.KEY_IMAGE_RES: "768x1024@24", pdc.KEY_FILE_SIZE: "300000"}
+        self.assertEqual(pde.compare_image_quality(heic, small_jpeg), 1)
+        self.assertEqual(pde.compare_image_quality(small_jpeg, jpeg), -1)
+        self.assertEqual(pde.compare_image_quality(jpeg, heic), 1)
+        self.assertEqual(pde.compare_image_quality(jpeg, dict(jpeg)), 0)
+        self.assertEqual(pde.compare_image_quality({pdc.KEY_IMAGE_RES: None}, small_jpeg), -1)
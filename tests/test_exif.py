@@ -0,0 +1,175 @@
+import io
+import struct
+import unittest
+
+from picdeduper import exif as pdexif
+from picdeduper import fingerprinting as pdf
+from picdeduper import platform as pds
+
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+
+
+def _ifd_block(start: int, entries, next_ifd: int = 0) -> bytes:
+    """Little-endian IFD at `start`, with its out-of-line values right after it."""
+    data_start = start + 2 + 12 * len(entries) + 4
+    head = struct.pack("<H", len(entries))
+    data = b""
+    for tag, field_type, values in entries:
+        if field_type == ASCII:
+            raw = values.encode() + b"\x00"
+            count = len(raw)
+        elif field_type == RATIONAL:
+            raw = b"".join(struct.pack("<LL", int(x * 10000), 10000) for x in values)
+            count = len(values)
+        else:
+            fmt = "<H" if field_type == SHORT else "<L"
+            raw = b"".join(struct.pack(fmt, x) for x in values)
+            count = len(values)
+        if len(raw) <= 4:
+            head += struct.pack("<HHL", tag, field_type, count) + raw.ljust(4, b"\x00")
+        else:
+            head += struct.pack("<HHLL", tag, field_type, count, data_start + len(data))
+            data += raw
+    return head + struct.pack("<L", next_ifd) + data
+
+
+def make_tiff(ifd0, exif_ifd=None, gps_ifd=None) -> bytes:
+    ifd0 = list(ifd0)
+    pointers = [(pdexif.TAG_EXIF_IFD, LONG, [0])] if exif_ifd else []
+    pointers += [(pdexif.TAG_GPS_IFD, LONG, [0])] if gps_ifd else []
+    ifd0_size = len(_ifd_block(8, ifd0 + pointers))
+    exif_start = 8 + ifd0_size
+    exif_block = _ifd_block(exif_start, exif_ifd) if exif_ifd else b""
+    gps_start = exif_start + len(exif_block)
+    gps_block = _ifd_block(gps_start, gps_ifd) if gps_ifd else b""
+    pointers = [(pdexif.TAG_EXIF_IFD, LONG, [exif_start])] if exif_ifd else []
+    pointers += [(pdexif.TAG_GPS_IFD, LONG, [gps_start])] if gps_ifd else []
+    return b"II*\x00" + struct.pack("<L", 8) + _ifd_block(8, ifd0 + pointers) + exif_block + gps_block
+
+
+def make_jpeg(tiff: bytes, height=3024, width=4032) -> bytes:
+    app1 = pdexif.EXIF_HEADER + tiff
+    app0 = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    sof0 = struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+    return (b"\xFF\xD8" +
+            b"\xFF\xE0" + struct.pack(">H", len(app0) + 2) + app0 +
+            b"\xFF\xE1" + struct.pack(">H", len(app1) + 2) + app1 +
+            b"\xFF\xC0" + struct.pack(">H", len(sof0) + 2) + sof0 +
+            b"\xFF\xDA" + b"\x00" * 1000 + b"\xFF\xD9")
+
+
+IPHONE_TIFF = make_tiff(
+    ifd0=[
+        (pdexif.TAG_MODEL, ASCII, "iPhone 11 Pro"),
+        (pdexif.TAG_SOFTWARE, ASCII, "13.4"),
+        (pdexif.TAG_DATE_TIME, ASCII, "2019:12:24 19:12:06"),
+    ],
+    exif_ifd=[
+        (pdexif.TAG_EXPOSURE_TIME, RATIONAL, [0.0166]),
+        (pdexif.TAG_F_NUMBER, RATIONAL, [1.8]),
+        (pdexif.TAG_DATE_TIME_ORIGINAL, ASCII, "2019:12:24 19:12:06"),
+        (pdexif.TAG_OFFSET_TIME, ASCII, "-08:00"),
+        (pdexif.TAG_OFFSET_TIME_ORIGINAL, ASCII, "-08:00"),
+        (pdexif.TAG_FOCAL_LENGTH, RATIONAL, [4.25]),
+    ],
+    gps_ifd=[
+        (pdexif.TAG_GPS_LATITUDE_REF, ASCII, "N"),
+        (pdexif.TAG_GPS_LATITUDE, RATIONAL, [37, 20, 7.728]),
+        (pdexif.TAG_GPS_LONGITUDE_REF, ASCII, "W"),
+        (pdexif.TAG_GPS_LONGITUDE, RATIONAL, [121, 53, 34.9008]),
+        (pdexif.TAG_GPS_ALTITUDE, RATIONAL, [12.3]),
+        (pdexif.TAG_GPS_IMG_DIRECTION, RATIONAL, [5.43]),
+        (pdexif.TAG_GPS_DEST_BEARING, RATIONAL, [4.32]),
+    ])
+
+
+class ExifTests(unittest.TestCase):
+
+    def test_parse_tiff(self):
+        tiff = pdexif.parse_tiff(IPHONE_TIFF)
+        self.assertEqual(tiff.ifd0[pdexif.TAG_MODEL], "iPhone 11 Pro")
+        self.assertEqual(tiff.exif[pdexif.TAG_DATE_TIME_ORIGINAL], "2019:12:24 19:12:06")
+        self.assertAlmostEqual(tiff.exif[pdexif.TAG_F_NUMBER], 1.8)
+        self.assertEqual(tiff.gps[pdexif.TAG_GPS_LATITUDE_REF], "N")
+        self.assertEqual(len(tiff.gps[pdexif.TAG_GPS_LATITUDE]), 3)
+
+    def test_parse_tiff_rejects_garbage(self):
+        with self.assertRaises(pdexif.ExifError):
+            pdexif.parse_tiff(b"not a tiff at all")
+
+    def test_parse_tiff_rejects_bad_sub_ifd_offset(self):
+        tiff = b"II*\x00" + struct.pack("<L", 8) + _ifd_block(8, [(pdexif.TAG_EXIF_IFD, LONG, [26, 26])])
+        with self.assertRaises(pdexif.ExifError):
+            pdexif.parse_tiff(tiff)
+
+    def test_read_jpeg_header_rejects_bad_segment_length(self):
+        jpeg = b"\xFF\xD8" + b"\xFF\xE1" + struct.pack(">H", 1) + make_jpeg(IPHONE_TIFF)[2:]
+        with self.assertRaises(pdexif.ExifError):
+            pdexif.read_jpeg_header(io.BytesIO(jpeg))
+
+    def test_read_jpeg_header(self):
+        header = pdexif.read_jpeg_header(io.BytesIO(make_jpeg(IPHONE_TIFF)))
+        self.assertEqual(header.exif, IPHONE_TIFF)
+        self.assertEqual((header.height, header.width, header.bits_per_sample), (3024, 4032, 24))
+
+    def test_read_jpeg_header_stops_at_image_data(self):
+        f = io.BytesIO(make_jpeg(IPHONE_TIFF))
+        pdexif.read_jpeg_header(f)
+        self.assertLess(f.tell(), len(IPHONE_TIFF) + 100)
+
+    def test_mdls_properties_of_jpeg(self):
+        properties = pdexif.mdls_properties_of_jpeg(io.BytesIO(make_jpeg(IPHONE_TIFF)))
+        self.assertDictEqual(properties, {
+            "kMDItemContentModificationDate": "2019-12-25 03:12:06 +0000",
+            "kMDItemContentCreationDate": "2019-12-25 03:12:06 +0000",
+            "kMDItemAcquisitionModel": "iPhone 11 Pro",
+            "kMDItemCreator": "13.4",
+            "kMDItemPixelHeight": "3024",
+            "kMDItemPixelWidth": "4032",
+            "kMDItemBitsPerSample": "24",
+            "kMDItemLatitude": "37.33548",
+            "kMDItemLongitude": "-121.893028",
+            "kMDItemAltitude": "12.3",
+            "kMDItemImageDirection": "5.43",
+            "kMDItemGPSDestBearing": "4.32",
+            "kMDItemExposureTimeSeconds": "0.0166",
+            "kMDItemFNumber": "1.8",
+            "kMDItemFocalLength": "4.25",
+        })
+
+    def test_tags_of_the_wrong_type_get_ignored(self):
+        tiff = make_tiff(
+            ifd0=[
+                (pdexif.TAG_MODEL, SHORT, [11]),
+                (pdexif.TAG_SOFTWARE, RATIONAL, [13.4, 1.0]),
+            ],
+            exif_ifd=[
+                (pdexif.TAG_PIXEL_X_DIMENSION, ASCII, "4032"),
+            ])
+
+        properties = pdexif.mdls_properties_from_tiff(pdexif.parse_tiff(tiff))
+
+        self.assertDictEqual(properties, dict())
+
+    def test_fingerprinter_with_header_metadata_backend(self):
+        path = "/test/IMG_1234.JPG"
+        platform = pds.FakePlatform()
+        platform.configure_is_mac_os(False)
+        platform.configure_binary_file(path, make_jpeg(IPHONE_TIFF))
+        platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526000000000, 1234, 16777220))
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        result = dict()
+        fingerprinter.image_signature_dict_of(path, result)
+
+        self.assertIsInstance(fingerprinter.metadata_backend, pdf.HeaderMetadataBackend)
+        self.assertEqual(platform.called_cmd_lines, [])
+        self.assertEqual(result["image_res"], "3024x4032@24")
+        self.assertEqual(result["image_creator"], "iPhone 11 Pro/13.4")
+        self.assertEqual(result["image_date"], "2019-12-25 03:12:06 +0000")
+        self.assertEqual(result["image_loc"], "<37.33548,-121.893028>")
+        self.assertEqual(result["image_angles"], "5.43/4.32")
+        self.assertEqual(result["image_camset"], "0.0166/1.8/4.25")
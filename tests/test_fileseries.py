@@ -193,6 +193,29 @@ class FileSeriesTests(unittest.TestCase):
         self.assertEqual(len(file_series_of_creator1.file_groups), 4)
         self.assertEqual(len(file_series_of_creator2.file_groups), 1)
 
+    def test_restored_series_get_continued(self):
+
+        properties = {
+            pdc.KEY_IMAGE_CREATOR: "creator",
+            pdc.KEY_IMAGE_LOC: "<+37.4,-120.3>",
+            pdc.KEY_IMAGE_DATE: "2022-12-23 20:13:32 -0700"
+        }
+
+        splitter = fileseries.PictureFileSeriesSplitter()
+        splitter.add_path("/path/one/IMG_1001.JPG", properties)
+        splitter.add_path("/path/one/IMG_1002.JPG", properties)
+        encoded = jsonable.encode(splitter.all_file_series)
+
+        restored = fileseries.PictureFileSeriesSplitter()
+        restored.restore_file_series(jsonable.decode(encoded, fileseries.PictureFileSeries))
+        restored.add_path("/path/one/IMG_1002.HEIC", properties)
+        restored.add_path("/path/one/IMG_1003.JPG", properties)
+        self.assertEqual(len(restored.all_file_series), 1)
+        self.assertEqual(len(restored.all_file_series[0].file_groups), 3)
+
+        restored.add_path("/path/one/IMG_1005.JPG", properties)
+        self.assertEqual(len(restored.all_file_series), 2)
+
     def test_jsonable_to(self):
 
         splitter = fileseries.PictureFileSeriesSplitter()
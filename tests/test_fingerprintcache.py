@@ -0,0 +1,100 @@
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import fingerprintcache as pdfc
+from picdeduper import fingerprinting as pdf
+from picdeduper import platform as pds
+
+from tests.test_exif import IPHONE_TIFF, make_jpeg
+
+
+def _signature(inode: int, file_hash: str = "abc") -> pdc.PropertyDict:
+    return {
+        pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+        pdc.KEY_FILE_SIZE: "4772278",
+        pdc.KEY_FILE_MTIME_NS: "1577243526000000000",
+        pdc.KEY_FILE_INODE: str(inode),
+        pdc.KEY_FILE_DEVICE: "16777220",
+        pdc.KEY_FILE_CORE_NAME: "IMG_1234",
+        pdc.KEY_FILE_HASH: file_hash,
+        pdc.KEY_IMAGE_RES: "3024x4032@24",
+    }
+
+
+def _quick_signature(signature: pdc.PropertyDict) -> pdc.PropertyDict:
+    return {key: signature[key] for key in pdfc.IDENTITY_KEYS + [pdc.KEY_FILE_DATE]}
+
+
+class FingerprintCacheTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.cache = pdfc.FingerprintCache(self.platform, max_entries=2)
+
+    def test_identity_of(self):
+        self.assertEqual(pdfc.identity_of(_signature(1234)), "16777220:1234:4772278:1577243526000000000")
+        self.assertIsNone(pdfc.identity_of({pdc.KEY_FILE_SIZE: "1"}))
+
+    def test_renamed_file_hits(self):
+        self.cache.put(_signature(1234))
+        cached = self.cache.get("/elsewhere/IMG_9999 copy.JPG", _quick_signature(_signature(1234)))
+        self.assertEqual(cached[pdc.KEY_FILE_HASH], "abc")
+        self.assertEqual(cached[pdc.KEY_FILE_CORE_NAME], "IMG_9999")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+    def test_changed_file_misses(self):
+        self.cache.put(_signature(1234))
+        quick_signature = {**_quick_signature(_signature(1234)), pdc.KEY_FILE_MTIME_NS: "1"}
+        self.assertIsNone(self.cache.get("/c/IMG_1234.JPG", quick_signature))
+        self.assertIsNone(self.cache.get("/c/IMG_1234.JPG", _quick_signature(_signature(1234)),
+                                         lambda cached: pdc.KEY_IMAGE_PHASH in cached))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_least_recently_used_gets_evicted(self):
+        self.cache.put(_signature(1))
+        self.cache.put(_signature(2))
+        self.cache.get("/c/IMG_1234.JPG", _quick_signature(_signature(1)))
+        self.cache.put(_signature(3))
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get("/c/IMG_1234.JPG", _quick_signature(_signature(2))))
+        self.assertIsNotNone(self.cache.get("/c/IMG_1234.JPG", _quick_signature(_signature(1))))
+
+    def test_save_and_load(self):
+        self.cache.put(_signature(1))
+        self.cache.put(_signature(2))
+        self.cache.save("/c/cache.json")
+
+        loaded = pdfc.FingerprintCache.load("/c/cache.json", self.platform, max_entries=1)
+        self.assertEqual(list(loaded.entries.keys()), [pdfc.identity_of(_signature(2))])
+
+    def test_fingerprinter_skips_cached_files(self):
+        path = "/c/IMG_1234.JPG"
+        self.platform.configure_is_mac_os(False)
+        self.platform.configure_binary_file(path, make_jpeg(IPHONE_TIFF))
+        self.platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526000000000, 1234, 16777220))
+        fingerprinter = pdf.Fingerprinter(self.platform, cache=self.cache)
+        first = fingerprinter.image_signature_dicts_of([path])[path]
+
+        # A second run must not even open the file:
+        del self.platform.binary_files[path]
+        moved_path = "/d/IMG_1234.JPG"
+        self.platform.configure_file_stat(moved_path, self.platform.file_stat(path))
+        second = fingerprinter.image_signature_dicts_of([moved_path])[moved_path]
+
+        self.assertEqual(second, first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_fingerprinter_misses_without_required_hash(self):
+        path = "/c/IMG_1234.JPG"
+        self.platform.configure_is_mac_os(False)
+        self.platform.configure_binary_file(path, make_jpeg(IPHONE_TIFF))
+        self.platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526000000000, 1234, 16777220))
+        fingerprinter = pdf.Fingerprinter(self.platform, cache=self.cache)
+
+        fingerprinter.image_signature_dicts_of([path], with_hash=False)
+        result = fingerprinter.image_signature_dicts_of([path], with_hash=True)[path]
+
+        self.assertIsNotNone(result[pdc.KEY_FILE_HASH])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
@@ -1,54 +1,71 @@
+import asyncio
+import hashlib
 import unittest
 
 from picdeduper import platform as pds
 from picdeduper import fingerprinting as pdf
 
+MDLS_COMMAND = ("mdls -name kMDItemContentModificationDate -name kMDItemContentCreationDate"
+                " -name kMDItemAcquisitionModel -name kMDItemCreator"
+                " -name kMDItemLatitude -name kMDItemLongitude -name kMDItemAltitude"
+                " -name kMDItemPixelHeight -name kMDItemPixelWidth -name kMDItemBitsPerSample"
+                " -name kMDItemImageDirection -name kMDItemGPSDestBearing"
+                " -name kMDItemImageDirection -name kMDItemGPSDestBearing")
+
+class VanishingFilesPlatform(pds.FakePlatform):
+    """A FakePlatform with files that are gone by the time they get stat()'ed, or read"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.unstattable_paths = set()
+        self.unreadable_paths = set()
+
+    def file_stat(self, path: pds.Path) -> pds.FileStat:
+        if path in self.unstattable_paths:
+            raise FileNotFoundError(path)
+        return super().file_stat(path)
+
+    def open_binary_file(self, path: pds.Path):
+        if path in self.unreadable_paths:
+            raise FileNotFoundError(path)
+        return super().open_binary_file(path)
+
 
 class FingerprintTests(unittest.TestCase):
 
-    # TODO: Needs more variations of this test
     def test_quick_image_signature_dict_of(self):
         path = "/test/testfile.tst"
         platform = pds.FakePlatform()
-        platform.configure_raw_stdout_of(
-            "mdls -name kMDItemFSSize -name kMDItemFSContentChangeDate -name kMDItemFSCreationDate -name kMDItemDateAdded -name kMDItemContentModificationDate -name kMDItemContentCreationDate -name kMDItemAcquisitionModel -name kMDItemCreator -name kMDItemLatitude -name kMDItemLongitude -name kMDItemAltitude -name kMDItemPixelHeight -name kMDItemPixelWidth -name kMDItemBitsPerSample -name kMDItemImageDirection -name kMDItemGPSDestBearing -name kMDItemImageDirection -name kMDItemGPSDestBearing /test/testfile.tst",
-            b"""
-            kMDItemAcquisitionModel                = "iPhone 11 Pro"
-            kMDItemAltitude                        = 12.3
-            kMDItemBitsPerSample                   = 24
-            kMDItemContentCreationDate             = 2019-12-25 03:12:06 +0000
-            kMDItemContentModificationDate         = 2019-12-25 03:12:06 +0000
-            kMDItemCreator                         = "13.4"
-            kMDItemDateAdded                       = 2022-11-01 08:46:06 +0000
-            kMDItemExposureTimeSeconds             = 0.0166
-            kMDItemFNumber                         = 1.8
-            kMDItemFocalLength                     = 4.25
-            kMDItemFSContentChangeDate             = 2019-12-25 03:12:06 +0000
-            kMDItemFSCreationDate                  = 2019-12-25 03:12:06 +0000
-            kMDItemFSSize                          = 4772278
-            kMDItemGPSDestBearing                  = 4.32
-            kMDItemImageDirection                  = 5.43
-            kMDItemLatitude                        = 123.2323
-            kMDItemLongitude                       = 34.4343
-            kMDItemPixelHeight                     = 3024
-            kMDItemPixelWidth                      = 4032
-            """)
+        platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526123456789, 1234, 16777220))
 
         fingerprinter = pdf.Fingerprinter(platform)
         result = fingerprinter.quick_image_signature_dict_of(path)
 
+        self.assertEqual(platform.called_cmd_lines, [])
         self.assertDictEqual(result, {
             "file_date": "2019-12-25 03:12:06 +0000",
             "file_size": "4772278",
+            "file_mtime_ns": "1577243526123456789",
+            "file_inode": "1234",
+            "file_device": "16777220",
         })
 
+    def test_file_date_is_never_rounded_up(self):
+        path = "/test/testfile.tst"
+        platform = pds.FakePlatform()
+        platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526999999999))
+
+        result = pdf.Fingerprinter(platform).quick_image_signature_dict_of(path)
+
+        self.assertEqual(result["file_date"], "2019-12-25 03:12:06 +0000")
+
     # TODO: Needs more variations of this test
     def test_image_signature_dict_of(self):
         path = "/test/testfile.tst"
         platform = pds.FakePlatform()
 
         platform.configure_raw_stdout_of(
-            "mdls -name kMDItemFSSize -name kMDItemFSContentChangeDate -name kMDItemFSCreationDate -name kMDItemDateAdded -name kMDItemContentModificationDate -name kMDItemContentCreationDate -name kMDItemAcquisitionModel -name kMDItemCreator -name kMDItemLatitude -name kMDItemLongitude -name kMDItemAltitude -name kMDItemPixelHeight -name kMDItemPixelWidth -name kMDItemBitsPerSample -name kMDItemImageDirection -name kMDItemGPSDestBearing -name kMDItemImageDirection -name kMDItemGPSDestBearing /test/testfile.tst",
+            MDLS_COMMAND + " /test/testfile.tst",
             b"""
             kMDItemAcquisitionModel                = "iPhone 11 Pro"
             kMDItemAltitude                        = 12.3
@@ -70,9 +87,8 @@ class FingerprintTests(unittest.TestCase):
             kMDItemPixelHeight                     = 3024
             kMDItemPixelWidth                      = 4032
             """)
-        platform.configure_raw_stdout_of(
-            "openssl sha256 -r /test/testfile.tst",
-            b"01234DeadBead9876")
+        platform.configure_binary_file(path, b"01234DeadBead9876")
+        platform.configure_file_stat(path, pds.FileStat(4772278, 1577243526000000000, 1234, 16777220))
 
         fingerprinter = pdf.Fingerprinter(platform)
         result = dict()
@@ -81,7 +97,10 @@ class FingerprintTests(unittest.TestCase):
         self.assertDictEqual(result, {
             "file_date": "2019-12-25 03:12:06 +0000",
             "file_size": "4772278",
-            "file_hash": "01234DeadBead9876",
+            "file_mtime_ns": "1577243526000000000",
+            "file_inode": "1234",
+            "file_device": "16777220",
+            "file_hash": hashlib.sha256(b"01234DeadBead9876").hexdigest(),
             "file_core_name": "testfile",
             "image_angles": "5.43/4.32",
             "image_camset": "0.0166/1.8/4.25",
@@ -90,3 +109,98 @@ class FingerprintTests(unittest.TestCase):
             "image_loc": "<123.2323,34.4343>",
             "image_res": "3024x4032@24",
         })
+
+    def test_image_signature_dicts_of(self):
+        paths = ["/test/IMG_0001.JPG", "/test/IMG_0002.JPG"]
+        platform = pds.FakePlatform()
+        platform.configure_raw_stdout_of(
+            MDLS_COMMAND + " /test/IMG_0001.JPG /test/IMG_0002.JPG",
+            b"""
+            kMDItemAcquisitionModel                = "iPhone 11 Pro"
+            kMDItemContentCreationDate             = 2019-12-25 03:12:06 +0000
+            kMDItemLatitude                        = (null)
+            kMDItemAcquisitionModel                = "iPhone 12"
+            kMDItemContentCreationDate             = 2020-01-01 10:00:00 +0000
+            kMDItemLatitude                        = 12.5
+            """)
+        platform.configure_binary_file("/test/IMG_0001.JPG", b"aaaa")
+        platform.configure_binary_file("/test/IMG_0002.JPG", b"bbbb")
+        platform.configure_file_stat("/test/IMG_0001.JPG", pds.FileStat(4772278, 1577243526000000000))
+        platform.configure_file_stat("/test/IMG_0002.JPG", pds.FileStat(1234, 1577872800000000000))
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        result = fingerprinter.image_signature_dicts_of(paths)
+
+        self.assertEqual(len(platform.called_cmd_lines), 1)
+        self.assertEqual(result["/test/IMG_0001.JPG"]["file_size"], "4772278")
+        self.assertEqual(result["/test/IMG_0001.JPG"]["file_hash"], hashlib.sha256(b"aaaa").hexdigest())
+        self.assertEqual(result["/test/IMG_0001.JPG"]["image_creator"], "iPhone 11 Pro")
+        self.assertEqual(result["/test/IMG_0001.JPG"]["image_loc"], None)
+        self.assertEqual(result["/test/IMG_0002.JPG"]["file_size"], "1234")
+        self.assertEqual(result["/test/IMG_0002.JPG"]["file_hash"], hashlib.sha256(b"bbbb").hexdigest())
+        self.assertEqual(result["/test/IMG_0002.JPG"]["image_date"], "2020-01-01 10:00:00 +0000")
+        self.assertEqual(result["/test/IMG_0002.JPG"]["file_core_name"], "IMG_0002")
+
+    def test_image_signature_dicts_of_falls_back_on_mismatched_output(self):
+        paths = ["/test/IMG_0001.JPG", "/test/IMG_0002.JPG", "/test/IMG_0003.JPG"]
+        platform = pds.FakePlatform()
+        platform.configure_catchall_raw_cmd_output(b"kMDItemAcquisitionModel = 42\n")
+        for path in paths:
+            platform.configure_file_stat(path, pds.FileStat(1234, 1577872800000000000))
+            platform.configure_binary_file(path, b"")
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        result = fingerprinter.image_signature_dicts_of(paths)
+
+        # One batched call that yields a single record, then one call per file.
+        self.assertEqual(len(platform.called_cmd_lines), 4)
+        self.assertEqual(result["/test/IMG_0003.JPG"]["image_creator"], "42")
+
+    def test_image_signature_dicts_of_leaves_out_vanished_files(self):
+        paths = ["/test/IMG_0001.JPG", "/test/IMG_0002.JPG", "/test/IMG_0003.JPG"]
+        platform = VanishingFilesPlatform()
+        platform.configure_catchall_raw_cmd_output(b"")
+        for path in paths:
+            platform.configure_file_stat(path, pds.FileStat(1234, 1577872800000000000))
+            platform.configure_binary_file(path, path.encode())
+        platform.unstattable_paths.add("/test/IMG_0002.JPG")
+        platform.unreadable_paths.add("/test/IMG_0003.JPG")
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        result = fingerprinter.image_signature_dicts_of(paths)
+        async_result = asyncio.run(fingerprinter.async_image_signature_dicts_of(paths, pds.AsyncPlatform(platform)))
+
+        self.assertEqual(list(result), ["/test/IMG_0001.JPG"])
+        self.assertEqual(async_result, result)
+        self.assertEqual(fingerprinter.image_signature_dicts_of(paths, with_hash=False).keys(),
+                         {"/test/IMG_0001.JPG", "/test/IMG_0003.JPG"})
+
+    def test_async_image_signature_dicts_of(self):
+        paths = ["/test/IMG_0001.JPG", "/test/IMG_0002.JPG", "/test/IMG_0003.JPG"]
+        platform = pds.FakePlatform()
+        platform.configure_catchall_raw_cmd_output(b"kMDItemAcquisitionModel = 42\n")
+        platform.configure_async_delay(0.01)
+        for path in paths:
+            platform.configure_file_stat(path, pds.FileStat(1234, 1577872800000000000))
+            platform.configure_binary_file(path, path.encode())
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        async_platform = pds.AsyncPlatform(platform, max_in_flight=8)
+        result = asyncio.run(fingerprinter.async_image_signature_dicts_of(paths, async_platform))
+
+        # One batched call that yields a single record, then the per-file calls, at once.
+        self.assertEqual(len(platform.called_cmd_lines), 4)
+        self.assertEqual(platform.max_cmds_in_flight, 3)
+        self.assertEqual(result, fingerprinter.image_signature_dicts_of(paths))
+
+    def test_async_double_check_dupes(self):
+        platform = pds.FakePlatform()
+        platform.configure_catchall_raw_cmd_output(b"1234 *whatever\n")
+        platform.configure_binary_file("/test/a.JPG", b"same")
+        platform.configure_binary_file("/test/b.JPG", b"same")
+        fingerprinter = pdf.Fingerprinter(platform)
+        properties = {"/test/a.JPG": dict(), "/test/b.JPG": dict()}
+
+        async_platform = pds.AsyncPlatform(platform)
+        self.assertTrue(asyncio.run(fingerprinter.async_double_check_dupes(properties, async_platform)))
+        self.assertEqual(properties["/test/a.JPG"]["file_second_hash"], properties["/test/b.JPG"]["file_second_hash"])
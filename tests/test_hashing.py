@@ -0,0 +1,51 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from picdeduper import hashing as pdh
+
+
+class HashingTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(4):
+            path = os.path.join(self.temp_dir.name, f"file{i}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(1000 + 777 * i))
+            self.paths.append(path)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def _expected_digest(self, path, algorithm="sha256") -> str:
+        with open(path, "rb") as f:
+            return hashlib.new(algorithm, f.read()).hexdigest()
+
+    def test_hash_file_with_readinto(self):
+        hasher = pdh.FileHasher(lambda path: open(path, "rb"), buffer_size=100)
+        for path in self.paths:
+            self.assertEqual(hasher.hash_file(path, "sha256"), self._expected_digest(path))
+
+    def test_hash_file_with_mmap(self):
+        hasher = pdh.FileHasher(lambda path: open(path, "rb"), mmap_threshold=1)
+        for path in self.paths:
+            self.assertEqual(hasher.hash_file(path, "sha256"), self._expected_digest(path))
+
+    def test_hash_file_with_hashlib_constructor(self):
+        hasher = pdh.FileHasher(lambda path: open(path, "rb"))
+        self.assertEqual(hasher.hash_file(self.paths[0], hashlib.md5), self._expected_digest(self.paths[0], "md5"))
+
+    def test_hash_files(self):
+        hasher = pdh.FileHasher(lambda path: open(path, "rb"), max_workers=3, buffer_size=64)
+        output = hasher.hash_files(self.paths, "sha256")
+        hasher.shutdown()
+        self.assertEqual(list(output.keys()), self.paths)
+        for path in self.paths:
+            self.assertEqual(output[path], self._expected_digest(path))
+
+    def test_is_available(self):
+        self.assertTrue(pdh.is_available("sha256"))
+        self.assertFalse(pdh.is_available("not-a-hash"))
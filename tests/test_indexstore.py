@@ -0,0 +1,251 @@
+import hashlib
+import json
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import evaluation as pde
+from picdeduper import platform as pds
+from picdeduper.indexstore import IndexStore, json_sections
+
+from tests.helpers import add_file, image_properties
+
+
+class IndexStoreTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.index_store = IndexStore(self.platform)
+        self.big_a = b"A" * 100000 + b"same middle" + b"Z" * 100000
+        self.big_b = b"A" * 100000 + b"diff middle" + b"Z" * 100000
+        self.big_c = b"B" * 100000 + b"same middle" + b"Z" * 100000
+
+    def test_unique_size_is_not_hashed(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1")
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22")
+
+        for path in ["/c/IMG_0001.JPG", "/c/IMG_0002.JPG"]:
+            properties = self.index_store.image_properties_for_path(path)
+            self.assertIsNone(properties[pdc.KEY_FILE_HASH])
+            self.assertFalse(pdc.KEY_FILE_PARTIAL_HASH in properties)
+        self.assertEqual(self.index_store.data.by_hash, dict())
+
+    def test_same_size_different_partial_hash_is_not_fully_hashed(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_c)
+
+        for path in ["/c/IMG_0001.JPG", "/c/IMG_0002.JPG"]:
+            properties = self.index_store.image_properties_for_path(path)
+            self.assertIsNone(properties[pdc.KEY_FILE_HASH])
+            self.assertTrue(pdc.KEY_FILE_PARTIAL_HASH in properties)
+
+    def test_same_partial_hash_gets_fully_hashed_and_backfilled(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_b)
+
+        self.assertEqual(
+            self.index_store.paths_with_hash(hashlib.sha256(self.big_a).hexdigest()),
+            {"/c/IMG_0001.JPG"})
+        self.assertEqual(
+            self.index_store.paths_with_hash(hashlib.sha256(self.big_b).hexdigest()),
+            {"/c/IMG_0002.JPG"})
+
+    def test_evaluate_finds_lazily_hashed_dupe(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"unrelated")
+
+        candidate_path = "/i/IMG_0001 copy.JPG"
+        self.platform.configure_binary_file(candidate_path, self.big_a)
+        candidate_properties = image_properties(candidate_path, len(self.big_a))
+        result = pde.evaluate(candidate_path, candidate_properties, self.index_store)
+
+        self.assertEqual(result.paths_with_same_hash(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(result.paths_with_same_core_filename(), {"/c/IMG_0001.JPG"})
+        self.assertIsNone(self.index_store.image_properties_for_path("/c/IMG_0002.JPG")[pdc.KEY_FILE_HASH])
+
+    def test_derived_lookups_are_rebuilt_on_load(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_b)
+        self.index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        self.assertEqual(loaded.paths_with_size(str(len(self.big_a))), {"/c/IMG_0001.JPG", "/c/IMG_0002.JPG"})
+        self.assertEqual(loaded.data, self.index_store.data)
+
+    def test_evaluate_finds_same_image_properties_but_not_missing_ones(self):
+        same_image = {pdc.KEY_IMAGE_RES: "3024x4032@24", pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"}
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1", **same_image)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22")  # No metadata at all
+        add_file(self.platform, self.index_store, "/c/IMG_0003.JPG", b"333",
+                 **{**same_image, pdc.KEY_IMAGE_CREATOR: "Apple iPhone 11 Pro"})
+        self.index_store.save("/c/picdedupe.json")
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        candidate_path = "/i/IMG_9999.JPG"
+        self.platform.configure_binary_file(candidate_path, b"4444")
+        result = pde.evaluate(candidate_path, {**image_properties(candidate_path, 4), **same_image}, loaded)
+        self.assertEqual(result.paths_with_same_image_properties(), {"/c/IMG_0001.JPG"})
+
+        result = pde.evaluate(candidate_path, image_properties(candidate_path, 4), loaded)
+        self.assertEqual(result.paths_with_same_image_properties(), set())
+
+    def test_similar_phash_lookup_survives_save_and_load(self):
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", b"1")
+        self.platform.configure_binary_file("/c/IMG_0002.HEIC", b"22")
+        self.platform.configure_binary_file("/c/IMG_0003.JPG", b"333")
+        self.index_store.add("/c/IMG_0001.JPG", {
+            **image_properties("/c/IMG_0001.JPG", 1), pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        self.index_store.add("/c/IMG_0002.HEIC", {
+            **image_properties("/c/IMG_0002.HEIC", 2), pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f3"})
+        self.index_store.add("/c/IMG_0003.JPG", {
+            **image_properties("/c/IMG_0003.JPG", 3), pdc.KEY_IMAGE_PHASH: "0f0f0f0f0f0f0f0f"})
+        self.index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        self.assertEqual(loaded.paths_with_similar_phash("f0f0f0f0f0f0f0f1", max_distance=4), {
+            "/c/IMG_0001.JPG": 1,
+            "/c/IMG_0002.HEIC": 1,
+        })
+        self.assertEqual(loaded.data, self.index_store.data)
+
+    def test_evaluate_finds_similar_images(self):
+        self.platform.configure_binary_file("/c/IMG_0001.HEIC", b"1")
+        self.platform.configure_binary_file("/c/IMG_0002.JPG", b"22")
+        self.index_store.add("/c/IMG_0001.HEIC", {
+            **image_properties("/c/IMG_0001.HEIC", 1), pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        self.index_store.add("/c/IMG_0002.JPG", {
+            **image_properties("/c/IMG_0002.JPG", 2), pdc.KEY_IMAGE_PHASH: "0f0f0f0f0f0f0f0f"})
+
+        candidate_path = "/i/IMG_9999.JPG"
+        self.platform.configure_binary_file(candidate_path, b"333")
+        candidate_properties = {**image_properties(candidate_path, 3), pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f7"}
+        result = pde.evaluate(candidate_path, candidate_properties, self.index_store)
+
+        self.assertTrue(result.has_similar_images())
+        self.assertEqual(result.paths_with_similar_image(), {"/c/IMG_0001.HEIC"})
+        self.assertFalse(result.is_completely_unique())
+
+    def test_sections_get_decoded_on_first_use(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_b)
+        self.index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+        self.assertNotIn("by_hash", loaded.data.__dict__)
+
+        self.assertEqual(loaded.paths_with_hash(hashlib.sha256(self.big_a).hexdigest()), {"/c/IMG_0001.JPG"})
+        self.assertIn("by_hash", loaded.data.__dict__)
+        self.assertNotIn("by_path", loaded.data.__dict__)
+        self.assertNotIn("file_series_splitter", loaded.__dict__)
+
+    def test_file_series_get_restored_instead_of_recomputed(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1")
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22")
+        add_file(self.platform, self.index_store, "/d/DSC_0001.JPG", b"333")
+        self.index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        self.assertEqual(loaded.file_series_splitter.all_file_series,
+                         sorted(self.index_store.file_series_splitter.all_file_series))
+        self.assertNotIn("by_path", loaded.data.__dict__)
+
+    def test_loads_json_of_any_layout(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        self.index_store.save("/c/picdedupe.json")
+        compact = json.dumps(json.loads(self.platform.text_files["/c/picdedupe.json"]))
+        self.platform.write_text_file("/c/compact.json", compact)
+
+        self.assertIsNone(json_sections(compact))
+        self.assertEqual(IndexStore.load("/c/compact.json", self.platform).data, self.index_store.data)
+
+    def test_streamed_json_has_a_section_per_line(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_b)
+        self.index_store.save("/c/picdedupe.json")
+        self.index_store.save("/c/pretty.json", pretty=True)
+        streamed = self.platform.text_files["/c/picdedupe.json"]
+        pretty = self.platform.text_files["/c/pretty.json"]
+
+        self.assertEqual(json.loads(streamed), json.loads(pretty))
+        self.assertEqual(len(streamed.splitlines()), len(json_sections(streamed)) + 2)
+        self.assertEqual(json_sections(streamed).keys(), json_sections(pretty).keys())
+        self.assertEqual(IndexStore.load("/c/picdedupe.json", self.platform).data, self.index_store.data)
+
+
+class IndexJournalTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.platform.configure_path_exists("/c/picdedupe.json", False)
+        self.platform.configure_path_exists("/c/picdedupe.json.journal", False)
+        self.index_store = IndexStore.load("/c/picdedupe.json", self.platform, journaled=True)
+
+    def test_crashed_run_gets_replayed_and_compacted(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 1)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"x" * 2)
+        self.index_store.commit()
+        add_file(self.platform, self.index_store, "/c/IMG_0003.JPG", b"x" * 3)  # Not flushed yet when the crash happens
+
+        reloaded = IndexStore.load("/c/picdedupe.json", self.platform, journaled=True)
+
+        self.assertEqual(set(reloaded.data.by_path.keys()), {"/c/IMG_0001.JPG", "/c/IMG_0002.JPG"})
+        self.assertEqual(self.platform.text_files["/c/picdedupe.json.journal"], "")
+        snapshot = IndexStore.load("/c/picdedupe.json", self.platform)
+        self.assertEqual(snapshot.data, reloaded.data)
+
+    def test_backfilled_hashes_get_journaled(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 5)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"x" * 5)
+        self.index_store.commit()
+
+        reloaded = IndexStore.load("/c/picdedupe.json", self.platform, journaled=True)
+
+        self.assertEqual(reloaded.data, self.index_store.data)
+        self.assertEqual(len(reloaded.paths_with_hash(hashlib.sha256(b"xxxxx").hexdigest())), 2)
+
+    def test_removals_get_journaled(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 1)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"x" * 2)
+        self.index_store.save("/c/picdedupe.json")
+        self.index_store.remove_paths({"/c/IMG_0001.JPG"})
+        self.index_store.commit()  # The crash happens before the next save()
+
+        reloaded = IndexStore.load("/c/picdedupe.json", self.platform, journaled=True)
+
+        self.assertEqual(list(reloaded.data.by_path.keys()), ["/c/IMG_0002.JPG"])
+        self.assertEqual(reloaded.data, self.index_store.data)
+
+    def test_read_only_load_replays_in_memory(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 1)
+        self.index_store.commit()
+        journal_text = self.platform.text_files["/c/picdedupe.json.journal"]
+
+        reloaded = IndexStore.load("/c/picdedupe.json", self.platform, read_only=True)
+
+        self.assertEqual(list(reloaded.data.by_path.keys()), ["/c/IMG_0001.JPG"])
+        self.assertIsNone(reloaded.journal)
+        self.assertFalse("/c/picdedupe.json" in self.platform.text_files)
+        self.assertEqual(self.platform.text_files["/c/picdedupe.json.journal"], journal_text)
+
+    def test_torn_record_is_ignored(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 1)
+        self.index_store.commit()
+        self.platform.append_text_file("/c/picdedupe.json.journal", '["/c/IMG_0002.JPG",{"file_')
+
+        reloaded = IndexStore.load("/c/picdedupe.json", self.platform, journaled=True)
+
+        self.assertEqual(list(reloaded.data.by_path.keys()), ["/c/IMG_0001.JPG"])
+
+    def test_save_clears_the_journal(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"x" * 1)
+        self.index_store.commit()
+        self.index_store.save("/c/picdedupe.json")
+        self.assertEqual(self.platform.text_files["/c/picdedupe.json.journal"], "")
+
+    def test_candidates_do_not_get_journaled(self):
+        self.index_store.stop_persisting()
+        add_file(self.platform, self.index_store, "/i/IMG_0001.JPG", b"x" * 1)
+        self.index_store.commit()
+        self.assertFalse(self.platform.path_exists("/c/picdedupe.json.journal"))
@@ -0,0 +1,164 @@
+import io
+import struct
+import unittest
+
+from picdeduper import fingerprinting as pdf
+from picdeduper import isobmff as pdbmff
+from picdeduper import platform as pds
+
+from tests.test_exif import IPHONE_TIFF
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">L4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type: bytes, payload: bytes = b"", version: int = 0) -> bytes:
+    return box(box_type, struct.pack(">B3s", version, b"\x00\x00\x00") + payload)
+
+
+def make_heic(tiff: bytes, width=4032, height=3024) -> bytes:
+    ftyp = box(b"ftyp", b"heic\x00\x00\x00\x00mif1heic")
+    exif_item = struct.pack(">L", 6) + b"Exif\x00\x00" + tiff
+
+    def _meta(exif_offset: int) -> bytes:
+        iinf = full_box(b"iinf", struct.pack(">H", 2) +
+                        full_box(b"infe", struct.pack(">HH4s", 1, 0, b"hvc1") + b"\x00", version=2) +
+                        full_box(b"infe", struct.pack(">HH4s", 2, 0, b"Exif") + b"\x00", version=2))
+        iloc = full_box(b"iloc", struct.pack(">BBH", 0x44, 0x00, 1) +
+                        struct.pack(">HHHLL", 2, 0, 1, exif_offset, len(exif_item)))
+        ipco = box(b"ipco",
+                   full_box(b"ispe", struct.pack(">LL", 512, 512)) +
+                   full_box(b"ispe", struct.pack(">LL", width, height)) +
+                   full_box(b"pixi", struct.pack(">BBBB", 3, 8, 8, 8)))
+        return full_box(b"meta",
+                        full_box(b"hdlr", b"\x00" * 4 + b"pict" + b"\x00" * 13) +
+                        full_box(b"pitm", struct.pack(">H", 1)) +
+                        iinf + iloc + box(b"iprp", ipco))
+
+    header_size = len(ftyp) + len(_meta(0))
+    mdat = box(b"mdat", exif_item + b"\x00" * 1000)
+    return ftyp + _meta(header_size + 8) + mdat
+
+
+def _mdta_meta() -> bytes:
+    keys = [b"com.apple.quicktime.location.ISO6709", b"com.apple.quicktime.model",
+            b"com.apple.quicktime.software", b"com.apple.quicktime.creationdate"]
+    values = ["+37.3355-121.8930+012.300/", "iPhone 11 Pro", "13.4", "2019-12-24T19:12:06-0800"]
+    keys_box = full_box(b"keys", struct.pack(">L", len(keys)) +
+                        b"".join(struct.pack(">L4s", 8 + len(key), b"mdta") + key for key in keys))
+    ilst = box(b"ilst", b"".join(
+        box(struct.pack(">L", i + 1), box(b"data", struct.pack(">LL", 1, 0) + value.encode()))
+        for i, value in enumerate(values)))
+    hdlr = full_box(b"hdlr", b"\x00" * 4 + b"mdta" + b"\x00" * 13)
+    return box(b"meta", hdlr + keys_box + ilst)
+
+
+def make_mov(mdat_size=1024 * 1024, with_mdta=True) -> bytes:
+    ftyp = box(b"ftyp", b"qt  \x00\x00\x00\x00qt  ")
+    mdat = box(b"mdat", b"\x00" * mdat_size)
+    # 2019-12-25 03:12:06 UTC, in seconds since 1904:
+    seconds = 1577243526 + pdbmff.QUICKTIME_EPOCH_OFFSET
+    mvhd = full_box(b"mvhd", struct.pack(">LLLL", seconds, seconds, 600, 6000) + b"\x00" * 80)
+    matrix = struct.pack(">9L", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd = full_box(b"tkhd", struct.pack(">LLLLL", seconds, seconds, 1, 0, 6000) +
+                    b"\x00" * 8 + b"\x00" * 8 + matrix + struct.pack(">LL", 1920 << 16, 1080 << 16))
+    udta = box(b"udta",
+               box(b"\xa9xyz", struct.pack(">HH", 26, 0x15c7) + b"+37.3355-121.8930+012.300/") +
+               box(b"\xa9mod", struct.pack(">HH", 13, 0x15c7) + b"iPhone 11 Pro"))
+    moov = box(b"moov", mvhd + box(b"trak", tkhd) + udta + (_mdta_meta() if with_mdta else b""))
+    return ftyp + mdat + moov
+
+
+class CountingReader(io.BytesIO):
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1) -> bytes:
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class IsoBmffTests(unittest.TestCase):
+
+    def test_iter_boxes(self):
+        data = box(b"ftyp", b"heic") + struct.pack(">L4sQ", 1, b"mdat", 16 + 4) + b"abcd" + box(b"free")
+        boxes = list(pdbmff.iter_boxes(io.BytesIO(data), 0, len(data)))
+        self.assertEqual([b.type for b in boxes], [b"ftyp", b"mdat", b"free"])
+        self.assertEqual(boxes[1].header_size, 16)
+        self.assertEqual(boxes[1].size, 20)
+
+    def test_iter_boxes_size_zero_goes_to_the_end(self):
+        data = box(b"ftyp") + struct.pack(">L4s", 0, b"mdat") + b"\x00" * 100
+        boxes = list(pdbmff.iter_boxes(io.BytesIO(data), 0, len(data)))
+        self.assertEqual(boxes[-1].end(), len(data))
+
+    def test_heic(self):
+        properties = pdbmff.mdls_properties_of_isobmff(io.BytesIO(make_heic(IPHONE_TIFF)))
+        self.assertEqual(properties["kMDItemAcquisitionModel"], "iPhone 11 Pro")
+        self.assertEqual(properties["kMDItemContentCreationDate"], "2019-12-25 03:12:06 +0000")
+        self.assertEqual(properties["kMDItemLatitude"], "37.33548")
+        self.assertEqual(properties["kMDItemPixelHeight"], "3024")
+        self.assertEqual(properties["kMDItemPixelWidth"], "4032")
+        self.assertEqual(properties["kMDItemBitsPerSample"], "24")
+
+    def test_mov(self):
+        properties = pdbmff.mdls_properties_of_isobmff(io.BytesIO(make_mov()))
+        self.assertDictEqual(properties, {
+            "kMDItemContentCreationDate": "2019-12-25 03:12:06 +0000",
+            "kMDItemContentModificationDate": "2019-12-25 03:12:06 +0000",
+            "kMDItemPixelHeight": "1080",
+            "kMDItemPixelWidth": "1920",
+            "kMDItemAcquisitionModel": "iPhone 11 Pro",
+            "kMDItemCreator": "13.4",
+            "kMDItemLatitude": "37.3355",
+            "kMDItemLongitude": "-121.893",
+            "kMDItemAltitude": "12.3",
+        })
+
+    def test_mov_without_mdta(self):
+        properties = pdbmff.mdls_properties_of_isobmff(io.BytesIO(make_mov(with_mdta=False)))
+        self.assertEqual(properties["kMDItemContentCreationDate"], "2019-12-25 03:12:06 +0000")
+        self.assertEqual(properties["kMDItemAcquisitionModel"], "iPhone 11 Pro")
+        self.assertEqual(properties["kMDItemLatitude"], "37.3355")
+        self.assertNotIn("kMDItemCreator", properties)
+
+    def test_mov_skips_mdat(self):
+        f = CountingReader(make_mov(mdat_size=8 * 1024 * 1024))
+        pdbmff.mdls_properties_of_isobmff(f)
+        self.assertLess(f.bytes_read, 4096)
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(pdbmff.IsoBmffError):
+            pdbmff.mdls_properties_of_isobmff(io.BytesIO(box(b"ftyp", b"heic") + box(b"free")))
+        with self.assertRaises(pdbmff.IsoBmffError):
+            pdbmff.mdls_properties_of_isobmff(io.BytesIO(box(b"moov", box(b"mvhd", b"\x00"))))
+
+    def test_rejects_bad_key_sizes(self):
+        hdlr = full_box(b"hdlr", b"\x00" * 4 + b"mdta" + b"\x00" * 13)
+        ilst = box(b"ilst", box(struct.pack(">L", 1), box(b"data", struct.pack(">LL", 1, 0) + b"iPhone")))
+        for keys_payload in [struct.pack(">LL4s", 0xFFFFFFFF, 0, b"mdta"),  # Would never get past the first key
+                             struct.pack(">LL4s", 1, 1000, b"mdta") + b"model"]:
+            moov = box(b"moov", box(b"meta", hdlr + full_box(b"keys", keys_payload) + ilst))
+            with self.assertRaises(pdbmff.IsoBmffError):
+                pdbmff.mdls_properties_of_isobmff(io.BytesIO(box(b"ftyp", b"qt  ") + moov))
+
+    def test_fingerprinter_with_header_metadata_backend(self):
+        path = "/test/IMG_1234.MOV"
+        platform = pds.FakePlatform()
+        platform.configure_is_mac_os(False)
+        platform.configure_binary_file(path, make_mov())
+        platform.configure_file_stat(path, pds.FileStat(1048576, 1577243526000000000, 1234, 16777220))
+
+        fingerprinter = pdf.Fingerprinter(platform)
+        result = dict()
+        fingerprinter.image_signature_dict_of(path, result)
+
+        self.assertEqual(platform.called_cmd_lines, [])
+        self.assertEqual(result["image_res"], "1080x1920")
+        self.assertEqual(result["image_creator"], "iPhone 11 Pro/13.4")
+        self.assertEqual(result["image_date"], "2019-12-25 03:12:06 +0000")
+        self.assertEqual(result["image_loc"], "<37.3355,-121.893>")
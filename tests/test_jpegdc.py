@@ -0,0 +1,151 @@
+import struct
+import unittest
+
+from picdeduper import jpegdc
+
+# Every DC size category (0..11) gets a 4-bit code, equal to the category
+DC_COUNTS = bytes([0, 0, 0, 12] + [0] * 12)
+DC_SYMBOLS = bytes(range(12))
+# AC: EOB = '0', (run 0, size 1) = '10', ZRL (16 zeros) = '110'
+AC_COUNTS = bytes([1, 1, 1] + [0] * 13)
+AC_SYMBOLS = bytes([0x00, 0x01, 0xF0])
+
+
+class _BitWriter:
+
+    def __init__(self) -> None:
+        self.bits = ""
+        self.output = b""
+
+    def write(self, value: int, count: int) -> None:
+        if count:
+            self.bits += format(value, f"0{count}b")
+
+    def flush(self) -> None:
+        self.bits += "1" * (-len(self.bits) % 8)
+        for i in range(0, len(self.bits), 8):
+            byte = int(self.bits[i:i + 8], 2)
+            self.output += bytes([byte]) + (b"\x00" if byte == 0xFF else b"")
+        self.bits = ""
+
+
+def _write_block(writer: _BitWriter, diff: int, with_ac: bool) -> None:
+    size = abs(diff).bit_length()
+    writer.write(size, 4)
+    writer.write(diff if diff >= 0 else diff + (1 << size) - 1, size)
+    if with_ac:
+        writer.write(0b10, 2)   # run 0, size 1...
+        writer.write(1, 1)      # ...value 1
+        writer.write(0b110, 3)  # 16 zeros
+        writer.write(0b0, 1)    # EOB
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def make_dc_jpeg(luma_dc, blocks_x: int, blocks_y: int,
+                 components: int = 1, sampling: int = 1,
+                 progressive: bool = False, with_ac: bool = True,
+                 restart_interval: int = 0, quant: int = 8) -> bytes:
+    """A JPEG with the given luma DC values (row by row, one per 8x8 block), and flat chroma"""
+    width, height = 8 * blocks_x, 8 * blocks_y
+    dqt = _segment(0xDB, bytes([0]) + bytes([quant] * 64))
+    frame = struct.pack(">BHHB", 8, height, width, components)
+    frame += bytes([1, (sampling << 4) | sampling, 0])
+    for component_id in range(2, components + 1):
+        frame += bytes([component_id, 0x11, 0])
+    sof = _segment(0xC2 if progressive else 0xC0, frame)
+    dht = _segment(0xC4, bytes([0x00]) + DC_COUNTS + DC_SYMBOLS + bytes([0x10]) + AC_COUNTS + AC_SYMBOLS)
+    dri = _segment(0xDD, struct.pack(">H", restart_interval)) if restart_interval else b""
+    scan = bytes([components]) + b"".join(bytes([i, 0x00]) for i in range(1, components + 1))
+    scan += bytes([0, 0 if progressive else 63, 0])
+    sos = _segment(0xDA, scan)
+
+    writer = _BitWriter()
+    mcus_x = -(-blocks_x // sampling) if components > 1 else blocks_x
+    mcus_y = -(-blocks_y // sampling) if components > 1 else blocks_y
+    luma_sampling = sampling if components > 1 else 1
+    predictions = [0] * components
+    for mcu in range(mcus_x * mcus_y):
+        if restart_interval and mcu and mcu % restart_interval == 0:
+            writer.flush()
+            writer.output += bytes([0xFF, 0xD0 + (mcu // restart_interval - 1) % 8])
+            predictions = [0] * components
+        mcu_x, mcu_y = mcu % mcus_x, mcu // mcus_x
+        for by in range(luma_sampling):
+            for bx in range(luma_sampling):
+                x, y = mcu_x * luma_sampling + bx, mcu_y * luma_sampling + by
+                dc = luma_dc[y * blocks_x + x] if (x < blocks_x and y < blocks_y) else 0
+                _write_block(writer, dc - predictions[0], with_ac and not progressive)
+                predictions[0] = dc
+        for _ in range(1, components):
+            _write_block(writer, 0, with_ac and not progressive)
+    writer.flush()
+    return b"\xFF\xD8" + dqt + sof + dht + dri + sos + writer.output + b"\xFF\xD9"
+
+
+def _dc_values(blocks_x: int, blocks_y: int):
+    return [((x * 37 + y * 11) % 200) - 100 for y in range(blocks_y) for x in range(blocks_x)]
+
+
+def _expected_pixels(dc_values, quant: int = 8):
+    return [min(255, max(0, 128 + (dc * quant) // 8)) for dc in dc_values]
+
+
+class JpegDcTests(unittest.TestCase):
+
+    def test_grayscale(self):
+        dc = _dc_values(5, 3)
+        pixels, width, height = jpegdc.decode_dc_grayscale(make_dc_jpeg(dc, 5, 3))
+        self.assertEqual((width, height), (5, 3))
+        self.assertEqual(pixels, _expected_pixels(dc))
+
+    def test_color_with_chroma_subsampling(self):
+        dc = _dc_values(6, 5)
+        pixels, width, height = jpegdc.decode_dc_grayscale(make_dc_jpeg(dc, 6, 5, components=3, sampling=2))
+        self.assertEqual((width, height), (6, 5))
+        self.assertEqual(pixels, _expected_pixels(dc))
+
+    def test_restart_intervals(self):
+        dc = _dc_values(7, 4)
+        pixels, _, _ = jpegdc.decode_dc_grayscale(make_dc_jpeg(dc, 7, 4, components=3, restart_interval=3))
+        self.assertEqual(pixels, _expected_pixels(dc))
+
+    def test_progressive_dc_scan(self):
+        dc = _dc_values(4, 4)
+        pixels, _, _ = jpegdc.decode_dc_grayscale(make_dc_jpeg(dc, 4, 4, components=3, progressive=True))
+        self.assertEqual(pixels, _expected_pixels(dc))
+
+    def test_quantization(self):
+        dc = [10, -10, 0, 5]
+        pixels, _, _ = jpegdc.decode_dc_grayscale(make_dc_jpeg(dc, 2, 2, quant=16))
+        self.assertEqual(pixels, _expected_pixels(dc, quant=16))
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(jpegdc.JpegDcError):
+            jpegdc.decode_dc_grayscale(b"not a jpeg")
+        with self.assertRaises(jpegdc.JpegDcError):
+            jpegdc.decode_dc_grayscale(make_dc_jpeg(_dc_values(4, 4), 4, 4)[:30])
+
+    def test_rejects_invalid_huffman_tables(self):
+        data = make_dc_jpeg(_dc_values(4, 4), 4, 4)
+        dht_at = data.index(bytes([0xFF, 0xC4])) + 5  # The DC counts
+        too_many_codes = data[:dht_at] + bytes([0, 5]) + data[dht_at + 2:]  # 5 codes of 2 bits
+        too_few_symbols = data[:dht_at] + bytes([0, 0, 200]) + data[dht_at + 3:]
+        for corrupt in [too_many_codes, too_few_symbols]:
+            with self.assertRaises(jpegdc.JpegDcError):
+                jpegdc.decode_dc_grayscale(corrupt)
+
+    def test_rejects_invalid_sampling_factors(self):
+        data = make_dc_jpeg(_dc_values(6, 5), 6, 5, components=3, sampling=2)
+        sampling_at = data.index(bytes([0xFF, 0xC0])) + 11  # Of the luma component
+        for sampling in [0x20, 0x02, 0x00, 0x52]:
+            with self.assertRaises(jpegdc.JpegDcError):
+                jpegdc.decode_dc_grayscale(data[:sampling_at] + bytes([sampling]) + data[sampling_at + 1:])
+
+    def test_rejects_too_many_blocks(self):
+        data = make_dc_jpeg(_dc_values(5, 3), 5, 3)
+        with self.assertRaises(jpegdc.JpegDcError):
+            jpegdc.decode_dc_grayscale(data, max_blocks=14)
+        self.assertEqual(jpegdc.decode_dc_grayscale(data, max_blocks=15)[1:], (5, 3))
@@ -0,0 +1,77 @@
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import merge as pdmerge
+from picdeduper import platform as pds
+from picdeduper.fileseries import PictureFileSeries
+from picdeduper.indexstore import IndexStore
+
+from tests.helpers import image_properties
+
+
+class MergeTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+
+    def _index_store(self, entries) -> IndexStore:
+        index_store = IndexStore(self.platform)
+        for path, properties in entries:
+            index_store.data.add(path, properties)
+            index_store.file_series_splitter.add_path(path, properties)
+        return index_store
+
+    def _properties(self, path: pds.Path, size: int, mtime_ns: int, **extra_properties) -> pdc.PropertyDict:
+        return {**image_properties(path, size),
+                pdc.KEY_FILE_MTIME_NS: str(mtime_ns),
+                pdc.KEY_FILE_INODE: "1",
+                **extra_properties}
+
+    def test_resolve_path_conflict(self):
+        indexed = self._properties("/c/IMG_0001.JPG", 1, 100)
+        hashed = self._properties("/c/IMG_0001.JPG", 1, 100, **{pdc.KEY_FILE_HASH: "aa"})
+        modified = self._properties("/c/IMG_0001.JPG", 2, 200, **{pdc.KEY_FILE_HASH: "bb"})
+
+        self.assertEqual(pdmerge.resolve_path_conflict(indexed, hashed)[pdc.KEY_FILE_HASH], "aa")
+        self.assertIs(pdmerge.resolve_path_conflict(hashed, modified), modified)
+        self.assertIs(pdmerge.resolve_path_conflict(modified, hashed), modified)
+
+    def test_merge(self):
+        a = self._index_store([
+            ("/a/IMG_0001.JPG", self._properties("/a/IMG_0001.JPG", 1, 100, **{
+                pdc.KEY_FILE_HASH: "aa", pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"})),
+            ("/c/IMG_0002.JPG", self._properties("/c/IMG_0002.JPG", 2, 100, **{pdc.KEY_FILE_HASH: "bb"})),
+        ])
+        b = self._index_store([
+            ("/b/IMG_0001.JPG", self._properties("/b/IMG_0001.JPG", 1, 100, **{
+                pdc.KEY_FILE_HASH: "aa", pdc.KEY_IMAGE_DATE: "2018-01-01 00:00:00 +0000"})),
+            ("/c/IMG_0002.JPG", self._properties("/c/IMG_0002.JPG", 3, 200, **{pdc.KEY_FILE_HASH: "cc"})),
+        ])
+
+        merged = pdmerge.merge_index_stores([a, b])
+
+        self.assertEqual(set(merged.data.by_path), {"/a/IMG_0001.JPG", "/b/IMG_0001.JPG", "/c/IMG_0002.JPG"})
+        self.assertEqual(merged.paths_with_hash("aa"), {"/a/IMG_0001.JPG", "/b/IMG_0001.JPG"})
+        self.assertEqual(merged.paths_with_hash("bb"), set())  # Modified since
+        self.assertEqual(merged.paths_with_hash("cc"), {"/c/IMG_0002.JPG"})
+        self.assertEqual(merged.paths_with_core_filename("IMG_0001"), {"/a/IMG_0001.JPG", "/b/IMG_0001.JPG"})
+        self.assertEqual(merged.paths_with_size("3"), {"/c/IMG_0002.JPG"})
+        self.assertEqual(merged.image_date_range(), ("2018-01-01 00:00:00 +0000", "2019-12-25 03:12:06 +0000"))
+
+    def test_merged_index_survives_save_and_load(self):
+        a = self._index_store([("/a/IMG_0001.JPG", self._properties("/a/IMG_0001.JPG", 1, 100))])
+        b = self._index_store([("/b/IMG_0001.JPG", self._properties("/b/IMG_0001.JPG", 1, 100))])
+        merged = pdmerge.merge_index_stores([a, b])
+        merged.save("/c/merged.json")
+
+        loaded = IndexStore.load("/c/merged.json", self.platform)
+        self.assertEqual(loaded.data, merged.data)
+        self.assertEqual(len(loaded.file_series_splitter.all_file_series), 2)
+
+    def test_merge_file_series(self):
+        a1 = PictureFileSeries("IMG_", 1, None, None, None)
+        a5 = PictureFileSeries("IMG_", 5, None, None, None)
+        b3 = PictureFileSeries("IMG_", 3, None, None, None)
+        dsc = PictureFileSeries("DSC", 7, None, None, None)
+        merged = pdmerge.merge_file_series([[a5, a1], [dsc, b3, PictureFileSeries("IMG_", 5, None, None, None)]])
+        self.assertEqual(merged, [dsc, a1, b3, a5])
@@ -0,0 +1,98 @@
+import math
+import struct
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import exif as pdexif
+from picdeduper import fingerprinting as pdf
+from picdeduper import perceptual as pdperc
+from picdeduper import platform as pds
+from picdeduper import similarity as pdsim
+
+from tests.test_exif import ASCII, LONG, _ifd_block, make_jpeg
+from tests.test_isobmff import make_heic, make_mov
+from tests.test_jpegdc import make_dc_jpeg
+
+
+def _scene(blocks_x: int, blocks_y: int):
+    """Luma DC values of the same smooth scene, at any size"""
+    return [int(100 * math.sin(5 * (x + 0.5) / blocks_x) * math.cos(4 * (y + 0.5) / blocks_y))
+            for y in range(blocks_y) for x in range(blocks_x)]
+
+
+def make_tiff_with_thumbnail(thumbnail: bytes) -> bytes:
+    ifd0 = [(pdexif.TAG_MODEL, ASCII, "iPhone 11 Pro")]
+    ifd1_start = 8 + len(_ifd_block(8, ifd0))
+    ifd1 = [(pdexif.TAG_THUMBNAIL_OFFSET, LONG, [0]), (pdexif.TAG_THUMBNAIL_LENGTH, LONG, [len(thumbnail)])]
+    thumbnail_start = ifd1_start + len(_ifd_block(ifd1_start, ifd1))
+    ifd1[0] = (pdexif.TAG_THUMBNAIL_OFFSET, LONG, [thumbnail_start])
+    return (b"II*\x00" + struct.pack("<L", 8) +
+            _ifd_block(8, ifd0, next_ifd=ifd1_start) +
+            _ifd_block(ifd1_start, ifd1) +
+            thumbnail)
+
+
+class PerceptualTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.hasher = pdperc.PerceptualHasher(self.platform)
+        self.thumbnail = make_dc_jpeg(_scene(20, 15), 20, 15, components=3)
+        self.full_size = make_dc_jpeg(_scene(80, 60), 80, 60, components=3, sampling=2)
+
+    def test_thumbnail_of_tiff(self):
+        tiff = pdexif.parse_tiff(make_tiff_with_thumbnail(self.thumbnail))
+        self.assertEqual(pdexif.thumbnail_of_tiff(tiff), self.thumbnail)
+
+    def test_jpeg_thumbnail(self):
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", make_jpeg(make_tiff_with_thumbnail(self.thumbnail)))
+        self.assertIsNotNone(self.hasher.phash_of("/c/IMG_0001.JPG"))
+        self.assertEqual(self.hasher.counters[pdperc.SOURCE_THUMBNAIL], 1)
+
+    def test_heic_thumbnail(self):
+        self.platform.configure_binary_file("/c/IMG_0001.HEIC", make_heic(make_tiff_with_thumbnail(self.thumbnail)))
+        self.assertIsNotNone(self.hasher.phash_of("/c/IMG_0001.HEIC"))
+        self.assertEqual(self.hasher.counters[pdperc.SOURCE_THUMBNAIL], 1)
+
+    @unittest.skipIf(pdperc.Image, "PIL would decode it")
+    def test_jpeg_without_thumbnail_gets_dc_decoded(self):
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", self.full_size)
+        self.assertIsNotNone(self.hasher.phash_of("/c/IMG_0001.JPG"))
+        self.assertEqual(self.hasher.counters[pdperc.SOURCE_DC], 1)
+
+    @unittest.skipIf(pdperc.Image, "PIL would decode it")
+    def test_large_jpeg_does_not_get_dc_decoded(self):
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", make_dc_jpeg(_scene(128, 96), 128, 96, with_ac=False))
+        self.assertIsNone(self.hasher.phash_of("/c/IMG_0001.JPG"))
+        self.assertEqual(self.hasher.counters[pdperc.SOURCE_NONE], 1)
+
+    @unittest.skipIf(pdperc.Image, "PIL would decode it")
+    def test_thumbnail_and_dc_decode_agree(self):
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", make_jpeg(make_tiff_with_thumbnail(self.thumbnail)))
+        self.platform.configure_binary_file("/c/IMG_0002.JPG", self.full_size)
+        a = pdsim.phash_from_string(self.hasher.phash_of("/c/IMG_0001.JPG"))
+        b = pdsim.phash_from_string(self.hasher.phash_of("/c/IMG_0002.JPG"))
+        self.assertLessEqual(pdsim.hamming_distance(a, b), 4)
+
+    @unittest.skipIf(pdperc.Image, "PIL would decode it")
+    def test_no_source(self):
+        self.platform.configure_binary_file("/c/IMG_0001.MOV", make_mov())
+        self.platform.configure_binary_file("/c/IMG_0002.HEIC", make_heic(make_tiff_with_thumbnail(b"")))
+        self.assertIsNone(self.hasher.phash_of("/c/IMG_0001.MOV"))
+        self.assertIsNone(self.hasher.phash_of("/c/IMG_0002.HEIC"))
+        self.assertEqual(self.hasher.counters[pdperc.SOURCE_NONE], 2)
+        self.assertEqual(self.hasher.summary(),
+                         "Perceptual hashes: 0 from thumbnail, 0 from reduced, 0 from dc, 2 from none")
+
+    def test_fingerprinter_with_perceptual_hasher(self):
+        path = "/c/IMG_0001.JPG"
+        self.platform.configure_is_mac_os(False)
+        self.platform.configure_binary_file(path, self.full_size)
+        self.platform.configure_file_stat(path, pds.FileStat(len(self.full_size), 1577243526000000000, 1234, 1))
+
+        result = dict()
+        pdf.Fingerprinter(self.platform).image_signature_dict_of(path, result)
+        self.assertNotIn(pdc.KEY_IMAGE_PHASH, result)
+
+        pdf.Fingerprinter(self.platform, perceptual_hasher=self.hasher).image_signature_dict_of(path, result)
+        self.assertEqual(len(result[pdc.KEY_IMAGE_PHASH]), 16)
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import fingerprinting as pdf
+from picdeduper import fixits
+from picdeduper import platform as pds
+from picdeduper.indexstore import IndexStore
+from picdeduper.picdeduper import PicDeduper
+
+from tests.helpers import image_properties
+from tests.test_fingerprinting import VanishingFilesPlatform
+
+
+class NoMetadataBackend(pdf.MetadataBackend):
+
+    def properties_of_image_file(self, path: pds.Path) -> pdc.PropertyDict:
+        return dict()
+
+
+class SkippingFixItProcessor(fixits.FixItProcessor):
+
+    def process(self, fixit: fixits.FixIt) -> bool:
+        return False
+
+
+class ThreadRecordingIndexStore(IndexStore):
+
+    def __init__(self, platform: pds.Platform) -> None:
+        super().__init__(platform)
+        self.update_threads = list()
+
+    def update_known_image_properties(self, path: pds.Path, image_properties: pdc.PropertyDict):
+        self.update_threads.append(threading.current_thread())
+        super().update_known_image_properties(path, image_properties)
+
+
+class PicDeduperTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = VanishingFilesPlatform()
+        self.platform.configure_every_file_path("/c", ["/c/IMG_0001.JPG", "/c/IMG_0002.JPG"])
+        self._write("/c/IMG_0001.JPG", b"AAAA" * 1000, mtime_ns=1577243526000000000)
+        self._write("/c/IMG_0002.JPG", b"BBBB" * 1000, mtime_ns=1577243526000000000)
+        self.pic_deduper = PicDeduper(self.platform, pdf.Fingerprinter(self.platform, NoMetadataBackend()),
+                                      SkippingFixItProcessor())
+        self.pic_deduper.lazy_hashing = True
+        self.pic_deduper.skip_unchanged_dirs = False
+        self.pic_deduper.jobs = 1
+        self.index_store = IndexStore(self.platform)
+
+    def _write(self, path: pds.Path, content: bytes, mtime_ns: int):
+        self.platform.configure_binary_file(path, content)
+        self.platform.configure_file_stat(path, pds.FileStat(len(content), mtime_ns, inode=1))
+        self.platform.configure_path_exists(path, True)
+
+    def test_changed_file_gets_hashed_again(self):
+        self.pic_deduper.index_established_collection_dir(self.index_store, "/c")
+        old_partial_hash = self.index_store.known_image_properties("/c/IMG_0001.JPG")[pdc.KEY_FILE_PARTIAL_HASH]
+
+        self._write("/c/IMG_0001.JPG", b"CCCC" * 1000, mtime_ns=1577243527000000000)
+        self.pic_deduper.index_established_collection_dir(self.index_store, "/c")
+
+        partial_hash = self.index_store.known_image_properties("/c/IMG_0001.JPG")[pdc.KEY_FILE_PARTIAL_HASH]
+        self.assertNotEqual(partial_hash, old_partial_hash)
+        self.assertEqual(partial_hash, self.platform.partial_file_hash("/c/IMG_0001.JPG"))
+        self.assertEqual(self.index_store.paths_with_partial_hash(old_partial_hash), set())
+
+    def test_candidates_get_compared_with_the_ones_before(self):
+        self.pic_deduper.index_established_collection_dir(self.index_store, "/c")
+        self.index_store.stop_persisting()
+        self.platform.configure_catchall_raw_cmd_output(b"1234 *whatever\n")  # Second opinions, without MD4 in hashlib
+        self._write("/i/IMG_0001.JPG", b"AAAA" * 1000, mtime_ns=1577243526000000000)
+        self._write("/i/IMG_9001.JPG", b"DDDD" * 1000, mtime_ns=1577243526000000000)
+        self._write("/i/IMG_9002.JPG", b"DDDD" * 1000, mtime_ns=1577243526000000000)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.pic_deduper.evaluate_candidate_paths(
+                self.index_store, ["/i/IMG_0001.JPG", "/i/IMG_9001.JPG", "/i/IMG_9002.JPG"])
+
+        self.assertIn("! DUPE ! /i/IMG_0001.JPG is a file dupe of {'/c/IMG_0001.JPG'}", output.getvalue())
+        self.assertIn(". UNIQ . /i/IMG_9001.JPG", output.getvalue())
+        self.assertIn("! DUPE ! /i/IMG_9002.JPG is a file dupe of {'/i/IMG_9001.JPG'}", output.getvalue())
+
+    def test_legacy_signatures_get_upgraded_on_the_indexing_thread(self):
+        index_store = ThreadRecordingIndexStore(self.platform)
+        for path in ["/c/IMG_0001.JPG", "/c/IMG_0002.JPG"]:
+            index_store.add(path, image_properties(path, 4000))  # No mtime_ns: indexed before we used stat()
+
+        self.pic_deduper.index_established_collection_dir(index_store, "/c")
+
+        self.assertEqual(index_store.update_threads, [threading.current_thread()] * 2)
+        for _, known_properties in index_store.all_image_properties():
+            self.assertEqual(known_properties[pdc.KEY_FILE_MTIME_NS], "1577243526000000000")
+
+    def test_vanished_file_gets_skipped(self):
+        self.platform.unstattable_paths.add("/c/IMG_0002.JPG")  # Gone after the walk found it
+
+        self.pic_deduper.index_established_collection_dir(self.index_store, "/c")
+
+        self.assertEqual(set(path for path, _ in self.index_store.all_image_properties()), {"/c/IMG_0001.JPG"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import concurrent.futures
+import random
+import threading
+import time
+import unittest
+
+from picdeduper import pipeline
+
+
+class PipelineTests(unittest.TestCase):
+
+    def test_chunked(self):
+        self.assertEqual(list(pipeline.chunked(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(pipeline.chunked([], 3)), [])
+
+    def test_background_iter(self):
+        self.assertEqual(list(pipeline.background_iter(range(100), max_queued=3)), list(range(100)))
+
+    def test_background_iter_raises_in_caller(self):
+        def failing():
+            yield 1
+            raise ValueError("walk failed")
+
+        with self.assertRaises(ValueError):
+            list(pipeline.background_iter(failing(), max_queued=3))
+
+    def test_ordered_map_keeps_order(self):
+        def slow_square(x):
+            time.sleep(random.random() / 1000)
+            return x * x
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            output = list(pipeline.ordered_map(slow_square, range(50), executor, max_in_flight=16))
+
+        self.assertEqual(output, [x * x for x in range(50)])
+
+    def test_ordered_map_limits_items_in_flight(self):
+        lock = threading.Lock()
+        pulled = [0]
+        consumed = [0]
+        max_ahead = [0]
+
+        def items():
+            for i in range(40):
+                with lock:
+                    pulled[0] += 1
+                    max_ahead[0] = max(max_ahead[0], pulled[0] - consumed[0])
+                yield i
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in pipeline.ordered_map(lambda x: x, items(), executor, max_in_flight=5):
+                with lock:
+                    consumed[0] += 1
+
+        self.assertEqual(consumed[0], 40)
+        self.assertLessEqual(max_ahead[0], 5)
+
+    def test_ordered_map_stops_on_should_quit(self):
+        should_quit = [False]
+        output = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            for x in pipeline.ordered_map(lambda x: x, range(1000), executor, max_in_flight=4,
+                                          should_quit=lambda: should_quit[0]):
+                output.append(x)
+                if x == 10:
+                    should_quit[0] = True
+
+        self.assertEqual(output, list(range(11)))
@@ -1,7 +1,13 @@
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
 import unittest
 import random
 
 from picdeduper import platform as pds
+from picdeduper import hashing as pdh
 
 
 class PlatformTests(unittest.TestCase):
@@ -54,17 +60,60 @@ class PlatformTests(unittest.TestCase):
         self.assertEqual(pds.path_core_filename("/path/to/file copy 1.ext"), "file")
         self.assertEqual(pds.path_core_filename("/path/to/file copy 22.ext"), "file")
 
+    def test_write_text_chunks_never_half_writes(self):
+        platform = pds.MacOSPlatform()
+
+        def failing_chunks():
+            yield "{"
+            raise OSError("Disk full")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "picdedupe.json")
+            platform.write_text_chunks(path, ["{", "}"])
+            self.assertEqual(platform.read_text_file(path), "{}")
+            with self.assertRaises(OSError):
+                platform.write_text_chunks(path, failing_chunks())
+            self.assertEqual(platform.read_text_file(path), "{}")
+            self.assertEqual(os.listdir(temp_dir), ["picdedupe.json"])
+
+            with self.assertRaises(FileNotFoundError) as raised:
+                platform.write_text_chunks(os.path.join(temp_dir, "missing", "picdedupe.json"), ["{}"])
+            self.assertIsNone(raised.exception.__context__)  # Not removing the temp file that never got created
+
     def test_quick_file_hash(self):
-        cmd_line = "openssl sha256 -r /test/testfile.tst"
         platform = pds.FakePlatform()
-        platform.configure_raw_stdout_of(cmd_line, b"1234DeadBead9876 */test/testfile.tst\n")
+        platform.configure_binary_file("/test/testfile.tst", b"1234DeadBead9876")
 
         output = platform.quick_file_hash("/test/testfile.tst")
 
-        self.assertTrue(cmd_line in platform.called_cmd_lines)
-        self.assertEqual(output, "1234DeadBead9876")
+        self.assertEqual(platform.called_cmd_lines, [])
+        self.assertEqual(output, hashlib.sha256(b"1234DeadBead9876").hexdigest())
 
+    def test_quick_file_hashes(self):
+        platform = pds.FakePlatform()
+        platform.configure_binary_file("/test/a.tst", b"a")
+        platform.configure_binary_file("/test/b.tst", b"b")
+
+        output = platform.quick_file_hashes(["/test/a.tst", "/test/b.tst"])
+
+        self.assertEqual(platform.called_cmd_lines, [])
+        self.assertDictEqual(output, {
+            "/test/a.tst": hashlib.sha256(b"a").hexdigest(),
+            "/test/b.tst": hashlib.sha256(b"b").hexdigest(),
+        })
+
+    @unittest.skipUnless(pdh.is_available("md4"), "hashlib has no MD4")
     def test_second_opinion_file_hash(self):
+        platform = pds.FakePlatform()
+        platform.configure_binary_file("/test/testfile.tst", b"1234DeadBead9876")
+
+        output = platform.second_opinion_file_hash("/test/testfile.tst")
+
+        self.assertEqual(platform.called_cmd_lines, [])
+        self.assertEqual(output, hashlib.new("md4", b"1234DeadBead9876").hexdigest())
+
+    @unittest.skipIf(pdh.is_available("md4"), "hashlib has MD4")
+    def test_second_opinion_file_hash_without_hashlib_md4(self):
         cmd_line = "openssl md4 -r /test/testfile.tst"
         platform = pds.FakePlatform()
         platform.configure_raw_stdout_of(cmd_line, b"1234DeadBead9876 */test/testfile.tst\n")
@@ -74,6 +123,43 @@ class PlatformTests(unittest.TestCase):
         self.assertTrue(cmd_line in platform.called_cmd_lines)
         self.assertEqual(output, "1234DeadBead9876")
 
+    def test_async_platform_limits_commands_in_flight(self):
+        platform = pds.FakePlatform()
+        platform.configure_catchall_raw_cmd_output(b"done\n")
+        platform.configure_async_delay(0.01)
+        async_platform = pds.AsyncPlatform(platform, max_in_flight=3)
+
+        async def run():
+            return await asyncio.gather(*[async_platform.stdout_of(["echo", str(i)]) for i in range(10)])
+
+        self.assertEqual(asyncio.run(run()), ["done"] * 10)
+        self.assertEqual(len(platform.called_cmd_lines), 10)
+        self.assertEqual(platform.max_cmds_in_flight, 3)
+
+    def test_async_platform_timeout(self):
+        platform = pds.FakePlatform()
+        platform.configure_async_delay(1.0)
+        async_platform = pds.AsyncPlatform(platform, timeout=0.01)
+
+        with self.assertRaises(pds.CommandTimeoutError):
+            asyncio.run(async_platform.raw_stdout_of(["sleep", "1"]))
+        self.assertEqual(platform.cmds_in_flight, 0)
+
+    def test_async_platform_without_async_mode(self):
+        platform = pds.FakePlatform()
+        platform.configure_raw_stdout_of("echo hi", b"hi\n")
+        platform.configure_binary_file("/test/a.tst", b"a")
+        async_platform = pds.AsyncPlatform(platform)
+
+        self.assertEqual(asyncio.run(async_platform.stdout_of(["echo", "hi"])), "hi")
+        self.assertEqual(asyncio.run(async_platform.quick_file_hashes(["/test/a.tst"])), {
+            "/test/a.tst": hashlib.sha256(b"a").hexdigest(),
+        })
+
+    def test_macos_platform_async_raw_stdout_of(self):
+        cmd = [sys.executable, "-c", "print('hello')"]
+        self.assertEqual(asyncio.run(pds.MacOSPlatform().async_raw_stdout_of(cmd)).strip(), b"hello")
+
     def test_sort_filenames(self):
         input = [
             'IMG_0001.JPG',
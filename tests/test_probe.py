@@ -0,0 +1,80 @@
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+from picdeduper import probe as pdprobe
+from picdeduper.indexstore import IndexStore
+
+from tests.helpers import add_file
+
+PROBE_PATH = "/c/picdedupe.pdprobe"
+
+
+class CollectionProbeTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.index_store = IndexStore(self.platform)
+        self.big_a = b"A" * 100000 + b"same middle" + b"Z" * 100000
+        self.big_b = b"A" * 100000 + b"diff middle" + b"Z" * 100000
+        self.big_c = b"B" * 100000 + b"same middle" + b"Z" * 100000
+        self.big_d = b"C" * 100000 + b"same middle" + b"Z" * 100000
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1")  # Unique size: no hash at all
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_a)  # Same partial hash as b: fully hashed
+        add_file(self.platform, self.index_store, "/c/IMG_0003.JPG", self.big_b)
+        add_file(self.platform, self.index_store, "/c/IMG_0004.JPG", self.big_c)  # Only a partial hash
+        self.probe = pdprobe.CollectionProbe.of(self.index_store)
+
+    def _may_have_dupe(self, probe: pdprobe.CollectionProbe, path: pds.Path, content: bytes):
+        self.platform.configure_binary_file(path, content)
+        candidate_properties = {pdc.KEY_FILE_SIZE: str(len(content))}
+        return probe.may_have_dupe(path, candidate_properties, self.platform), candidate_properties
+
+    def test_is_probe_path(self):
+        self.assertTrue(pdprobe.is_probe_path(PROBE_PATH))
+        self.assertFalse(pdprobe.is_probe_path("/c/picdedupe.json"))
+
+    def test_size_miss_needs_no_hash(self):
+        may_have_dupe, candidate_properties = self._may_have_dupe(self.probe, "/s/IMG_0001.JPG", b"333")
+
+        self.assertFalse(may_have_dupe)
+        self.assertFalse(pdc.KEY_FILE_PARTIAL_HASH in candidate_properties)
+        self.assertFalse(pdc.KEY_FILE_HASH in candidate_properties)
+
+    def test_same_size_as_unhashed_entry_may_be_dupe(self):
+        may_have_dupe, candidate_properties = self._may_have_dupe(self.probe, "/s/IMG_0001.JPG", b"9")
+
+        self.assertTrue(may_have_dupe)
+        self.assertFalse(pdc.KEY_FILE_HASH in candidate_properties)
+
+    def test_hashes_tell_when_sizes_collide(self):
+        self.assertTrue(self._may_have_dupe(self.probe, "/s/IMG_0002.JPG", self.big_a)[0])  # By full hash
+        self.assertTrue(self._may_have_dupe(self.probe, "/s/IMG_0004.JPG", self.big_c)[0])  # By partial hash
+        self.assertFalse(self._may_have_dupe(self.probe, "/s/IMG_0005.JPG", self.big_d)[0])
+
+    def test_mapped_probe(self):
+        self.probe.save(PROBE_PATH, self.platform)
+        saved = self.platform.binary_files[PROBE_PATH]
+
+        loaded = pdprobe.CollectionProbe.load(PROBE_PATH, self.platform)
+
+        self.assertEqual(loaded.entry_count, 4)
+        self.assertEqual(loaded.bloom_filter, self.probe.bloom_filter)
+        self.assertTrue(self._may_have_dupe(loaded, "/s/IMG_0002.JPG", self.big_a)[0])
+        self.assertFalse(self._may_have_dupe(loaded, "/s/IMG_0005.JPG", self.big_d)[0])
+
+        add_file(self.platform, self.index_store, "/c/IMG_0005.JPG", self.big_d)
+        loaded.add(self.index_store.known_image_properties("/c/IMG_0005.JPG"))
+
+        self.assertTrue(self._may_have_dupe(loaded, "/s/IMG_0005.JPG", self.big_d)[0])
+        self.assertEqual(self.platform.binary_files[PROBE_PATH], saved)  # Copied on write
+
+    def test_not_a_probe(self):
+        self.platform.write_binary_file("/c/picdedupe.pdidx", b"PDIDX\x00\x00\x02" + bytes(64))
+
+        with self.assertRaises(pdprobe.ProbeError):
+            pdprobe.CollectionProbe.load("/c/picdedupe.pdidx", self.platform)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import platform as pds
+from picdeduper import prune as pdprune
+from picdeduper import snapshot as pdsnap
+from picdeduper.indexstore import IndexStore
+from picdeduper.sqliteindexstore import SqliteIndexStore
+
+from tests.helpers import add_file
+
+
+class PruneTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.index_store = IndexStore(self.platform)
+        add_file(self.platform, self.index_store, "/c/2018/IMG_0001.JPG", b"1",
+                 **{pdc.KEY_FILE_HASH: "aa", pdc.KEY_IMAGE_DATE: "2018-01-01 00:00:00 +0000"})
+        add_file(self.platform, self.index_store, "/c/2019/IMG_0002.JPG", b"22",
+                 **{pdc.KEY_FILE_HASH: "bb", pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000",
+                    pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        add_file(self.platform, self.index_store, "/c/2019/IMG_0002.MOV", b"333", **{pdc.KEY_FILE_HASH: "cc"})
+        add_file(self.platform, self.index_store, "/c/2019/IMG_0003.JPG", b"4444",
+                 **{pdc.KEY_FILE_HASH: "dd", pdc.KEY_IMAGE_DATE: "2019-12-26 10:00:00 +0000"})
+        # Outside of the collection
+        add_file(self.platform, self.index_store, "/d/IMG_0002.JPG", b"55555", **{pdc.KEY_FILE_HASH: "ee"})
+        self.platform.configure_dir_entries("/c", ["2018", "2019"], dict())
+        self.platform.configure_dir_entries("/c/2018", [], {
+            "IMG_0001.JPG": pds.FileStat(1, 1000),
+            "notes.txt": pds.FileStat(5, 1000),
+        })
+        self.platform.configure_dir_entries("/c/2019", [], {
+            "IMG_0003.JPG": pds.FileStat(4, 4000),
+        })
+
+    def test_iter_stale_paths(self):
+        self.assertEqual(list(pdprune.iter_stale_paths(["/c/a", "/c/b", "/c/d", "/c/e"], ["/c/b", "/c/c", "/c/d"])),
+                         ["/c/a", "/c/e"])
+        self.assertEqual(list(pdprune.iter_stale_paths(["/c/a"], [])), ["/c/a"])
+        self.assertEqual(list(pdprune.iter_stale_paths([], ["/c/a"])), [])
+
+    def test_iter_existing_image_paths(self):
+        self.assertEqual(sorted(pdprune.iter_existing_image_paths(self.platform, "/c")),
+                         ["/c/2018/IMG_0001.JPG", "/c/2019/IMG_0003.JPG"])
+
+    def test_prune_index(self):
+        stale_paths = pdprune.prune_index(self.index_store, self.platform, "/c")
+
+        self.assertEqual(stale_paths, {"/c/2019/IMG_0002.JPG", "/c/2019/IMG_0002.MOV"})
+        data = self.index_store.data
+        self.assertEqual(set(data.by_path), {"/c/2018/IMG_0001.JPG", "/c/2019/IMG_0003.JPG", "/d/IMG_0002.JPG"})
+        self.assertEqual(self.index_store.paths_with_hash("bb"), set())
+        self.assertFalse("bb" in data.by_hash)
+        self.assertEqual(self.index_store.paths_with_core_filename("IMG_0002"), {"/d/IMG_0002.JPG"})
+        self.assertEqual(data.by_phash, dict())
+        self.assertEqual(self.index_store.paths_with_similar_phash("f0f0f0f0f0f0f0f0", max_distance=4), dict())
+        self.assertEqual(self.index_store.paths_with_size("3"), set())
+        self.assertEqual(self.index_store.image_date_range(),
+                         ("2018-01-01 00:00:00 +0000", "2019-12-26 10:00:00 +0000"))
+
+        all_series_paths = {file_group.main_path
+                            for file_series in self.index_store.file_series_splitter.all_file_series
+                            for file_group in file_series.file_groups}
+        self.assertEqual(all_series_paths, {"/c/2018/IMG_0001.JPG", "/c/2019/IMG_0003.JPG", "/d/IMG_0002.JPG"})
+
+    def test_empty_collection_does_not_get_pruned_unless_forced(self):
+        self.platform.configure_dir_entries("/c", [], dict())  # E.g. not mounted
+
+        self.assertEqual(pdprune.prune_index(self.index_store, self.platform, "/c"), set())
+        self.assertEqual(len(self.index_store), 5)
+
+        self.assertEqual(len(pdprune.prune_index(self.index_store, self.platform, "/c", force=True)), 4)
+        self.assertEqual(set(self.index_store.data.by_path), {"/d/IMG_0002.JPG"})
+
+    def test_pruned_index_survives_save_and_load(self):
+        pdprune.prune_index(self.index_store, self.platform, "/c")
+        self.index_store.save("/c/picdedupe.json")
+
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+
+        self.assertEqual(loaded.data, self.index_store.data)
+        self.assertFalse("/c/2019/IMG_0002.MOV" in self.platform.text_files["/c/picdedupe.json"])
+
+    def test_prune_other_index_stores(self):
+        sqlite_store = SqliteIndexStore(self.platform)
+        sqlite_store.import_index_store(self.index_store)
+        pdsnap.save_index(self.index_store, "/c/picdedupe.pdidx")
+        mapped_store = pdsnap.MappedIndexStore.load("/c/picdedupe.pdidx", self.platform)
+
+        for index_store in [sqlite_store, mapped_store]:
+            pdprune.prune_index(index_store, self.platform, "/c")
+
+            self.assertIsNone(index_store.known_image_properties("/c/2019/IMG_0002.JPG"))
+            self.assertEqual(index_store.paths_with_hash("bb"), set())
+            self.assertEqual(index_store.paths_with_core_filename("IMG_0002"), {"/d/IMG_0002.JPG"})
+            self.assertEqual(index_store.paths_with_similar_phash("f0f0f0f0f0f0f0f0", max_distance=4), dict())
+            self.assertEqual(len(index_store), 3)
+
+    def test_no_placeholder_records(self):
+        self.assertEqual(self.index_store.image_properties_for_path("/c/2019/IMG_0004.JPG"), dict())
+        self.assertFalse("/c/2019/IMG_0004.JPG" in self.index_store.data.by_path)
+
+        self.index_store.save("/c/picdedupe.json")
+        storage_dict = json.loads(self.platform.text_files["/c/picdedupe.json"])
+        storage_dict[pdc.KEY_BY_PATH]["/c/2019/IMG_0005.JPG"] = dict()  # As older versions left behind
+        self.platform.write_text_file("/c/older.json", json.dumps(storage_dict))
+
+        loaded = IndexStore.load("/c/older.json", self.platform)
+
+        self.assertIsNone(loaded.known_image_properties("/c/2019/IMG_0005.JPG"))
+        self.assertEqual(len(loaded), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
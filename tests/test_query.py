@@ -0,0 +1,133 @@
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import journal as pdj
+from picdeduper import platform as pds
+from picdeduper import query as pdquery
+from picdeduper import shardedindexstore as pdshard
+from picdeduper import snapshot as pdsnap
+from picdeduper import time as pdt
+from picdeduper.indexstore import IndexStore
+from picdeduper.sqliteindexstore import SqliteIndexStore
+from picdeduper.timeindex import ImageTimeIndex
+
+from tests.helpers import add_file
+
+MANIFEST_PATH = "/c/picdedupe.pdshards"
+
+
+class ImageTimeIndexTests(unittest.TestCase):
+
+    def test_add_remove_and_range(self):
+        time_index = ImageTimeIndex.of([(30.0, "/c/c"), (10.0, "/c/a")])
+        time_index.add(20.0, "/c/b")
+        time_index.add(20.0, "/c/b2")
+
+        self.assertEqual(time_index.paths_between(None, None), ["/c/a", "/c/b", "/c/b2", "/c/c"])
+        self.assertEqual(time_index.paths_between(20.0, 30.0), ["/c/b", "/c/b2", "/c/c"])
+        self.assertEqual(time_index.paths_between(11.0, 19.0), [])
+        self.assertEqual(time_index.entries_between(None, 10.0), [(10.0, "/c/a")])
+
+        time_index.remove(20.0, "/c/b2")
+        time_index.remove(20.0, "/c/nope")
+
+        self.assertEqual(time_index.paths_between(15.0, None), ["/c/b", "/c/c"])
+        self.assertEqual(len(time_index), 3)
+
+    def test_changes_get_merged_in_on_query(self):
+        time_index = ImageTimeIndex.of([(10.0, "/c/a"), (30.0, "/c/c")])
+        time_index.add(20.0, "/c/b")
+        time_index.remove(10.0, "/c/a")
+        time_index.add(10.0, "/c/a")
+        time_index.remove(30.0, "/c/c")
+
+        self.assertEqual(list(time_index.timestamps), [10.0, 30.0])  # Not yet
+        self.assertEqual(time_index.paths_between(None, None), ["/c/a", "/c/b"])
+        self.assertEqual(time_index.pending_adds, set())
+
+
+class QueryTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.index_store = IndexStore(self.platform)
+        self._add("/c/IMG_0001.JPG", b"aa", "2019-12-25 03:12:06 -0800", "Apple iPhone 11 Pro")
+        self._add("/c/IMG_0002.JPG", b"bb", "2019-12-25 12:00:00 +0100", "Canon EOS 5D Mark IV")
+        self._add("/c/IMG_0003.JPG", b"cc", "2019-12-26 10:00:00 +0000", "Apple iPhone 11 Pro")
+        self._add("/d/IMG_0001.HEIC", b"aa", "2018-01-01 00:00:00 +0000", "Apple iPhone 8")
+        self._add("/d/IMG_0004.PNG", b"dd", None, None)
+
+    def _add(self, path: pds.Path, content: bytes, image_date: str, creator: str):
+        """Indexes the file at `path`, with `content` as its hash too"""
+        add_file(self.platform, self.index_store, path, content, **{
+            pdc.KEY_FILE_HASH: content.decode(), pdc.KEY_IMAGE_DATE: image_date, pdc.KEY_IMAGE_CREATOR: creator})
+
+    def _paths(self, index_store, **filters):
+        return pdquery.IndexQuery(**filters).paths(index_store)
+
+    def test_time_bound(self):
+        self.assertEqual(pdquery.time_bound("2019-12-25", is_newest=False),
+                         pdt.timestamp_from_string("2019-12-25 00:00:00 +0000"))
+        self.assertEqual(pdquery.time_bound("2019-12-25", is_newest=True),
+                         pdt.timestamp_from_string("2019-12-25 23:59:59 +0000"))
+        self.assertEqual(pdquery.time_bound("2019-12-25 03:12:06 -0800", is_newest=False), 1577272326.0)
+        with self.assertRaises(ValueError):
+            pdquery.time_bound("25/12/2019", is_newest=False)
+
+    def test_adds_do_not_build_the_time_index(self):
+        self.assertFalse(self.index_store.data.is_decoded("by_image_time"))
+
+    def test_time_range_is_in_time_order(self):
+        paths = self.index_store.paths_with_image_time_between(pdquery.time_bound("2019-12-25", False), None)
+
+        # 11:00 UTC, then 11:12 UTC: not the order of the time strings
+        self.assertEqual(paths, ["/c/IMG_0002.JPG", "/c/IMG_0001.JPG", "/c/IMG_0003.JPG"])
+
+    def test_filters(self):
+        oldest, newest = pdquery.time_bound("2019-12-25", False), pdquery.time_bound("2019-12-25", True)
+
+        self.assertEqual(self._paths(self.index_store, oldest=oldest, newest=newest, creator="iphone"),
+                         ["/c/IMG_0001.JPG"])
+        self.assertEqual(self._paths(self.index_store, file_hash="aa"), ["/c/IMG_0001.JPG", "/d/IMG_0001.HEIC"])
+        self.assertEqual(self._paths(self.index_store, file_hash="aa", newest=oldest), ["/d/IMG_0001.HEIC"])
+        self.assertEqual(self._paths(self.index_store, core_filename="IMG_0001", creator="11 Pro"), ["/c/IMG_0001.JPG"])
+        self.assertEqual(self._paths(self.index_store, creator="canon"), ["/c/IMG_0002.JPG"])
+
+    def test_time_index_is_rebuilt_on_load_and_kept_up_to_date(self):
+        self.index_store.save("/c/picdedupe.json")
+        loaded = IndexStore.load("/c/picdedupe.json", self.platform)
+        self.index_store = loaded
+        self._add("/c/IMG_0005.JPG", b"ee", "2019-12-25 20:00:00 +0000", None)  # Before the time index is built
+
+        self.assertEqual(self._paths(loaded, oldest=pdquery.time_bound("2019-12-25", False)),
+                         ["/c/IMG_0002.JPG", "/c/IMG_0001.JPG", "/c/IMG_0005.JPG", "/c/IMG_0003.JPG"])
+
+        self._add("/c/IMG_0006.JPG", b"ff", "2019-12-26 20:00:00 +0000", None)  # After
+        self._add("/c/IMG_0005.JPG", b"ee", "2017-01-01 00:00:00 +0000", None)  # Changed
+        loaded.remove_paths({"/c/IMG_0003.JPG"})
+
+        self.assertEqual(self._paths(loaded, oldest=pdquery.time_bound("2019-12-25", False)),
+                         ["/c/IMG_0002.JPG", "/c/IMG_0001.JPG", "/c/IMG_0006.JPG"])
+
+    def test_other_index_stores(self):
+        sqlite_store = SqliteIndexStore(self.platform)
+        sqlite_store.import_index_store(self.index_store)
+        pdsnap.save_index(self.index_store, "/c/picdedupe.pdidx")
+        mapped_store = pdsnap.MappedIndexStore.load("/c/picdedupe.pdidx", self.platform)
+        self.platform.configure_path_exists(MANIFEST_PATH, False)
+        for shard in ["2018-01", "2019-12", pdshard.UNDATED_SHARD]:
+            self.platform.configure_path_exists(pdj.journal_path_of(pdshard.shard_path_of(MANIFEST_PATH, shard)), False)
+        pdsnap.save_index(self.index_store, MANIFEST_PATH)
+        sharded_store = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        oldest = pdquery.time_bound("2019-12-25", False)
+
+        for index_store in [sqlite_store, mapped_store, sharded_store]:
+            self.assertEqual(index_store.paths_with_image_time_between(oldest, None),
+                             ["/c/IMG_0002.JPG", "/c/IMG_0001.JPG", "/c/IMG_0003.JPG"])
+            self.assertEqual(index_store.paths_with_image_time_between(None, oldest), ["/d/IMG_0001.HEIC"])
+            self.assertEqual(self._paths(index_store, oldest=oldest, creator="iPhone"),
+                             ["/c/IMG_0001.JPG", "/c/IMG_0003.JPG"])
+
+
+if __name__ == '__main__':
+    unittest.main()
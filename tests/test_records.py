@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import jsonable
+from picdeduper import records as pdr
+
+PROPERTIES = {
+    pdc.KEY_FILE_DATE: "2019-12-25 03:12:06 +0000",
+    pdc.KEY_FILE_SIZE: "4772278",
+    pdc.KEY_FILE_MTIME_NS: "1577243526000000000",
+    pdc.KEY_FILE_HASH: "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+    pdc.KEY_FILE_CORE_NAME: "IMG_1234",
+    pdc.KEY_IMAGE_DATE: "2019-12-24 19:12:06 -0800",
+    pdc.KEY_IMAGE_RES: "3024x4032@24",
+    pdc.KEY_IMAGE_LOC: "<+37.33,-122.03>",
+    pdc.KEY_IMAGE_CREATOR: "Apple iPhone 11 Pro",
+    pdc.KEY_IMAGE_ANGLES: None,
+    pdc.KEY_IMAGE_PHASH: "00f0f0f0f0f0f0f1",
+}
+
+
+class ImageRecordTests(unittest.TestCase):
+
+    def test_reads_back_exactly_what_was_set(self):
+        record = pdr.ImageRecord(PROPERTIES)
+        self.assertEqual(dict(record), PROPERTIES)
+        self.assertEqual(record, PROPERTIES)
+        self.assertEqual(len(record), len(PROPERTIES))
+
+    def test_values_are_stored_compactly(self):
+        record = pdr.ImageRecord(PROPERTIES)
+        self.assertEqual(record.file_hash, bytes.fromhex(PROPERTIES[pdc.KEY_FILE_HASH]))
+        self.assertEqual(record.file_size, 4772278)
+        self.assertIsInstance(record.image_date, int)
+        self.assertIsInstance(record.image_phash, int)
+        self.assertIs(record.image_creator, pdr.ImageRecord(dict(PROPERTIES)).image_creator)
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def test_unexpected_forms_are_kept_as_is(self):
+        odd = {
+            pdc.KEY_FILE_HASH: "ABCDEF",            # upper case would not read back the same
+            pdc.KEY_FILE_SIZE: "0042",              # neither would the leading zeros
+            pdc.KEY_FILE_DATE: "2019:12:25 03:12:06",
+            pdc.KEY_IMAGE_PHASH: "xyz",
+            "some_future_key": "value",
+        }
+        record = pdr.ImageRecord(odd)
+        self.assertEqual(dict(record), odd)
+        self.assertEqual(record.file_hash, "ABCDEF")
+
+    def test_missing_is_not_none(self):
+        record = pdr.ImageRecord({pdc.KEY_FILE_HASH: None})
+        self.assertIn(pdc.KEY_FILE_HASH, record)
+        self.assertNotIn(pdc.KEY_FILE_PARTIAL_HASH, record)
+        self.assertIsNone(record.get(pdc.KEY_FILE_PARTIAL_HASH))
+        with self.assertRaises(KeyError):
+            record[pdc.KEY_FILE_PARTIAL_HASH]
+        del record[pdc.KEY_FILE_HASH]
+        self.assertEqual(len(record), 0)
+        with self.assertRaises(KeyError):
+            del record["some_future_key"]
+
+    def test_encodes_as_a_property_dict(self):
+        record = pdr.ImageRecord(PROPERTIES)
+        self.assertEqual(json.loads(json.dumps(jsonable.encode({"/c/IMG_1234.JPG": record}))),
+                         {"/c/IMG_1234.JPG": PROPERTIES})
+        self.assertIs(pdr.ImageRecord.of(record), record)
@@ -0,0 +1,143 @@
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import evaluation as pde
+from picdeduper import journal as pdj
+from picdeduper import platform as pds
+from picdeduper import shardedindexstore as pdshard
+from picdeduper import snapshot as pdsnap
+from picdeduper.indexstore import IndexStore
+
+from tests.helpers import add_file, image_properties
+
+MANIFEST_PATH = "/c/picdedupe.pdshards"
+
+
+class ShardedIndexStoreTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.platform.configure_path_exists(MANIFEST_PATH, False)
+        for shard in ["2018-01", "2019-12", pdshard.UNDATED_SHARD]:
+            shard_path = pdshard.shard_path_of(MANIFEST_PATH, shard)
+            self.platform.configure_path_exists(shard_path, False)
+            self.platform.configure_path_exists(pdj.journal_path_of(shard_path), False)
+        self.index_store = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        self.big_a = b"A" * 100000 + b"same middle" + b"Z" * 100000
+
+    def _add_collection(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a,
+                 **{pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000", pdc.KEY_IMAGE_RES: "3024x4032@24"})
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22",
+                 **{pdc.KEY_IMAGE_DATE: "2019-12-26 10:00:00 +0000"})
+        add_file(self.platform, self.index_store, "/d/IMG_0003.JPG", b"333",
+                 **{pdc.KEY_IMAGE_DATE: "2018-01-01 00:00:00 +0000"})
+        add_file(self.platform, self.index_store, "/d/IMG_0004.PNG", b"4444")
+        self.index_store.save(MANIFEST_PATH)
+        return pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+
+    def test_is_sharded_path(self):
+        self.assertTrue(pdshard.is_sharded_path(MANIFEST_PATH))
+        self.assertFalse(pdshard.is_sharded_path("/c/picdedupe.json"))
+
+    def test_shard_of_image_date(self):
+        self.assertEqual(pdshard.shard_of_image_date("2019-12-25 03:12:06 +0000"), "2019-12")
+        self.assertEqual(pdshard.shard_of_image_date(None), pdshard.UNDATED_SHARD)
+        self.assertEqual(pdshard.shard_path_of(MANIFEST_PATH, "2019-12"), "/c/picdedupe-2019-12.json")
+
+    def test_size_bucket(self):
+        self.assertEqual(pdshard.size_bucket(7), 7)
+        self.assertEqual(pdshard.size_bucket(3_800_000), pdshard.size_bucket(3_900_000))
+        self.assertNotEqual(pdshard.size_bucket(3_000_000), pdshard.size_bucket(3_900_000))
+
+    def test_adds_go_to_the_shard_of_their_month(self):
+        loaded = self._add_collection()
+        self.assertEqual(sorted(loaded.summaries), ["2018-01", "2019-12", pdshard.UNDATED_SHARD])
+        self.assertEqual(loaded.summaries["2019-12"].entry_count, 2)
+        self.assertEqual(loaded.image_date_range(), ("2018-01-01 00:00:00 +0000", "2019-12-26 10:00:00 +0000"))
+        self.assertEqual(len(loaded.shards), 0)
+        shard = IndexStore.load(pdshard.shard_path_of(MANIFEST_PATH, pdshard.UNDATED_SHARD), self.platform)
+        self.assertEqual(set(shard.data.by_path), {"/d/IMG_0004.PNG"})
+
+    def test_readd_with_another_date_moves_to_its_new_shard(self):
+        loaded = self._add_collection()
+        add_file(self.platform, loaded, "/d/IMG_0003.JPG", b"333", **{pdc.KEY_IMAGE_DATE: "2019-12-31 00:00:00 +0000"})
+        loaded.save(MANIFEST_PATH)
+        loaded = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+
+        self.assertEqual(loaded.summaries["2018-01"].entry_count, 0)
+        self.assertEqual(loaded.summaries["2019-12"].entry_count, 3)
+        self.assertEqual(loaded.paths_with_size("3"), {"/d/IMG_0003.JPG"})
+        self.assertEqual(loaded.known_image_properties("/d/IMG_0003.JPG")[pdc.KEY_IMAGE_DATE],
+                         "2019-12-31 00:00:00 +0000")
+
+    def test_lookups_only_load_the_shards_that_may_match(self):
+        loaded = self._add_collection()
+
+        self.assertEqual(loaded.known_image_properties("/d/IMG_0003.JPG")[pdc.KEY_FILE_SIZE], "3")
+        self.assertEqual(list(loaded.shards), ["2018-01"])
+        self.assertIsNone(loaded.known_image_properties("/d/IMG_9999.JPG"))
+
+        self.assertEqual(loaded.paths_with_size("2"), {"/c/IMG_0002.JPG"})
+        self.assertEqual(loaded.paths_with_core_filename("IMG_0004"), {"/d/IMG_0004.PNG"})
+        self.assertEqual(loaded.paths_with_core_filename("IMG_9999"), set())
+        self.assertEqual(set(loaded.shards), {"2018-01", "2019-12", pdshard.UNDATED_SHARD})
+
+    def test_evaluate(self):
+        loaded = self._add_collection()
+
+        candidate_path = "/i/IMG_0001 copy.JPG"
+        self.platform.configure_binary_file(candidate_path, self.big_a)
+        candidate_properties = {**image_properties(candidate_path, len(self.big_a)),
+                                pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000", pdc.KEY_IMAGE_RES: "3024x4032@24"}
+        loaded.stop_persisting()
+        result = pde.evaluate(candidate_path, candidate_properties, loaded)
+
+        self.assertEqual(result.paths_with_same_hash(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(result.paths_with_same_core_filename(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(result.paths_with_same_image_properties(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(list(loaded.shards), ["2019-12"])
+
+    def test_crashed_run_gets_replayed(self):
+        self._add_collection()
+        index_store = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        self.platform.configure_binary_file("/c/IMG_0005.JPG", b"55555")
+        index_store.add("/c/IMG_0005.JPG", {**image_properties("/c/IMG_0005.JPG", 5),
+                                            pdc.KEY_IMAGE_DATE: "2019-12-31 23:59:59 +0000"})
+        index_store.commit()
+        # ... and crash
+
+        recovered = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        self.assertEqual(recovered.summaries["2019-12"].entry_count, 3)
+        recovered.shards.clear()
+        self.assertEqual(recovered.paths_with_size("5"), {"/c/IMG_0005.JPG"})
+
+    def test_read_only_load_replays_in_memory(self):
+        self._add_collection()
+        index_store = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        add_file(self.platform, index_store, "/c/IMG_0005.JPG", b"55555",
+                 **{pdc.KEY_IMAGE_DATE: "2019-12-31 23:59:59 +0000"})
+        index_store.commit()
+        # ... and crash
+        manifest_text = self.platform.text_files[MANIFEST_PATH]
+        journal_path = pdj.journal_path_of(pdshard.shard_path_of(MANIFEST_PATH, "2019-12"))
+        journal_text = self.platform.text_files[journal_path]
+
+        read_only = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform, read_only=True)
+        self.assertEqual(read_only.summaries["2019-12"].entry_count, 3)
+        read_only.shards.clear()
+        self.assertEqual(read_only.paths_with_size("5"), {"/c/IMG_0005.JPG"})
+        self.assertEqual(self.platform.text_files[MANIFEST_PATH], manifest_text)
+        self.assertEqual(self.platform.text_files[journal_path], journal_text)
+
+    def test_converts_both_ways(self):
+        json_store = IndexStore(self.platform)
+        self.platform.configure_binary_file("/c/IMG_0001.JPG", b"1")
+        json_store.add("/c/IMG_0001.JPG", {**image_properties("/c/IMG_0001.JPG", 1),
+                                           pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"})
+        pdsnap.save_index(json_store, MANIFEST_PATH)
+
+        loaded = pdshard.ShardedIndexStore.load(MANIFEST_PATH, self.platform)
+        self.assertEqual(dict(loaded.all_image_properties()), json_store.data.by_path)
+        pdsnap.save_index(loaded, "/c/converted.json")
+        self.assertEqual(IndexStore.load("/c/converted.json", self.platform).data, json_store.data)
@@ -0,0 +1,60 @@
+import random
+import unittest
+
+from picdeduper import similarity as pdsim
+
+
+class SimilarityTests(unittest.TestCase):
+
+    def test_hamming_distance(self):
+        self.assertEqual(pdsim.hamming_distance(0, 0), 0)
+        self.assertEqual(pdsim.hamming_distance(0b1011, 0b0001), 2)
+        self.assertEqual(pdsim.hamming_distance(0, 2 ** 64 - 1), 64)
+
+    def test_phash_string(self):
+        self.assertEqual(pdsim.phash_string(0xabc), "0000000000000abc")
+        self.assertEqual(pdsim.phash_from_string("0000000000000abc"), 0xabc)
+
+    def test_dhash_of_grayscale(self):
+        gradient = [255 - x for y in range(16) for x in range(18)]
+        self.assertEqual(pdsim.dhash_of_grayscale(gradient, 18, 16), 2 ** 64 - 1)
+        flat = [128] * (32 * 32)
+        self.assertEqual(pdsim.dhash_of_grayscale(flat, 32, 32), 0)
+
+    def test_dhash_is_stable_across_sizes(self):
+        def image(width, height):
+            return [int(255 * ((x / width - 0.3) ** 2 + (y / height - 0.6) ** 2))
+                    for y in range(height) for x in range(width)]
+
+        small = pdsim.dhash_of_grayscale(image(90, 80), 90, 80)
+        big = pdsim.dhash_of_grayscale(image(900, 800), 900, 800)
+        self.assertLessEqual(pdsim.hamming_distance(small, big), 4)
+
+    def test_dhash_of_grayscale_rejects_bad_sizes(self):
+        with self.assertRaises(ValueError):
+            pdsim.dhash_of_grayscale([1, 2, 3], 2, 2)
+
+    def test_hamming_index_matches_a_scan(self):
+        rng = random.Random(42)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+        # A few near dupes of the first value:
+        values += [values[0] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for _ in range(10)]
+        index = pdsim.HammingIndex()
+        for value in values:
+            index.add(value)
+
+        for query in values[:50]:
+            for max_distance in (0, 3, 8, 12):
+                expected = {v: pdsim.hamming_distance(query, v) for v in values
+                            if pdsim.hamming_distance(query, v) <= max_distance}
+                self.assertEqual(index.within(query, max_distance), expected)
+
+    def test_hamming_index_remove(self):
+        index = pdsim.HammingIndex()
+        index.add(0b1)
+        index.add(0b11)
+        index.remove(0b1)
+        self.assertEqual(len(index), 1)
+        self.assertNotIn(0b1, index)
+        self.assertEqual(index.within(0b1, 1), {0b11: 1})
+        self.assertEqual(index.tables[0], {0b11: {0b11}})
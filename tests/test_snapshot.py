@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import evaluation as pde
+from picdeduper import platform as pds
+from picdeduper import snapshot as pdsnap
+from picdeduper.indexstore import IndexStore
+
+from tests.helpers import add_file, image_properties
+
+
+class SnapshotTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.json_store = IndexStore(self.platform)
+        self.big_a = b"A" * 100000 + b"same middle" + b"Z" * 100000
+        self.big_b = b"A" * 100000 + b"diff middle" + b"Z" * 100000
+        add_file(self.platform, self.json_store, "/c/IMG_0001.JPG", self.big_a,
+                 **{pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000", pdc.KEY_IMAGE_RES: "3024x4032@24"})
+        add_file(self.platform, self.json_store, "/c/IMG_0002.JPG", self.big_b,
+                 **{pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        add_file(self.platform, self.json_store, "/d/IMG_0001.HEIC", b"1",
+                 **{pdc.KEY_IMAGE_DATE: "2018-01-01 00:00:00 +0000"})
+        self.json_store.save("/c/picdedupe.json")
+        pdsnap.save_index(self.json_store, "/c/picdedupe.pdidx")
+        self.mapped_store = pdsnap.MappedIndexStore.load("/c/picdedupe.pdidx", self.platform)
+
+    def test_is_snapshot_path(self):
+        self.assertTrue(pdsnap.is_snapshot_path("/c/picdedupe.pdidx"))
+        self.assertFalse(pdsnap.is_snapshot_path("/c/picdedupe.json"))
+
+    def test_lookups(self):
+        hash_a = hashlib.sha256(self.big_a).hexdigest()
+        self.assertEqual(self.mapped_store.paths_with_hash(hash_a), {"/c/IMG_0001.JPG"})
+        self.assertEqual(self.mapped_store.paths_with_hash("00" * 32), set())
+        self.assertEqual(self.mapped_store.paths_with_hash("not hex"), set())
+        self.assertEqual(self.mapped_store.paths_with_core_filename("IMG_0001"),
+                         {"/c/IMG_0001.JPG", "/d/IMG_0001.HEIC"})
+        self.assertEqual(self.mapped_store.paths_with_size(str(len(self.big_a))),
+                         {"/c/IMG_0001.JPG", "/c/IMG_0002.JPG"})
+        self.assertEqual(self.mapped_store.paths_with_similar_phash("f0f0f0f0f0f0f0f1", 4), {"/c/IMG_0002.JPG": 1})
+        self.assertEqual(self.mapped_store.image_date_range(), self.json_store.image_date_range())
+        self.assertEqual(self.mapped_store.known_image_properties("/c/IMG_0001.JPG"),
+                         self.json_store.known_image_properties("/c/IMG_0001.JPG"))
+        image_properties = self.json_store.known_image_properties("/c/IMG_0001.JPG")
+        self.assertEqual(self.mapped_store.paths_with_image_properties(image_properties), {"/c/IMG_0001.JPG"})
+        image_properties = self.json_store.known_image_properties("/d/IMG_0001.HEIC")
+        self.assertEqual(self.mapped_store.paths_with_image_properties(image_properties), set())  # No resolution
+        self.assertIsNone(self.mapped_store.known_image_properties("/c/IMG_0000.JPG"))
+        self.assertIsNone(self.mapped_store.known_image_properties("/z/IMG_0000.JPG"))
+
+    def test_converts_both_ways(self):
+        self.mapped_store.save("/c/converted.json")
+        converted = IndexStore.load("/c/converted.json", self.platform)
+        self.assertEqual(converted.data, self.json_store.data)
+
+        pdsnap.save_index(converted, "/c/converted.pdidx")
+        self.assertEqual(self.platform.binary_files["/c/converted.pdidx"],
+                         self.platform.binary_files["/c/picdedupe.pdidx"])
+
+    def test_adds_and_backfills_go_to_the_overlay(self):
+        candidate_path = "/i/IMG_0001 copy.HEIC"
+        self.platform.configure_binary_file(candidate_path, b"2")
+        candidate_properties = image_properties(candidate_path, 1)
+        result = pde.evaluate(candidate_path, candidate_properties, self.mapped_store)
+
+        self.assertEqual(result.paths_with_same_hash(), set())
+        self.assertEqual(result.paths_with_same_core_filename(), {"/c/IMG_0001.JPG", "/d/IMG_0001.HEIC"})
+        backfilled_hash = self.mapped_store.known_image_properties("/d/IMG_0001.HEIC")[pdc.KEY_FILE_PARTIAL_HASH]
+        self.assertEqual(backfilled_hash, self.platform.partial_file_hash("/d/IMG_0001.HEIC"))
+        self.assertEqual(self.mapped_store.paths_with_partial_hash(backfilled_hash), {"/d/IMG_0001.HEIC"})
+
+        self.mapped_store.add(candidate_path, candidate_properties)
+        self.assertEqual(len(list(self.mapped_store.all_image_properties())), 4)
+        self.assertEqual(self.mapped_store.paths_with_size("1"), {"/d/IMG_0001.HEIC", candidate_path})
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(pdsnap.SnapshotError):
+            pdsnap.IndexSnapshot(memoryview(b"PDIDX"))
+        with self.assertRaises(pdsnap.SnapshotError):
+            pdsnap.IndexSnapshot(memoryview(b"X" * 1000))
+        with self.assertRaises(pdsnap.SnapshotError):
+            pdsnap.snapshot_bytes_of([("/c/IMG_0001.JPG", {pdc.KEY_FILE_HASH: "xyz"})],
+                                     self.json_store.image_date_range())
+
+    def test_maps_a_real_file(self):
+        platform = pds.MacOSPlatform()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "picdedupe.pdidx")
+            platform.write_binary_file(path, self.platform.binary_files["/c/picdedupe.pdidx"])
+            mapped_store = pdsnap.MappedIndexStore.load(path, platform)
+            self.assertEqual(mapped_store.paths_with_core_filename("IMG_0002"), {"/c/IMG_0002.JPG"})
+            mapped_store.snapshot.buffer.release()
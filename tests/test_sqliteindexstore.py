@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from picdeduper import common as pdc
+from picdeduper import evaluation as pde
+from picdeduper import platform as pds
+from picdeduper.indexstore import IndexStore
+from picdeduper.sqliteindexstore import SqliteIndexStore, is_sqlite_path
+
+from tests.helpers import add_file, image_properties
+
+
+class SqliteIndexStoreTests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.platform = pds.FakePlatform()
+        self.index_store = SqliteIndexStore(self.platform)
+        self.big_a = b"A" * 100000 + b"same middle" + b"Z" * 100000
+        self.big_b = b"A" * 100000 + b"diff middle" + b"Z" * 100000
+
+    def tearDown(self) -> None:
+        self.index_store.close()
+
+    def test_is_sqlite_path(self):
+        self.assertTrue(is_sqlite_path("/c/picdedupe.sqlite"))
+        self.assertTrue(is_sqlite_path("/c/picdedupe.DB"))
+        self.assertFalse(is_sqlite_path("/c/picdedupe.json"))
+
+    def test_lookups(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1",
+                 **{pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"})
+        add_file(self.platform, self.index_store, "/d/IMG_0001.HEIC", b"22",
+                 **{pdc.KEY_IMAGE_DATE: "2018-01-01 00:00:00 +0000"})
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"33")
+
+        self.assertEqual(self.index_store.paths_with_core_filename("IMG_0001"), {"/c/IMG_0001.JPG", "/d/IMG_0001.HEIC"})
+        self.assertEqual(self.index_store.paths_with_size("2"), {"/d/IMG_0001.HEIC", "/c/IMG_0002.JPG"})
+        self.assertEqual(self.index_store.image_date_range(),
+                         ("2018-01-01 00:00:00 +0000", "2019-12-25 03:12:06 +0000"))
+        self.assertEqual(self.index_store.image_properties_for_path("/c/IMG_0001.JPG")[pdc.KEY_FILE_SIZE], "1")
+        self.assertEqual(self.index_store.image_properties_for_path("/c/IMG_9999.JPG"), dict())
+        self.assertIsNone(self.index_store.known_image_properties("/c/IMG_9999.JPG"))
+        self.assertEqual(len(self.index_store), 3)
+
+    def test_update_known_image_properties(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1")
+        self.index_store.update_known_image_properties("/c/IMG_0001.JPG", {pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        self.assertEqual(self.index_store.known_image_properties("/c/IMG_0001.JPG")[pdc.KEY_IMAGE_PHASH],
+                         "f0f0f0f0f0f0f0f0")
+
+        for index_store in [self.index_store, IndexStore(self.platform)]:
+            with self.assertRaises(KeyError):
+                index_store.update_known_image_properties("/c/IMG_9999.JPG", {pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        self.assertIsNone(self.index_store.known_image_properties("/c/IMG_9999.JPG"))
+
+    def test_same_partial_hash_gets_fully_hashed_and_backfilled(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", self.big_b)
+
+        hash_a = hashlib.sha256(self.big_a).hexdigest()
+        self.assertEqual(self.index_store.paths_with_hash(hash_a), {"/c/IMG_0001.JPG"})
+        self.assertEqual(self.index_store.image_properties_for_path("/c/IMG_0001.JPG")[pdc.KEY_FILE_HASH], hash_a)
+        partial_hash = self.index_store.image_properties_for_path("/c/IMG_0001.JPG")[pdc.KEY_FILE_PARTIAL_HASH]
+        self.assertEqual(self.index_store.paths_with_partial_hash(partial_hash), {"/c/IMG_0001.JPG", "/c/IMG_0002.JPG"})
+
+    def test_evaluate(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", self.big_a,
+                 **{pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"unrelated")
+
+        candidate_path = "/i/IMG_0001 copy.JPG"
+        self.platform.configure_binary_file(candidate_path, self.big_a)
+        candidate_properties = {**image_properties(candidate_path, len(self.big_a)),
+                                pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f1"}
+        result = pde.evaluate(candidate_path, candidate_properties, self.index_store)
+
+        self.assertEqual(result.paths_with_same_hash(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(result.paths_with_same_core_filename(), {"/c/IMG_0001.JPG"})
+        self.assertEqual(result.paths_with_similar_image(), set())  # Exact dupes are not "similar"
+
+    def test_similar_phash_index_follows_adds(self):
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1", **{pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f0"})
+        self.assertEqual(self.index_store.paths_with_similar_phash("f0f0f0f0f0f0f0f1", 4), {"/c/IMG_0001.JPG": 1})
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22", **{pdc.KEY_IMAGE_PHASH: "f0f0f0f0f0f0f0f3"})
+        self.assertEqual(self.index_store.paths_with_similar_phash("f0f0f0f0f0f0f0f1", 4), {
+            "/c/IMG_0001.JPG": 1,
+            "/c/IMG_0002.JPG": 1,
+        })
+
+    def test_import_json(self):
+        json_store = IndexStore(self.platform)
+        for path, content in [("/c/IMG_0001.JPG", self.big_a), ("/c/IMG_0002.JPG", self.big_b)]:
+            self.platform.configure_binary_file(path, content)
+            json_store.add(path, image_properties(path, len(content)))
+        json_store.save("/c/picdedupe.json")
+
+        self.assertEqual(self.index_store.import_json("/c/picdedupe.json"), 2)
+
+        self.assertEqual(dict(self.index_store.all_image_properties()), json_store.data.by_path)
+        self.assertEqual(self.index_store.image_date_range(), json_store.image_date_range())
+
+    def test_image_properties_lookup(self):
+        same_image = {pdc.KEY_IMAGE_RES: "3024x4032@24", pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"}
+        add_file(self.platform, self.index_store, "/c/IMG_0001.JPG", b"1", **same_image)
+        add_file(self.platform, self.index_store, "/c/IMG_0002.JPG", b"22")
+
+        self.assertEqual(self.index_store.paths_with_image_properties(same_image), {"/c/IMG_0001.JPG"})
+        self.assertEqual(self.index_store.paths_with_image_properties(image_properties("/i/IMG_0002.JPG", 2)), set())
+
+    def test_upgrades_older_databases(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, "picdedupe.sqlite")
+            index_store = SqliteIndexStore(self.platform, db_path)
+            same_image = {pdc.KEY_IMAGE_RES: "3024x4032@24", pdc.KEY_IMAGE_DATE: "2019-12-25 03:12:06 +0000"}
+            self.platform.configure_binary_file("/c/IMG_0001.JPG", b"1")
+            index_store.add("/c/IMG_0001.JPG", {**image_properties("/c/IMG_0001.JPG", 1), **same_image})
+            index_store.connection.execute("DROP INDEX images_by_image_key")
+            index_store.connection.execute("ALTER TABLE images DROP COLUMN image_key")
+            index_store.commit()
+            index_store.close()
+
+            reopened = SqliteIndexStore(self.platform, db_path)
+            self.assertEqual(reopened.paths_with_image_properties(same_image), {"/c/IMG_0001.JPG"})
+            reopened.close()
+
+    def test_commits_survive_reopening(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, "picdedupe.sqlite")
+            index_store = SqliteIndexStore(self.platform, db_path)
+            self.platform.configure_binary_file("/c/IMG_0001.JPG", b"1")
+            index_store.add("/c/IMG_0001.JPG", image_properties("/c/IMG_0001.JPG", 1))
+            index_store.commit()
+
+            reopened = SqliteIndexStore(self.platform, db_path)
+            self.assertEqual(reopened.paths_with_core_filename("IMG_0001"), {"/c/IMG_0001.JPG"})
+            self.assertEqual(reopened.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            reopened.close()
+            index_store.close()
+
+    def test_candidates_do_not_get_persisted(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, "picdedupe.sqlite")
+            index_store = SqliteIndexStore(self.platform, db_path)
+            index_store.stop_persisting()
+            self.platform.configure_binary_file("/i/IMG_0001.JPG", b"1")
+            index_store.add("/i/IMG_0001.JPG", image_properties("/i/IMG_0001.JPG", 1))
+            index_store.commit()
+            index_store.close()
+
+            reopened = SqliteIndexStore(self.platform, db_path)
+            self.assertEqual(len(reopened), 0)
+            reopened.close()
@@ -21,6 +21,14 @@ class TimeTests(unittest.TestCase):
         self.assertEqual(ts1 - ts2, 3600)
         self.assertEqual(ts1, ts3)
 
+    def test_timestamp_for_string_same_as_datetime(self):
+        for time_string in ["2019-06-30 23:17:38 +0200", "1969-12-31 23:59:59 -1130", "2020-02-29 00:00:00 +1400"]:
+            self.assertEqual(pdt.timestamp_from_string(time_string), pdt.datetime_from_string(time_string).timestamp())
+        for time_string in ["2019-02-29 23:17:38 +0200", "2019-06-30 24:17:38 +0200", "2019-06-30T23:17:38+0200"]:
+            with self.assertRaises(ValueError):
+                pdt.timestamp_from_string(time_string)
+        self.assertIsNone(pdt.timestamp_from_string(None))
+
     def test_string_for_timestamp(self):
         self.assertEqual(pdt.string_from_timestamp(1561929458), "2019-06-30 21:17:38 +0000")
 